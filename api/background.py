@@ -0,0 +1,42 @@
+"""
+🧵 Фоновые задачи процесса
+Голый create_task без ссылки может собрать GC, а при остановке сервера задача
+обрывается на полуслове. spawn() держит ссылку, drain() при остановке ждёт
+незавершённые (не дольше таймаута): дописываются очередь CRM, грязные сессии,
+обновление меню и прогрев. На Vercel инстанс просто замораживается — там
+drain() не вызывается, и поведение прежнее.
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_tasks = set()
+
+
+def spawn(coro, name=None):
+    """create_task, который переживёт GC и дождётся остановки сервера"""
+    task = asyncio.get_running_loop().create_task(coro, name=name)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+def pending():
+    return sum(1 for t in _tasks if not t.done())
+
+
+async def drain(timeout):
+    """Ждёт фоновые задачи до timeout секунд, остальные отменяет → сколько отменено"""
+    current = asyncio.current_task()
+    waiting = {t for t in _tasks if not t.done() and t is not current}
+    if not waiting:
+        return 0
+    logger.info("Draining %s background tasks", len(waiting))
+    _, left = await asyncio.wait(waiting, timeout=timeout)
+    for t in left:
+        t.cancel()
+    if left:
+        logger.warning("Cancelled %s background tasks after %ss", len(left), timeout)
+    return len(left)
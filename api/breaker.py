@@ -0,0 +1,151 @@
+"""
+🔌 Автоматы (circuit breakers) для внешних зависимостей
+Redis, Graph API, CRM и Telegram завёрнуты в Breaker: если среди последних
+BREAKER_WINDOW_CALLS вызовов (не старше BREAKER_WINDOW секунд) доля ошибок
+(исключения и таймауты) не меньше BREAKER_FAILURE_RATE при хотя бы
+BREAKER_MIN_CALLS вызовах — автомат размыкается, и BREAKER_COOLDOWN секунд
+вызовы сразу получают CircuitOpen (вызывающий код решает, что делать: отдать
+сессию из памяти, поставить заказ в очередь, пропустить уведомление). Затем
+один пробный вызов (half-open): успех замыкает автомат, ошибка — снова размыкает.
+Состояния видны в /health.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+try:
+    from .config import (
+        BREAKER_FAILURE_RATE, BREAKER_MIN_CALLS, BREAKER_WINDOW, BREAKER_WINDOW_CALLS, BREAKER_COOLDOWN,
+    )
+except ImportError:
+    from config import (
+        BREAKER_FAILURE_RATE, BREAKER_MIN_CALLS, BREAKER_WINDOW, BREAKER_WINDOW_CALLS, BREAKER_COOLDOWN,
+    )
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name):
+        super().__init__(f"circuit {name} is open")
+        self.name = name
+
+
+class Breaker:
+    def __init__(self, name, timeout=None, failure_rate=BREAKER_FAILURE_RATE,
+                 min_calls=BREAKER_MIN_CALLS, window=BREAKER_WINDOW, window_calls=BREAKER_WINDOW_CALLS,
+                 cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.timeout = timeout
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self.state = CLOSED
+        # (время, ok) последних window_calls вызовов: при большом потоке старые
+        # успехи не размывают долю ошибок, и автомат реагирует за несколько вызовов
+        self._calls = deque(maxlen=window_calls)
+        self._opened_at = 0.0
+        self._probing = False
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    # ------------------------------------------
+    # состояние
+    # ------------------------------------------
+
+    def _trim(self, now):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def allow(self):
+        """Можно ли звать зависимость сейчас (в half-open — только одному пробному вызову)"""
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self.state = HALF_OPEN
+            logger.info("Circuit %s half-open, probing", self.name)
+        if self.state == HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def record(self, ok):
+        now = time.monotonic()
+        self.stats["calls"] += 1
+        if not ok:
+            self.stats["failures"] += 1
+        if self.state == HALF_OPEN:
+            self._probing = False
+            if ok:
+                self.state = CLOSED
+                self._calls.clear()
+                logger.warning("Circuit %s closed", self.name)
+            else:
+                self._open(now)
+            return
+        self._calls.append((now, ok))
+        self._trim(now)
+        failed = sum(1 for _, good in self._calls if not good)
+        if (self.state == CLOSED and len(self._calls) >= self.min_calls
+                and failed / len(self._calls) >= self.failure_rate):
+            self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self.stats["opened"] += 1
+        logger.error("Circuit %s open for %ss", self.name, self.cooldown)
+
+    # ------------------------------------------
+    # вызов
+    # ------------------------------------------
+
+    async def call(self, fn, *args, is_failure=None, **kwargs):
+        """await fn(*args, **kwargs) под автоматом. is_failure(result) — если
+        зависимость сообщает об ошибке результатом, а не исключением"""
+        if not self.allow():
+            self.stats["rejected"] += 1
+            raise CircuitOpen(self.name)
+        try:
+            if self.timeout:
+                result = await asyncio.wait_for(fn(*args, **kwargs), self.timeout)
+            else:
+                result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            if self.state == HALF_OPEN:
+                self._probing = False
+            raise
+        except Exception:
+            self.record(False)
+            raise
+        self.record(not (is_failure and is_failure(result)))
+        return result
+
+    def describe(self):
+        now = time.monotonic()
+        self._trim(now)
+        info = {"state": self.state, "recent_calls": len(self._calls),
+                "recent_failures": sum(1 for _, ok in self._calls if not ok), **self.stats}
+        if self.state == OPEN:
+            info["retry_in"] = round(max(0.0, self.cooldown - (now - self._opened_at)), 1)
+        return info
+
+
+BREAKERS = {}
+
+
+def breaker(name, timeout=None):
+    """Общий автомат на процесс по имени (создаётся при первом обращении)"""
+    b = BREAKERS.get(name)
+    if b is None:
+        b = BREAKERS[name] = Breaker(name, timeout=timeout)
+    return b
+
+
+def describe_all():
+    return {name: b.describe() for name, b in sorted(BREAKERS.items())}
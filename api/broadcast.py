@@ -0,0 +1,325 @@
+"""
+📣 Рассылки по базе контактов
+Задание живёт в Redis (хэш broadcast:{id}) и идёт с одного бизнес-номера
+(поле number, по умолчанию основной): контакты перебираются SSCAN по contacts:all
+этого номера, курсор сохраняется после каждой страницы — прерванная рассылка
+продолжается с того же места. Итог по каждому номеру — один символ в хэше
+broadcast:{id}:r (s — отправлено, o — отписан, f<код> — ошибка Graph) пишется
+сразу после его отправки, поэтому повторный прогон страницы, оборванной
+посередине, не пишет дважды уже отправленным (повтор возможен только для
+запросов, которые были в полёте в момент обрыва, — не больше concurrency).
+Отправка — через номер (wa_numbers.Number.post: его токен, пул, темп и автомат),
+не чаще rate сообщений в секунду и не больше concurrency запросов одновременно.
+Разомкнутый автомат номера — не ошибка получателя: итог не пишется, курсор
+остаётся на текущей странице, задание встаёт на паузу с resume_at (конец
+остывания автомата), и воркер продолжает его после этого момента.
+Запуск — broadcast.py (CLI / воркер).
+"""
+
+import asyncio
+import json
+import logging
+import secrets
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+try:
+    from .config import BROADCAST_RATE, BROADCAST_CONCURRENCY
+    from .breaker import CircuitOpen, OPEN
+    from .storage import contacts_key, contact_key
+except ImportError:
+    from config import BROADCAST_RATE, BROADCAST_CONCURRENCY
+    from breaker import CircuitOpen, OPEN
+    from storage import contacts_key, contact_key
+
+logger = logging.getLogger(__name__)
+
+OPTOUT_KEY = "optout"
+QUEUE_KEY = "broadcast:queue"
+JOB_TTL = 86400 * 30
+# Graph: превышен темп / пара «отправитель-получатель» — стоит подождать и повторить
+RETRY_CODES = {4, 80007, 130429, 131056}
+COUNTERS = ("matched", "sent", "failed", "optout")
+# Не отправлено: автомат номера разомкнут — получатель остаётся на следующий прогон
+NOT_SENT = "open"
+
+
+def _job_key(job_id):
+    return f"broadcast:{job_id}"
+
+
+def resolve_number(ref=""):
+    """Номер из реестра по phone_id или имени; пусто — основной"""
+    # wa_numbers сам импортирует отсюда RateLimiter — импорт по месту
+    try:
+        from .wa_numbers import NUMBERS, PRIMARY
+    except ImportError:
+        from wa_numbers import NUMBERS, PRIMARY
+    if not ref:
+        return PRIMARY
+    for number in NUMBERS.values():
+        if str(ref) in (number.phone_id, number.name):
+            return number
+    raise ValueError(f"unknown number: {ref} (есть: {', '.join(n.name for n in NUMBERS.values())})")
+
+
+# ------------------------------------------
+# сегменты и сообщения
+# ------------------------------------------
+
+def parse_segment(spec):
+    """"all" | "active:30" (писали за 30 дней) | "min_msgs:5", условия через запятую"""
+    checks = []
+    for part in filter(None, (p.strip() for p in (spec or "all").split(","))):
+        name, _, arg = part.partition(":")
+        if name == "all":
+            continue
+        if name == "active":
+            since = (datetime.now() - timedelta(days=int(arg))).isoformat()
+            checks.append(lambda c, since=since: c.get("last_seen", "") >= since)
+        elif name == "min_msgs":
+            checks.append(lambda c, n=int(arg): int(c.get("msg_count", 0)) >= n)
+        else:
+            raise ValueError(f"unknown segment: {part}")
+    return checks
+
+
+def validate_message(message):
+    kind = message.get("type")
+    if kind == "text" and message.get("text"):
+        return
+    if kind == "template" and message.get("name"):
+        return
+    raise ValueError('message must be {"type": "text", "text": ...} or {"type": "template", "name": ...}')
+
+
+def build_payload(message, phone):
+    """Тело запроса Graph API для одного получателя"""
+    payload = {"messaging_product": "whatsapp", "to": phone}
+    if message["type"] == "text":
+        payload.update(type="text", text={"body": message["text"]})
+    else:
+        template = {"name": message["name"], "language": {"code": message.get("language", "ru")}}
+        if message.get("components"):
+            template["components"] = message["components"]
+        payload.update(type="template", template=template)
+    return payload
+
+
+class RateLimiter:
+    """Равномерный темп: слоты через 1/rate секунды, общие для всех воркеров"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+# ------------------------------------------
+# задания
+# ------------------------------------------
+
+async def create_job(store, message, segment="all", rate=None, concurrency=None, enqueue=False, number=""):
+    validate_message(message)
+    parse_segment(segment)
+    number = resolve_number(number)
+    job_id = f"{datetime.now():%Y%m%d%H%M%S}-{secrets.token_hex(2)}"
+    key = _job_key(job_id)
+    cmds = [
+        ["HSET", key, "status", "new", "message", json.dumps(message, ensure_ascii=False),
+         "segment", segment, "number", number.phone_id, "rate", rate or BROADCAST_RATE,
+         "concurrency", concurrency or BROADCAST_CONCURRENCY,
+         "cursor", 0, "created_at", datetime.now().isoformat(),
+         *[x for c in COUNTERS for x in (c, 0)]],
+        ["EXPIRE", key, JOB_TTL],
+    ]
+    if enqueue:
+        cmds.append(["LPUSH", QUEUE_KEY, job_id])
+    await store.pipeline(cmds)
+    return job_id
+
+
+async def job_status(store, job_id):
+    job = await store.execute("HGETALL", _job_key(job_id))
+    if not job:
+        return None
+    job = dict(job)
+    for c in COUNTERS + ("cursor", "concurrency"):
+        job[c] = int(job.get(c, 0))
+    job["rate"] = float(job.get("rate", 0))
+    job["resume_at"] = float(job.get("resume_at") or 0)
+    job["message"] = json.loads(job.get("message", "{}"))
+    job["id"] = job_id
+    return job
+
+
+async def job_outcomes(store, job_id):
+    """{phone: код} — s, o, f<код ошибки>"""
+    return await store.execute("HGETALL", f"{_job_key(job_id)}:r")
+
+
+async def set_optout(store, phone, opted_out=True):
+    await store.execute("SADD" if opted_out else "SREM", OPTOUT_KEY, phone)
+
+
+async def _send(number, payload, attempts=3):
+    """Код итога: "s", "f<код>" или NOT_SENT — автомат номера разомкнут (до запроса
+    или этим отказом): Graph недоступен, получатель тут ни при чём. Повторяет при
+    ограничении темпа, 5xx и сетевых сбоях"""
+    code = "net"
+    for attempt in range(attempts):
+        try:
+            r = await number.post(payload)
+            if r is None:
+                return NOT_SENT
+            if r.status_code < 400:
+                return "s"
+            try:
+                code = str(r.json().get("error", {}).get("code", r.status_code))
+            except ValueError:
+                code = str(r.status_code)
+            if r.status_code < 500 and r.status_code != 429 and not (code.isdigit() and int(code) in RETRY_CODES):
+                return f"f{code}"
+        except CircuitOpen:
+            return NOT_SENT
+        except httpx.TransportError:
+            code = "net"
+        if number.breaker.state == OPEN:
+            return NOT_SENT
+        if attempt < attempts - 1:
+            await asyncio.sleep(2 ** attempt)
+    return f"f{code}"
+
+
+async def run_job(store, job_id, number=None, page_size=100, stop=None):
+    """Выполняет (или продолжает) задание; stop — asyncio.Event для мягкой паузы;
+    number — подменить номер задания. Возвращает итоговый статус задания"""
+    job = await job_status(store, job_id)
+    if job is None:
+        raise KeyError(f"no broadcast job {job_id}")
+    if job["status"] == "done":
+        return job
+    key, rkey = _job_key(job_id), f"{_job_key(job_id)}:r"
+    checks = parse_segment(job["segment"])
+    message = job["message"]
+    number = number or resolve_number(job.get("number", ""))
+    contacts = contacts_key(number.namespace)
+    limiter = RateLimiter(job["rate"])
+    sem = asyncio.Semaphore(max(1, job["concurrency"]))
+
+    def outcome(phone, code):
+        counter = "sent" if code == "s" else "optout" if code == "o" else "failed"
+        return [["HSET", rkey, phone, code], ["HINCRBY", key, "matched", 1], ["HINCRBY", key, counter, 1]]
+
+    blocked = []
+
+    async def deliver(phone):
+        async with sem:
+            if blocked:
+                return
+            await limiter.wait()
+            code = await _send(number, build_payload(message, phone))
+            if code == NOT_SENT:
+                blocked.append(phone)
+                return
+            # Итог — сразу: обрыв посередине страницы не повторит отправленное
+            await store.pipeline(outcome(phone, code))
+
+    cursor = job["cursor"]
+    await store.execute("HSET", key, "status", "running", "resume_at", 0, "started_at", datetime.now().isoformat())
+    logger.info("Broadcast %s: start from cursor %s via %s", job_id, cursor, number.name)
+    try:
+        while True:
+            page, (cursor, phones) = cursor, await store.execute("SSCAN", contacts, cursor, "COUNT", page_size)
+            if phones:
+                # Одним пайплайном: итог прошлого прогона, отписка, карточка контакта
+                probe = []
+                for p in phones:
+                    probe += [["HGET", rkey, p], ["SISMEMBER", OPTOUT_KEY, p]]
+                    if checks:
+                        probe.append(["HGETALL", contact_key(p, number.namespace)])
+                res = await store.pipeline(probe)
+                step = 3 if checks else 2
+                todo, optout = [], []
+                for i, p in enumerate(phones):
+                    done, opted = res[i * step], res[i * step + 1]
+                    if done:
+                        continue
+                    if checks and not all(ch(res[i * step + 2]) for ch in checks):
+                        continue
+                    (optout if int(opted) else todo).append(p)
+
+                if optout:
+                    await store.pipeline([cmd for p in optout for cmd in outcome(p, "o")])
+                await asyncio.gather(*(deliver(p) for p in todo))
+            if blocked:
+                # Курсор не двигаем: страница повторится, отправленным итог уже записан
+                resume_at = time.time() + number.breaker.describe().get("retry_in", 0)
+                await store.pipeline([["HSET", key, "status", "paused", "resume_at", round(resume_at, 3)],
+                                      ["EXPIRE", rkey, JOB_TTL]])
+                logger.warning("Broadcast %s: circuit %s open, paused at cursor %s",
+                               job_id, number.breaker.name, page)
+                break
+            await store.pipeline([["HSET", key, "cursor", cursor], ["EXPIRE", rkey, JOB_TTL]])
+            if cursor == 0:
+                await store.execute("HSET", key, "status", "done", "finished_at", datetime.now().isoformat())
+                break
+            if stop is not None and stop.is_set():
+                await store.execute("HSET", key, "status", "paused")
+                break
+    except BaseException:
+        try:
+            await store.execute("HSET", key, "status", "paused")
+        except Exception:
+            pass
+        raise
+    job = await job_status(store, job_id)
+    logger.info("Broadcast %s: %s, sent=%s failed=%s optout=%s", job_id, job["status"],
+                job["sent"], job["failed"], job["optout"])
+    return job
+
+
+async def _pause(seconds, stop):
+    """asyncio.sleep, который прерывается stop"""
+    if stop is None:
+        await asyncio.sleep(seconds)
+        return
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def worker(store, stop=None, poll=2.0):
+    """Берёт задания из broadcast:queue по одному, пока не выставлен stop.
+    Поставленное на паузу возвращается в очередь: следующим (после stop или
+    разомкнутого автомата — тогда воркер ждёт resume_at) или в конец (после
+    ошибки), чтобы задание не терялось"""
+    while stop is None or not stop.is_set():
+        job_id = await store.execute("RPOP", QUEUE_KEY)
+        if not job_id:
+            await asyncio.sleep(poll)
+            continue
+        try:
+            job = await run_job(store, job_id, stop=stop)
+        except KeyError as e:
+            logger.error("Broadcast %s dropped: %s", job_id, e)
+        except Exception as e:
+            logger.error("Broadcast %s failed: %s", job_id, e, exc_info=True)
+            await store.execute("LPUSH", QUEUE_KEY, job_id)
+            await asyncio.sleep(poll)
+        else:
+            if job["status"] == "paused":
+                await store.execute("RPUSH", QUEUE_KEY, job_id)
+                if job["resume_at"] > time.time():
+                    await _pause(job["resume_at"] - time.time(), stop)
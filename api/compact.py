@@ -0,0 +1,233 @@
+"""
+🗜 Компакция и архив заказов
+orders:list растёт бесконечно, contacts:all не знает об истёкших контактах,
+а order:{id} живёт 7 дней. Компакция (cron /cron/compact или compact.py):
+  • заказы старше ARCHIVE_AFTER_DAYS дописывает в дневной архив — gzip NDJSON
+    (файл ARCHIVE_DIR/orders-YYYY-MM-DD.ndjson.gz или, без ARCHIVE_DIR, список
+    archive:orders:{день} в Redis как замена blob-хранилищу), удаляет order:{id}
+    и отрезает их хвост orders:list; записи без order:{id} (истёк TTL) просто убирает;
+  • из contacts:all (и contacts:{ns}:all других бизнес-номеров) убирает номера,
+    у которых истёк contact:{phone}.
+Всё идёт пачками по COMPACT_BATCH (LRANGE/SSCAN + пайплайн), память — на одну пачку.
+Прогон ограничен по времени и продолжается со следующего запуска с того же места.
+Счётчики архивного дня (archive:stats:{день}, поля как в stats:{день}) компакция
+пересчитывает по архиву дня при каждой дописке в него: /stats берёт их одним
+HGETALL на день, когда stats:{день} нет, и архив не распаковывает.
+Архивные заказы читает compact.py export.
+"""
+
+import asyncio
+import base64
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+try:
+    from .config import ARCHIVE_DIR, ARCHIVE_AFTER_DAYS, COMPACT_BATCH
+    from .storage import _stats_commands, contacts_key, contact_key, ARCHIVE_STATS_KEY
+except ImportError:
+    from config import ARCHIVE_DIR, ARCHIVE_AFTER_DAYS, COMPACT_BATCH
+    from storage import _stats_commands, contacts_key, contact_key, ARCHIVE_STATS_KEY
+
+logger = logging.getLogger(__name__)
+
+CONTACTS_CURSOR_KEY = "compact:contacts:cursor"
+
+
+def _pack(records):
+    data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+    return gzip.compress(data.encode("utf-8"))
+
+
+def _unpack(blob):
+    # Архив дня — несколько gzip-участков подряд (по одному на пачку), gzip читает их как один поток
+    text = gzip.decompress(blob).decode("utf-8")
+    return [json.loads(line) for line in text.splitlines() if line]
+
+
+def _dedupe(orders):
+    # Прерванный прогон мог дописать пачку дважды
+    seen, out = set(), []
+    for o in orders:
+        key = (o.get("id"), o.get("created_at"))
+        if key not in seen:
+            seen.add(key)
+            out.append(o)
+    return out
+
+
+# ==========================================
+# 📦 АРХИВ
+# ==========================================
+
+class DirArchive:
+    """Файлы orders-YYYY-MM-DD.ndjson.gz в каталоге (дописываются gzip-участками)"""
+    name = "dir"
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, day):
+        return os.path.join(self.root, f"orders-{day}.ndjson.gz")
+
+    async def append(self, day, orders):
+        def write():
+            os.makedirs(self.root, exist_ok=True)
+            with open(self._path(day), "ab") as f:
+                f.write(_pack(orders))
+        await asyncio.to_thread(write)
+
+    async def read(self, day):
+        def load():
+            try:
+                with open(self._path(day), "rb") as f:
+                    return _dedupe(_unpack(f.read()))
+            except FileNotFoundError:
+                return []
+        return await asyncio.to_thread(load)
+
+    async def days(self):
+        names = await asyncio.to_thread(lambda: os.listdir(self.root) if os.path.isdir(self.root) else [])
+        return sorted(n[7:17] for n in names if n.startswith("orders-") and n.endswith(".ndjson.gz"))
+
+
+class RedisArchive:
+    """Список archive:orders:{день} из base64(gzip)-участков + множество дней archive:orders"""
+    name = "redis"
+
+    def __init__(self, store):
+        self.store = store
+
+    async def append(self, day, orders):
+        await self.store.pipeline([
+            ["RPUSH", f"archive:orders:{day}", base64.b64encode(_pack(orders)).decode("ascii")],
+            ["SADD", "archive:orders", day],
+        ])
+
+    async def read(self, day):
+        chunks = await self.store.execute("LRANGE", f"archive:orders:{day}", 0, -1)
+        return _dedupe([o for c in chunks or () for o in _unpack(base64.b64decode(c))])
+
+    async def days(self):
+        return sorted(await self.store.execute("SMEMBERS", "archive:orders"))
+
+
+def create_archive(store):
+    return DirArchive(ARCHIVE_DIR) if ARCHIVE_DIR else RedisArchive(store)
+
+
+def daily_counters(orders):
+    """Те же поля, что в stats:{день}, посчитанные по архивным заказам"""
+    row = {}
+    for order in orders:
+        for cmd in _stats_commands(order):
+            if cmd[0] == "HINCRBY":
+                row[cmd[2]] = row.get(cmd[2], 0) + int(cmd[3])
+    return row
+
+
+async def summarize_day(store, archive, day):
+    """archive:stats:{день} заново по всему архиву дня: дубли прерванного прогона
+    отсекает read(), поэтому счётчики не задваиваются"""
+    row = daily_counters(await archive.read(day))
+    key = f"{ARCHIVE_STATS_KEY}:{day}"
+    cmds = [["DEL", key]]
+    if row:
+        cmds.append(["HSET", key, *[x for field, value in sorted(row.items()) for x in (field, value)]])
+    await store.pipeline(cmds)
+    return row
+
+
+# ==========================================
+# 🗜 КОМПАКЦИЯ
+# ==========================================
+
+async def compact_orders(store, archive, older_than_days=ARCHIVE_AFTER_DAYS, batch=COMPACT_BATCH, deadline=None):
+    """Разбирает orders:list с хвоста (самые старые), пока не встретит свежий заказ"""
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime("%Y-%m-%d")
+    report = {"archived": 0, "dangling": 0, "days": set(), "done": False}
+    while deadline is None or time.monotonic() < deadline:
+        ids = await store.execute("LRANGE", "orders:list", -batch, -1)
+        if not ids:
+            report["done"] = True
+            break
+        raws = await store.pipeline([["GET", f"order:{i}"] for i in ids])
+        by_day, drop, fresh = {}, [], False
+        # LPUSH кладёт новые в голову — идём от последнего элемента к первому
+        for oid, raw in zip(reversed(ids), reversed(raws)):
+            if raw is None:
+                report["dangling"] += 1
+                drop.append((oid, False))
+                continue
+            order = json.loads(raw)
+            day = (order.get("created_at") or "")[:10]
+            if day >= cutoff:
+                fresh = True
+                break
+            by_day.setdefault(day, []).append(order)
+            drop.append((oid, True))
+        # Сначала архив и его счётчики, потом удаление: обрыв между ними даст дубль, а не потерю
+        for day, orders in sorted(by_day.items()):
+            await archive.append(day, orders)
+            await summarize_day(store, archive, day)
+            report["days"].add(day)
+            report["archived"] += len(orders)
+        if drop:
+            cmds = [["DEL", f"order:{oid}"] for oid, archived in drop if archived]
+            # Новые заказы приходят в голову списка, хвост отрезаем по длине
+            cmds.append(["LTRIM", "orders:list", 0, -len(drop) - 1])
+            await store.pipeline(cmds)
+        if fresh:
+            report["done"] = True
+            break
+    report["days"] = sorted(report["days"])
+    return report
+
+
+async def compact_contacts(store, batch=COMPACT_BATCH, deadline=None, namespace=""):
+    """SSCAN по contacts:all номера: без contact:{phone} убираются; курсор переживает перезапуск"""
+    key = contacts_key(namespace)
+    cursor_key = f"{CONTACTS_CURSOR_KEY}:{namespace}" if namespace else CONTACTS_CURSOR_KEY
+    cursor = int(await store.execute("GET", cursor_key) or 0)
+    report = {"scanned": 0, "removed": 0, "done": False}
+    while True:
+        cursor, phones = await store.execute("SSCAN", key, cursor, "COUNT", batch)
+        if phones:
+            alive = await store.pipeline([["EXISTS", contact_key(p, namespace)] for p in phones])
+            gone = [p for p, n in zip(phones, alive) if not int(n)]
+            if gone:
+                await store.execute("SREM", key, *gone)
+            report["scanned"] += len(phones)
+            report["removed"] += len(gone)
+        if cursor == 0:
+            await store.execute("DEL", cursor_key)
+            report["done"] = True
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            await store.execute("SET", cursor_key, cursor, "EX", 86400 * 7)
+            break
+    return report
+
+
+async def compact(store, archive=None, older_than_days=ARCHIVE_AFTER_DAYS, batch=COMPACT_BATCH, budget=None,
+                  namespaces=("",)):
+    """Полный прогон; budget — секунд на весь прогон (None — до конца);
+    namespaces — пространства бизнес-номеров, чьи contacts:all чистить"""
+    archive = archive or create_archive(store)
+    started = time.monotonic()
+    deadline = started + budget if budget else None
+    orders = await compact_orders(store, archive, older_than_days, batch, deadline)
+    contacts = {"scanned": 0, "removed": 0, "done": True}
+    for namespace in namespaces:
+        part = await compact_contacts(store, batch, deadline, namespace)
+        contacts["scanned"] += part["scanned"]
+        contacts["removed"] += part["removed"]
+        contacts["done"] = contacts["done"] and part["done"]
+    report = {"archive": archive.name, "orders": orders, "contacts": contacts,
+              "seconds": round(time.monotonic() - started, 3)}
+    logger.info("Compaction: archived=%s dangling=%s contacts_removed=%s",
+                orders["archived"], orders["dangling"], contacts["removed"], extra={"compact": report})
+    return report
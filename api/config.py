@@ -11,11 +11,102 @@ import os, re
 
 WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN", "")
 WHATSAPP_PHONE_ID = os.getenv("WHATSAPP_PHONE_ID", "929651966907277")
+# Несколько номеров в одном деплое: JSON-список или путь к JSON-файлу (см. api/wa_numbers.py)
+WHATSAPP_NUMBERS = os.getenv("WHATSAPP_NUMBERS", "")
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN", "dyadya-steak-2024")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "")
 UPSTASH_REDIS_REST_URL = os.getenv("UPSTASH_REDIS_REST_URL", "")
 UPSTASH_REDIS_REST_TOKEN = os.getenv("UPSTASH_REDIS_REST_TOKEN", "")
+# Хранилище: upstash | redis | memory (пусто — upstash, если заданы ключи, иначе redis по REDIS_URL)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "")
+REDIS_URL = os.getenv("REDIS_URL", "")
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", "20"))
+# L1-кэш сессий в памяти процесса: максимум записей и время жизни записи (сек)
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "5000"))
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", "600"))
+# Меню: redis (документ menu:doc, по умолчанию) | file (MENU_FILE) | builtin (только этот файл)
+MENU_SOURCE = os.getenv("MENU_SOURCE", "redis")
+MENU_FILE = os.getenv("MENU_FILE", "")
+MENU_CHECK_INTERVAL = float(os.getenv("MENU_CHECK_INTERVAL", "30"))
+# Рассылки: сообщений в секунду и одновременных запросов к Graph API
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+# Автоматы (api/breaker.py): доля ошибок среди последних вызовов (не старше окна, сек)
+# при минимуме вызовов → пауза cooldown (сек);
+# таймауты одного вызова Redis / Graph / CRM (сек)
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", "30"))
+BREAKER_WINDOW_CALLS = int(os.getenv("BREAKER_WINDOW_CALLS", "20"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "15"))
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "3"))
+GRAPH_TIMEOUT = float(os.getenv("GRAPH_TIMEOUT", "10"))
+CRM_TIMEOUT = float(os.getenv("CRM_TIMEOUT", "8"))
+# Лимит входящих на номер: не больше RATE_LIMIT сообщений за скользящее окно RATE_WINDOW сек (0 — без лимита)
+RATE_LIMIT = int(os.getenv("RATE_LIMIT", "15"))
+RATE_WINDOW = float(os.getenv("RATE_WINDOW", "30"))
+# Компакция (api/compact.py): заказы старше N дней уходят в архив (N < 7 — TTL order:{id}),
+# ARCHIVE_DIR — каталог gzip NDJSON (пусто — архив в Redis), пачка и бюджет прогона в секундах
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "3"))
+COMPACT_BATCH = int(os.getenv("COMPACT_BATCH", "200"))
+COMPACT_BUDGET = float(os.getenv("COMPACT_BUDGET", "20"))
+# Сверка с CRM (api/crm_sync.py): список заказов CRM, период опроса (сек), страница и
+# число одновременных запросов страниц; заказ, которого нет в CRM дольше N сек, отправляется
+# заново (не больше CRM_RESUBMIT_ATTEMPTS раз); CRM_STATUS_MAP — JSON {"статус CRM": "этап"}
+CRM_ORDERS_URL = os.getenv("CRM_ORDERS_URL", "https://ds-api.delres.kz/api/orders")
+CRM_SYNC_INTERVAL = float(os.getenv("CRM_SYNC_INTERVAL", "60"))
+CRM_SYNC_PAGE_SIZE = int(os.getenv("CRM_SYNC_PAGE_SIZE", "100"))
+CRM_SYNC_CONCURRENCY = int(os.getenv("CRM_SYNC_CONCURRENCY", "4"))
+CRM_RESUBMIT_AFTER = int(os.getenv("CRM_RESUBMIT_AFTER", "300"))
+CRM_RESUBMIT_ATTEMPTS = int(os.getenv("CRM_RESUBMIT_ATTEMPTS", "3"))
+CRM_STATUS_MAP = os.getenv("CRM_STATUS_MAP", "")
+# Время доставки (api/eta.py), минуты: готовка, дорога, ширина вилки; скорость кухни —
+# отдано заказов за окно ETA_RATE_WINDOW (сек), но не ниже ETA_DEFAULT_RATE заказов/мин,
+# пока за окно меньше ETA_MIN_SAMPLES; заказ старше ETA_QUEUE_MAX_AGE сек уходит из очереди
+ETA_PREP = float(os.getenv("ETA_PREP", "10"))
+ETA_DELIVERY = float(os.getenv("ETA_DELIVERY", "20"))
+ETA_SPREAD = int(os.getenv("ETA_SPREAD", "20"))
+ETA_RATE_WINDOW = int(os.getenv("ETA_RATE_WINDOW", "3600"))
+ETA_DEFAULT_RATE = float(os.getenv("ETA_DEFAULT_RATE", "0.5"))
+ETA_MIN_SAMPLES = int(os.getenv("ETA_MIN_SAMPLES", "5"))
+ETA_QUEUE_MAX_AGE = int(os.getenv("ETA_QUEUE_MAX_AGE", "10800"))
+# Профилирование (api/profiler.py): доля профилируемых сообщений (0 — выключено),
+# период сэмплирования (мс) и сколько последних профилей держать
+PROFILE_RATE = float(os.getenv("PROFILE_RATE", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "5"))
+PROFILE_BUFFER = int(os.getenv("PROFILE_BUFFER", "200"))
+# Журнал переписки (поток convo:{номер}, /conversation): сколько последних записей
+# хранить на клиента (0 — не писать) и до скольких символов сокращать текст
+CONVO_MAXLEN = int(os.getenv("CONVO_MAXLEN", "200"))
+CONVO_TEXT_MAX = int(os.getenv("CONVO_TEXT_MAX", "300"))
+# Лента заказов для кухни (api/order_feed.py, /orders/stream): период опроса Redis (сек),
+# очередь событий на соединение, пинг простаивающего соединения (сек) и сколько секунд
+# держать соединение (0 — без ограничения; на Vercel — меньше maxDuration функции)
+ORDERS_STREAM_POLL = float(os.getenv("ORDERS_STREAM_POLL", "1"))
+ORDERS_STREAM_BUFFER = int(os.getenv("ORDERS_STREAM_BUFFER", "100"))
+ORDERS_STREAM_HEARTBEAT = float(os.getenv("ORDERS_STREAM_HEARTBEAT", "15"))
+ORDERS_STREAM_MAX_AGE = float(os.getenv("ORDERS_STREAM_MAX_AGE", "0"))
+# Vercel Cron присылает Authorization: Bearer $CRON_SECRET
+CRON_SECRET = os.getenv("CRON_SECRET", "")
+# Свой сервер (server.py): кроны из vercel.json внутри процесса (api/cron.py) и сколько
+# секунд при остановке ждать фоновые задачи (очередь CRM, запись сессий)
+CRON_SCHEDULER = os.getenv("CRON_SCHEDULER", "0") == "1"
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "10"))
+
+# Базовые URL внешних API (переопределяются для локальных моков и нагрузочных тестов)
+GRAPH_API_URL = os.getenv("GRAPH_API_URL", "https://graph.facebook.com/v22.0").rstrip("/")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+
+# ==========================================
+# 📝 ЛОГИ
+# ==========================================
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")        # json | text
+# Доля INFO-строк, которые пишем, по логгерам: "api.index.wa=0.1,api.crm=0.5"
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
 
 # ==========================================
 # 🏪 БИЗНЕС
@@ -57,13 +148,27 @@ T = {
     "cart_title": {"ru": "🛒 *Ваш заказ:*", "kz": "🛒 *Сіздің тапсырысыңыз:*"},
     "total": {"ru": "💰 Итого", "kz": "💰 Барлығы"},
     "min_warn": {"ru": "⚠️ Минимальный заказ: {min} тг", "kz": "⚠️ Ең аз тапсырыс: {min} тг"},
-    "ask_address": {"ru": "📍 Напишите *адрес доставки*:\n(улица, дом, квартира, подъезд)", "kz": "📍 *Жеткізу мекен-жайын* жазыңыз:\n(көше, үй, пәтер)"},
+    "cart_repriced": {"ru": "⚠️ Меню обновилось, корзина пересчитана:\n{changes}", "kz": "⚠️ Мәзір жаңартылды, себет қайта есептелді:\n{changes}"},
+    "item_gone": {"ru": "нет в меню", "kz": "мәзірде жоқ"},
+    "unsubscribed": {"ru": "🔕 Вы отписались от акций. Вернуть — напишите *подписаться*", "kz": "🔕 Акциялардан бас тарттыңыз. Қайтару үшін *жазылу* деп жазыңыз"},
+    "subscribed": {"ru": "🔔 Вы снова подписаны на акции!", "kz": "🔔 Акцияларға қайта жазылдыңыз!"},
+    "ask_address": {"ru": "📍 Напишите *адрес доставки*:\n(улица, дом, квартира, подъезд)\nили отправьте геолокацию 📎", "kz": "📍 *Жеткізу мекен-жайын* жазыңыз:\n(көше, үй, пәтер)\nнемесе геолокация жіберіңіз 📎"},
+    "geo_ok": {"ru": "📍 Геолокация получена. Квартиру и подъезд напишите в комментарии к заказу.", "kz": "📍 Геолокация алынды. Пәтер мен кіреберісті тапсырысқа пікірде жазыңыз."},
+    "geo_not_now": {"ru": "📍 Геолокацию отправьте при оформлении заказа — когда бот спросит адрес.", "kz": "📍 Геолокацияны тапсырыс рәсімдегенде — бот мекен-жай сұрағанда жіберіңіз."},
     "ask_phone": {"ru": "📞 Напишите *номер телефона* для связи:", "kz": "📞 Байланыс *телефон нөмірін* жазыңыз:"},
     "ask_payment": {"ru": "💳 Выберите *способ оплаты*:", "kz": "💳 *Төлем әдісін* таңдаңыз:"},
     "ask_comment": {"ru": "💬 Комментарий к заказу?", "kz": "💬 Тапсырысқа пікір?"},
     "confirm": {
-        "ru": "📋 *Подтвердите заказ:*\n\n{cart}\n\n📍 Адрес: {addr}\n📞 Телефон: {phone}\n💳 Оплата: {pay}\n💬 Комментарий: {comment}\n\n🚚 Доставка: ~{time} мин\n⚠️ *Доставка платная: от 700 тг* (зависит от загруженности дорог)\n\nВсё верно?",
-        "kz": "📋 *Тапсырысты растаңыз:*\n\n{cart}\n\n📍 Мекен-жай: {addr}\n📞 Телефон: {phone}\n💳 Төлем: {pay}\n💬 Пікір: {comment}\n\n🚚 Жеткізу: ~{time} мин\n⚠️ *Жеткізу ақылы: 700 тг-ден* (жол тығыздығына байланысты)\n\nБәрі дұрыс па?",
+        "ru": "📋 *Подтвердите заказ:*\n\n{cart}\n\n📍 Адрес: {addr}\n📞 Телефон: {phone}\n💳 Оплата: {pay}\n💬 Комментарий: {comment}\n\n🚚 Доставка: ~{time} мин\n{delivery}\n\nВсё верно?",
+        "kz": "📋 *Тапсырысты растаңыз:*\n\n{cart}\n\n📍 Мекен-жай: {addr}\n📞 Телефон: {phone}\n💳 Төлем: {pay}\n💬 Пікір: {comment}\n\n🚚 Жеткізу: ~{time} мин\n{delivery}\n\nБәрі дұрыс па?",
+    },
+    "delivery_zone": {
+        "ru": "💸 *Доставка: {fee} тг* (зона {zone}, {label})\n💰 Итого с доставкой: *{total} тг*",
+        "kz": "💸 *Жеткізу: {fee} тг* ({zone} аймақ, {label})\n💰 Жеткізумен барлығы: *{total} тг*",
+    },
+    "delivery_unknown": {
+        "ru": "⚠️ *Доставка платная: от 700 тг* (зависит от загруженности дорог)",
+        "kz": "⚠️ *Жеткізу ақылы: 700 тг-ден* (жол тығыздығына байланысты)",
     },
     "order_done": {
         "ru": "✅ *Заказ #{id} принят!*\n\n🕐 Ожидайте ~{time} мин\n📞 Курьер свяжется перед приездом\n\n❌ Для отмены заказа: wa.me/77081798320\n\nСпасибо, что выбрали *Дядя Стейк Бургер*! 🍔❤️",
@@ -102,6 +207,22 @@ T = {
         "ru": "Не понял 🤔 Выберите из меню или напишите заказ текстом!",
         "kz": "Түсінбедім 🤔 Мәзірден таңдаңыз немесе мәтін жазыңыз!",
     },
+    "checkout_saved": {
+        "ru": "🔁 *Как в прошлый раз?*\n{addresses}\n📞 {phone} · 💳 {pay}\n\nНажмите адрес — сразу перейдём к подтверждению. Или напишите новый адрес.",
+        "kz": "🔁 *Өткен жолғыдай ма?*\n{addresses}\n📞 {phone} · 💳 {pay}\n\nМекенжайды басыңыз — бірден растауға өтеміз. Немесе жаңа мекенжай жазыңыз.",
+    },
+    "slow_down": {
+        "ru": "⏳ Слишком много сообщений — подождите полминуты, и я снова отвечу.\n⏳ Хабарлама тым көп — жарты минут күте тұрыңыз.",
+        "kz": "⏳ Хабарлама тым көп — жарты минут күте тұрыңыз.\n⏳ Слишком много сообщений — подождите полминуты, и я снова отвечу.",
+    },
+    "repeat_order": {"ru": "🔁 Повторить заказ", "kz": "🔁 Қайталау"},
+    "repeat_empty": {"ru": "😔 Из прошлого заказа ничего не осталось в меню", "kz": "😔 Өткен тапсырыстағы тағамдар мәзірде жоқ"},
+    "crm_cooking": {"ru": "👨‍🍳 Заказ #{id} готовится", "kz": "👨‍🍳 #{id} тапсырыс дайындалып жатыр"},
+    "crm_on_way": {"ru": "🛵 Заказ #{id} уже в пути — курьер скоро будет", "kz": "🛵 #{id} тапсырыс жолда — курьер жақында келеді"},
+    "crm_delivered": {"ru": "✅ Заказ #{id} доставлен. Приятного аппетита! 🍔", "kz": "✅ #{id} тапсырыс жеткізілді. Ас болсын! 🍔"},
+    "crm_cancelled": {"ru": "❌ Заказ #{id} отменён. Вопросы — {phone}", "kz": "❌ #{id} тапсырыс тоқтатылды. Сұрақтар — {phone}"},
+    "same_as_last": {"ru": "🔁 Как в прошлый раз", "kz": "🔁 Өткен жолғыдай"},
+    "new_address": {"ru": "✏️ Другой адрес", "kz": "✏️ Басқа мекенжай"},
     "pay_kaspi": {"ru": "Каспи перевод", "kz": "Каспи аударым"},
     "pay_cash": {"ru": "Наличные", "kz": "Қолма-қол"},
     "pay_qr": {"ru": "Каспи QR", "kz": "Каспи QR"},
@@ -370,11 +491,13 @@ _STOP_WORDS = {
     "как дела", "что нового",
 }
 
-def parse_text_order(text):
+def parse_text_order(text, aliases=None):
     """
     Парсит текст типа «2 сырных говяжьих и колу» 
     Возвращает список (variant_id, qty) или пустой список
+    aliases — отсортированные алиасы из индекса меню (по умолчанию — встроенного)
     """
+    aliases = MENU_INDEX["aliases"] if aliases is None else aliases
     txt = text.lower().strip()
     
     # Если слишком короткий или стоп-слово
@@ -405,19 +528,13 @@ def parse_text_order(text):
         if not part.strip():
             continue
         
-        # Ищем лучшее совпадение по алиасам
+        # Ищем лучшее совпадение по алиасам (индекс отсортирован по приоритету —
+        # первое совпадение и есть лучшее)
         best_vid = None
-        best_prio = -1
-        
-        for keywords, vid, prio in _ALIASES:
-            matched = True
-            for kw in keywords:
-                if kw not in part:
-                    matched = False
-                    break
-            if matched and prio > best_prio:
+        for keywords, vid, _prio in aliases:
+            if all(kw in part for kw in keywords):
                 best_vid = vid
-                best_prio = prio
+                break
         
         if best_vid:
             # Суммируем если тот же товар уже есть
@@ -429,3 +546,75 @@ def parse_text_order(text):
                 results.append((best_vid, qty))
     
     return results
+
+
+# ==========================================
+# 📦 ПРЕДРАССЧИТАННЫЙ ИНДЕКС МЕНЮ
+# ==========================================
+# Сортированные алиасы парсера и готовые строки WhatsApp-списков.
+# `python build_menu_index.py` сохраняет их в api/menu_index.json, чтобы холодный
+# старт только читал файл; если файл устарел (другое меню или алиасы) — строим на месте.
+
+MENU_INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "menu_index.json")
+# Поднять при изменении build_menu_index(): формат индекса не входит в отпечаток данных
+MENU_INDEX_VERSION = 1
+
+
+def _source_fingerprint():
+    """Отпечаток данных меню — правки остального config.py индекс не устаревают"""
+    import hashlib
+    import json
+    data = {"version": MENU_INDEX_VERSION, "categories": CATEGORIES, "menu_items": MENU_ITEMS, "aliases": _ALIASES}
+    return hashlib.sha1(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def build_menu_index(categories=None, menu_items=None, aliases=None):
+    """Строит всё, что не зависит от сессии: алиасы по убыванию приоритета,
+    строки списка категорий и позиций для каждого языка"""
+    categories = CATEGORIES if categories is None else categories
+    menu_items = MENU_ITEMS if menu_items is None else menu_items
+    aliases = _ALIASES if aliases is None else aliases
+
+    # sorted() стабилен: при равном приоритете выигрывает алиас, объявленный раньше
+    sorted_aliases = [list(a) for a in sorted(aliases, key=lambda a: -a[2])]
+
+    category_rows, item_rows = {}, {}
+    for lang in ("ru", "kz"):
+        rows = []
+        for c in categories:
+            count = len([i for i in menu_items if i["cat"] == c["id"]])
+            if c["id"] == "steaks":
+                desc = "Свяжитесь с нами" if lang == "ru" else "Бізбен байланысыңыз"
+            else:
+                desc = f"{count} " + ("позиций" if lang == "ru" else "тағам")
+            rows.append({"id": f"cat_{c['id']}", "title": c[lang][:24], "description": desc})
+        rows.append({"id": "back_main", "title": "🔙 " + ("Назад" if lang == "ru" else "Артқа")})
+        category_rows[lang] = rows
+
+        item_rows[lang] = {}
+        for c in categories:
+            rows = []
+            for item in (i for i in menu_items if i["cat"] == c["id"]):
+                name = item.get(f"{lang}_name", item["ru_name"])
+                for v in item["variants"]:
+                    label = name if len(item["variants"]) == 1 else f"{name} {v.get(lang, v['ru'])}"
+                    rows.append({"id": f"add_{v['id']}", "title": label[:24], "description": f"{v['price']:,} тг"[:72]})
+            rows.append({"id": "back_categories", "title": "🔙 " + ("Назад к меню" if lang == "ru" else "Мәзірге қайту")})
+            item_rows[lang][c["id"]] = rows
+
+    return {"aliases": sorted_aliases, "category_rows": category_rows, "item_rows": item_rows}
+
+
+def _load_menu_index():
+    try:
+        import json
+        with open(MENU_INDEX_FILE, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("fingerprint") == _source_fingerprint():
+            return data
+    except (OSError, ValueError):
+        pass
+    return build_menu_index()
+
+
+MENU_INDEX = _load_menu_index()
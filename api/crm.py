@@ -6,10 +6,16 @@
 import os
 import re
 import json
+import asyncio
 import logging
 import httpx
 from datetime import datetime, timezone, timedelta
 
+try:
+    from . import gazetteer
+except ImportError:
+    import gazetteer
+
 logger = logging.getLogger(__name__)
 
 ASTANA_TZ = timezone(timedelta(hours=5))
@@ -105,40 +111,9 @@ def normalize_phone(phone: str) -> str:
 
 
 def parse_address(address: str) -> dict:
-    """Парсит адрес: 'Мангилик ел 24, кв 90' → street, building, room"""
-    result = {"street": None, "building": None, "entrance": None, "floor": None, "room": None}
-    if not address:
-        return result
-    
-    # Ищем кв/квартира
-    kv_match = re.search(r'(?:кв\.?|квартира)\s*(\d+)', address, re.IGNORECASE)
-    if kv_match:
-        result["room"] = kv_match.group(1)
-    
-    # Ищем подъезд
-    pod_match = re.search(r'(?:подъезд|подьезд|под\.?)\s*(\d+)', address, re.IGNORECASE)
-    if pod_match:
-        result["entrance"] = pod_match.group(1)
-    
-    # Ищем этаж
-    floor_match = re.search(r'(?:этаж|эт\.?)\s*(\d+)', address, re.IGNORECASE)
-    if floor_match:
-        result["floor"] = floor_match.group(1)
-    
-    # Убираем кв/подъезд/этаж из строки чтобы найти улицу и дом
-    clean = re.sub(r'(?:кв\.?|квартира|подъезд|подьезд|под\.?|этаж|эт\.?)\s*\d+', '', address, flags=re.IGNORECASE)
-    clean = re.sub(r'[,\s]+$', '', clean).strip()
-    
-    # Ищем номер дома (последнее число в оставшейся строке)
-    parts = re.match(r'^(.+?)\s+(\d+\S*)\s*$', clean)
-    if parts:
-        result["street"] = parts.group(1).strip()
-        result["building"] = parts.group(2).strip()
-    else:
-        result["street"] = clean
-        result["building"] = "1"
-    
-    return result
+    """Парсит адрес по справочнику улиц: 'Мангилик ел 24, кв 90' → street, building, room,
+    координаты и зона доставки (api/gazetteer.py)"""
+    return gazetteer.parse(address)
 
 
 def build_nomenclatures(cart: list) -> list:
@@ -146,12 +121,12 @@ def build_nomenclatures(cart: list) -> list:
     noms = []
     for item in cart:
         if not isinstance(item, dict):
-            logger.warning(f"CRM: cart item is not dict: {type(item)} = {item}")
+            logger.warning("CRM: cart item is not dict: %s = %r", type(item).__name__, item)
             continue
         vid = item.get("vid", "")
         mapping = CRM_PRODUCT_MAP.get(vid)
         if not mapping:
-            logger.warning(f"CRM: нет маппинга для variant_id={vid}, пропускаем")
+            logger.warning("CRM: нет маппинга для variant_id=%s, пропускаем", vid)
             continue
         noms.append({
             "id": mapping["crm_id"],
@@ -173,27 +148,56 @@ def build_payment(payment_method: str, total_tenge: int) -> list:
     }]
 
 
+# ==========================================
+# 🔌 ПУЛ СОЕДИНЕНИЙ К CRM
+# ==========================================
+
+_pool = {"client": None, "loop": None}
+
+
+def crm_http():
+    """Один keep-alive пул к CRM на процесс: создаётся при старте сервера (или при
+    первом вызове), закрывается close_crm_http(). Своего таймаута нет — вызовы идут
+    под автоматом crm, и время ограничивает его CRM_TIMEOUT"""
+    loop = asyncio.get_running_loop()
+    if _pool["client"] is None or _pool["loop"] is not loop:
+        _pool["client"] = httpx.AsyncClient(
+            timeout=None, limits=httpx.Limits(max_keepalive_connections=10),
+            headers={"Authorization": f"Bearer {CRM_TOKEN}", "Accept": "application/json"})
+        _pool["loop"] = loop
+    return _pool["client"]
+
+
+async def close_crm_http():
+    client, _pool["client"], _pool["loop"] = _pool["client"], None, None
+    if client is not None:
+        await client.aclose()
+
+
 # ==========================================
 # 🚀 ОТПРАВКА ЗАКАЗА В CRM
 # ==========================================
 
-async def send_order_to_crm(session_data: dict) -> dict:
+async def send_order_to_crm(session_data: dict, trade_point_id: int = None) -> dict:
     """
     Отправляет заказ из бота в CRM DelRes.
     
     session_data:
       - cart: [{vid, qty, price, name_ru, ...}]
-      - order: {address, phone, payment, comment}
+      - order: {address, phone, payment, comment, crm_uuid}
       - phone: номер WhatsApp
+    trade_point_id: точка продаж номера, на который пришёл заказ (по умолчанию CRM_TRADE_POINT_ID)
+    crm_uuid бот выдаёт при сохранении заказа: повторная отправка идёт с тем же
+    uuid, и по нему сверка (api/crm_sync.py) находит заказ в CRM.
     
-    Returns: {"success": bool, "order_id": int, "error": str}
+    Returns: {"success": bool, "order_id": int, "uuid": str, "error": str}
     """
     if not CRM_TOKEN:
         logger.warning("CRM: токен не задан, пропускаем")
         return {"success": False, "error": "CRM_TOKEN not set"}
     
     if not isinstance(session_data, dict):
-        logger.error(f"CRM: session_data is {type(session_data)}, not dict")
+        logger.error("CRM: session_data is %s, not dict", type(session_data).__name__)
         return {"success": False, "error": "Invalid session data"}
     
     cart = session_data.get("cart", [])
@@ -201,7 +205,8 @@ async def send_order_to_crm(session_data: dict) -> dict:
     if not isinstance(order_info, dict):
         order_info = {}
     
-    logger.warning(f"CRM debug: cart type={type(cart)}, order type={type(order_info)}, cart={str(cart)[:300]}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("CRM debug: cart=%s", json.dumps(cart, ensure_ascii=False, default=str)[:300])
     
     nomenclatures = build_nomenclatures(cart)
     if not nomenclatures:
@@ -223,17 +228,24 @@ async def send_order_to_crm(session_data: dict) -> dict:
     comment_parts.append("📱 WhatsApp бот")
     if address:
         comment_parts.append(f"📍 {address}")
+    zone = order_info.get("zone") or addr["zone"]
+    fee = order_info.get("delivery_fee") or addr["fee"]
+    if zone:
+        comment_parts.append(f"🚚 Зона {zone}, доставка {fee} тг")
     comment = " | ".join(comment_parts)
+    # Геоточка клиента точнее координат дома по справочнику
+    lat = order_info.get("lat") or addr["lat"]
+    lon = order_info.get("lon") or addr["lon"]
     
     import uuid as uuid_mod
     
     payload = {
-        "uuid": str(uuid_mod.uuid4()),
+        "uuid": order_info.get("crm_uuid") or str(uuid_mod.uuid4()),
         "date": datetime.now(ASTANA_TZ).strftime("%Y-%m-%d %H:%M"),
         "comment": comment,
         "is_fiscal": False,
         "organization_id": CRM_ORGANIZATION_ID,
-        "trade_point_id": CRM_TRADE_POINT_ID,
+        "trade_point_id": trade_point_id or CRM_TRADE_POINT_ID,
         "sales_channel_id": CRM_SALES_CHANNEL_ID,
         "order_tags": [],
         "payments": payments,
@@ -242,14 +254,14 @@ async def send_order_to_crm(session_data: dict) -> dict:
             "phone": phone,
             "client_name": order_info.get("name", "WhatsApp клиент"),
             "street": addr["street"],
-            "building": addr["building"],
+            "building": addr["building"] or "1",
             "entrance": addr["entrance"],
             "floor": addr["floor"],
             "room": addr["room"],
             "city_id": CRM_CITY_ID,
             "coordinates": {
-                "latitude": None,
-                "longitude": None,
+                "latitude": lat,
+                "longitude": lon,
             },
         },
     }
@@ -260,39 +272,38 @@ async def send_order_to_crm(session_data: dict) -> dict:
         "Content-Type": "application/json",
     }
     
-    logger.warning(f"CRM PAYLOAD: {json.dumps(payload, ensure_ascii=False, default=str)[:1000]}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("CRM PAYLOAD: %s", json.dumps(payload, ensure_ascii=False, default=str)[:1000])
     
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            resp = await client.post(
-                f"{CRM_BASE_URL}/order/orders",
-                json=payload,
-                headers=headers,
-            )
-            
-            data = resp.json()
-            if isinstance(data, list):
-                data = {"success": False, "message": str(data)}
-            logger.info(f"CRM response {resp.status_code}: {str(data)[:500]}")
+        resp = await crm_http().post(
+            f"{CRM_BASE_URL}/order/orders",
+            json=payload,
+            headers=headers,
+        )
+        
+        data = resp.json()
+        if isinstance(data, list):
+            data = {"success": False, "message": str(data)}
+        logger.info("CRM response %s", resp.status_code, extra={"crm_status": resp.status_code})
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("CRM response body: %s", str(data)[:500])
+        
+        if resp.status_code in (200, 201) and data.get("success"):
+            order_data = data.get("data", {})
+            order_id = 0
+            if isinstance(order_data, dict):
+                if "data" in order_data and isinstance(order_data["data"], dict):
+                    order_id = order_data["data"].get("id", 0)
+                else:
+                    order_id = order_data.get("id", 0)
+            logger.info("CRM: заказ создан #%s", order_id)
+            return {"success": True, "order_id": order_id, "uuid": payload["uuid"]}
+        else:
+            error_msg = data.get("message") or str(data)
+            logger.error("CRM: ошибка %s: %s", resp.status_code, error_msg)
+            return {"success": False, "error": error_msg, "status": resp.status_code}
             
-            if resp.status_code in (200, 201) and data.get("success"):
-                order_data = data.get("data", {})
-                order_id = 0
-                if isinstance(order_data, dict):
-                    if "data" in order_data and isinstance(order_data["data"], dict):
-                        order_id = order_data["data"].get("id", 0)
-                    else:
-                        order_id = order_data.get("id", 0)
-                logger.info(f"CRM: заказ создан #{order_id}")
-                return {"success": True, "order_id": order_id}
-                logger.info(f"CRM: заказ создан #{order_id}")
-                return {"success": True, "order_id": order_id}
-            else:
-                error_msg = data.get("message") or str(data)
-                logger.error(f"CRM: ошибка {resp.status_code}: {error_msg}")
-                return {"success": False, "error": error_msg, "status": resp.status_code}
-                
     except Exception as e:
-        import traceback
-        logger.error(f"CRM: исключение: {e}\n{traceback.format_exc()}")
-        return {"success": False, "error": str(e)}
+        logger.error("CRM: исключение: %s", e, exc_info=True)
+        return {"success": False, "error": str(e), "retry": True}
@@ -0,0 +1,328 @@
+"""
+🔄 Сверка заказов с CRM DelRes
+После send_order_to_crm бот больше ничего не спрашивал у CRM: не дошедший заказ
+терялся, а клиент не знал, что с его заказом. Сверка (cron /cron/crm-sync или
+crm_sync.py worker) раз в CRM_SYNC_INTERVAL:
+  • досылает очередь crm:queue (заказы, не ушедшие, пока CRM была недоступна);
+  • берёт незавершённые заказы из crm:open:{день} (их пишет store_order вместе с
+    заказом) и запрашивает список заказов CRM только за эти дни: первую страницу,
+    затем остальные параллельно (не больше CRM_SYNC_CONCURRENCY запросов).
+    Страница, не изменившаяся с прошлого опроса (ETag → 304), берётся из памяти;
+  • сопоставляет заказы по uuid, с которым бот их отправил. Новый этап (готовится →
+    в пути → доставлен, или отменён) — сообщение клиенту; последний этап хранится
+    в crm:track:{uuid}, повторный опрос не пишет дважды;
+  • новый статус CRM — событие status в ленте кухни (orders:stream, /orders/stream);
+  • заказ, которого нет в CRM два опроса подряд и дольше CRM_RESUBMIT_AFTER сек,
+    отправляется заново с тем же uuid (не больше CRM_RESUBMIT_ATTEMPTS раз);
+  • завершённые, брошенные и старше суток заказы уходят из crm:open — опрос
+    смотрит только на живые заказы, и при их отсутствии в CRM не ходит вовсе.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+try:
+    from .config import (
+        T, BIZ, CRM_ORDERS_URL, CRM_TIMEOUT, CRM_SYNC_INTERVAL, CRM_SYNC_PAGE_SIZE, CRM_SYNC_CONCURRENCY,
+        CRM_RESUBMIT_AFTER, CRM_RESUBMIT_ATTEMPTS, CRM_STATUS_MAP,
+    )
+    from .crm import CRM_TOKEN, send_order_to_crm, crm_http
+    from .breaker import breaker, CircuitOpen
+    from .storage import CRM_TRACK_TTL, order_event_command
+    from .wa_numbers import NUMBERS, PRIMARY
+    from . import eta
+except ImportError:
+    from config import (
+        T, BIZ, CRM_ORDERS_URL, CRM_TIMEOUT, CRM_SYNC_INTERVAL, CRM_SYNC_PAGE_SIZE, CRM_SYNC_CONCURRENCY,
+        CRM_RESUBMIT_AFTER, CRM_RESUBMIT_ATTEMPTS, CRM_STATUS_MAP,
+    )
+    from crm import CRM_TOKEN, send_order_to_crm, crm_http
+    from breaker import breaker, CircuitOpen
+    from storage import CRM_TRACK_TTL, order_event_command
+    from wa_numbers import NUMBERS, PRIMARY
+    import eta
+
+logger = logging.getLogger(__name__)
+
+CRM_QUEUE_KEY = "crm:queue"
+# Этапы по порядку; cancelled возможен на любом, lost — заказ так и не попал в CRM
+STAGES = ("cooking", "on_way", "delivered")
+FINAL = {"delivered", "cancelled", "lost"}
+# Кухня отдала заказ — он уходит из очереди kitchen:queue (api/eta.py)
+KITCHEN_DONE = {"on_way", "delivered", "cancelled"}
+STALE_AFTER = 86400
+
+DEFAULT_STATUS_MAP = {
+    "accepted": "cooking", "confirmed": "cooking", "in_progress": "cooking", "cooking": "cooking",
+    "preparing": "cooking", "ready": "cooking", "готовится": "cooking", "принят": "cooking",
+    "delivering": "on_way", "on_the_way": "on_way", "on_way": "on_way", "courier": "on_way",
+    "в пути": "on_way", "доставляется": "on_way",
+    "delivered": "delivered", "completed": "delivered", "done": "delivered", "closed": "delivered",
+    "доставлен": "delivered", "выполнен": "delivered",
+    "canceled": "cancelled", "cancelled": "cancelled", "rejected": "cancelled", "отменен": "cancelled",
+}
+STATUS_MAP = {**DEFAULT_STATUS_MAP, **{k.lower(): v for k, v in json.loads(CRM_STATUS_MAP or "{}").items()}}
+
+# (start, end, page) → (etag, заказы, last_page) — страницы прошлого опроса
+_pages = {}
+
+
+# ==========================================
+# 📤 ОТПРАВКА И ОЧЕРЕДЬ
+# ==========================================
+
+def crm_failed(result):
+    # Сетевая ошибка или 5xx — CRM недоступна; 4xx (битый заказ) автомат не трогает
+    return bool(result.get("retry")) or result.get("status", 0) >= 500
+
+
+async def submit_order(entry, trade_point=None):
+    """crm.send_order_to_crm под автоматом crm; разомкнут или таймаут — {"retry": True}"""
+    try:
+        return await breaker("crm", timeout=CRM_TIMEOUT).call(send_order_to_crm, entry, trade_point_id=trade_point,
+                                                              is_failure=crm_failed)
+    except (CircuitOpen, asyncio.TimeoutError) as e:
+        return {"success": False, "error": str(e) or "timeout", "retry": True}
+
+
+async def drain_queue(store, limit=20):
+    """Досылает crm:queue, пока CRM отвечает → (отправлено, очередь пуста)"""
+    sent = 0
+    for _ in range(limit):
+        raw = await store.execute("RPOP", CRM_QUEUE_KEY)
+        if not raw:
+            return sent, True
+        entry = json.loads(raw)
+        result = await submit_order(entry, entry.get("trade_point"))
+        if crm_failed(result):
+            await store.execute("RPUSH", CRM_QUEUE_KEY, raw)
+            return sent, False
+        sent += 1
+        logger.info("CRM: queued order #%s sent: %s", entry["order"].get("id"), result.get("success"))
+    return sent, False
+
+
+def _entry(track):
+    """Заказ из crm:track в виде, который принимает send_order_to_crm"""
+    order = json.loads(track["order"])
+    return {"phone": order["phone"], "cart": order["cart"],
+            "order": {"id": order["id"], "address": order.get("address", ""),
+                      "phone": order.get("contact_phone", ""), "payment": order.get("payment", ""),
+                      "comment": order.get("comment", ""), "crm_uuid": order["crm_uuid"],
+                      "zone": order.get("zone"), "delivery_fee": order.get("delivery_fee"),
+                      "lat": order.get("lat"), "lon": order.get("lon")}}
+
+
+def _oid(track):
+    # Номер заказа в ленте кухни — число, как в событии new
+    return int(track["oid"]) if track.get("oid", "").isdigit() else track.get("oid")
+
+
+# ==========================================
+# 📥 СПИСОК ЗАКАЗОВ CRM
+# ==========================================
+
+def _parse_page(data):
+    """Пагинация Laravel: {"data": [...], "last_page": N}, с meta или вложенным data"""
+    if isinstance(data, list):
+        return data, 1
+    meta, items = data.get("meta") or data, data.get("data", [])
+    if isinstance(items, dict):
+        meta, items = items, items.get("data", [])
+    return (items if isinstance(items, list) else []), int(meta.get("last_page") or 1)
+
+
+async def fetch_page(client, start, end, page, report=None):
+    key = (start, end, page)
+    cached = _pages.get(key)
+    headers = {"If-None-Match": cached[0]} if cached and cached[0] else {}
+    params = {"start_date": start, "end_date": end, "per_page": CRM_SYNC_PAGE_SIZE, "page": page}
+    resp = await breaker("crm", timeout=CRM_TIMEOUT).call(client.get, CRM_ORDERS_URL, params=params,
+                                                          headers=headers, is_failure=lambda r: r.status_code >= 500)
+    if resp.status_code == 304 and cached:
+        if report is not None:
+            report["not_modified"] += 1
+        return cached[1], cached[2]
+    resp.raise_for_status()
+    orders, last = _parse_page(resp.json())
+    _pages[key] = (resp.headers.get("etag"), orders, last)
+    return orders, last
+
+
+async def fetch_orders(client, start, end, report=None):
+    """Все заказы CRM за [start, end]: первая страница, затем остальные параллельно"""
+    first, last = await fetch_page(client, start, end, 1, report)
+    sem = asyncio.Semaphore(CRM_SYNC_CONCURRENCY)
+
+    async def one(page):
+        async with sem:
+            return (await fetch_page(client, start, end, page, report))[0]
+
+    rest = await asyncio.gather(*(one(p) for p in range(2, last + 1)))
+    for key in [k for k in _pages if k[:2] != (start, end) or k[2] > last]:
+        del _pages[key]
+    if report is not None:
+        report["pages"] += last
+    return [o for page in (first, *rest) for o in page if isinstance(o, dict)]
+
+
+# ==========================================
+# 🔄 СВЕРКА
+# ==========================================
+
+def _crm_status(order):
+    status = order.get("status")
+    if isinstance(status, dict):
+        status = status.get("code") or status.get("slug") or status.get("name")
+    if status is None:
+        status = order.get("status_id", "")
+    return str(status).strip().lower()
+
+
+def _advances(prev, stage):
+    if prev in FINAL:
+        return False
+    if stage == "cancelled" or not prev:
+        return True
+    return STAGES.index(stage) > STAGES.index(prev)
+
+
+async def notify(track, stage):
+    """Сообщение клиенту с номера, на который пришёл заказ. False — повторить в следующий опрос"""
+    lang = track.get("lang", "ru")
+    text = T[f"crm_{stage}"].get(lang, T[f"crm_{stage}"]["ru"]).format(id=track.get("oid"), phone=BIZ["phone"])
+    number = NUMBERS.get(track.get("number", "")) or PRIMARY
+    r = await number.post({"messaging_product": "whatsapp", "to": track["phone"], "type": "text",
+                           "text": {"body": text}})
+    # Автомат разомкнут или Graph лежит — повторим; 4xx (окно 24 ч закрыто) повтор не спасёт
+    return r is not None and r.status_code < 500
+
+
+async def sync_once(store, client=None):
+    """Один опрос: очередь, список CRM за дни живых заказов, уведомления, повторная отправка"""
+    report = {"queue_sent": 0, "open": 0, "crm_orders": 0, "pages": 0, "not_modified": 0, "matched": 0,
+              "notified": 0, "resubmitted": 0, "closed": 0, "lost": 0}
+    if not CRM_TOKEN:
+        report["error"] = "CRM_TOKEN not set"
+        return report
+    report["queue_sent"], _ = await drain_queue(store)
+
+    now = datetime.now()
+    days = [(now - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(CRM_TRACK_TTL // 86400)]
+    members = await store.pipeline([["SMEMBERS", f"crm:open:{d}"] for d in days])
+    open_day = {u: d for d, uuids in zip(days, members) for u in uuids or ()}
+    report["open"] = len(open_day)
+    if not open_day:
+        return report
+    uuids = list(open_day)
+    rows = await store.pipeline([["HGETALL", f"crm:track:{u}"] for u in uuids])
+    queue = await store.execute("LRANGE", CRM_QUEUE_KEY, 0, -1)
+    queued = {json.loads(raw)["order"].get("crm_uuid") for raw in queue or ()}
+
+    # CRM считает дни по Астане (UTC+5) — конец окна на день позже
+    start = min(open_day.values())
+    end = (datetime.strptime(max(open_day.values()), "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    try:
+        crm_orders = await fetch_orders(client or crm_http(), start, end, report)
+    except (CircuitOpen, asyncio.TimeoutError, httpx.HTTPError, ValueError) as e:
+        logger.warning("CRM sync: orders fetch failed: %s", e)
+        report["error"] = str(e) or type(e).__name__
+        return report
+    report["crm_orders"] = len(crm_orders)
+    by_uuid = {o["uuid"]: o for o in crm_orders if o.get("uuid")}
+
+    cmds, close = [], []
+    crm_down = False
+    ts = int(time.time())
+    for u, track in zip(uuids, rows):
+        if not track:
+            close.append(u)          # crm:track истёк
+            continue
+        key = f"crm:track:{u}"
+        age = ts - int(track.get("created") or ts)
+        found = by_uuid.get(u)
+        if found is None:
+            if u in queued or crm_down:
+                continue             # очередь дошлёт сама / CRM не принимает
+            missed = int(track.get("missed") or 0) + 1
+            if missed < 2 or age < CRM_RESUBMIT_AFTER:
+                cmds.append(["HSET", key, "missed", missed])
+                continue
+            attempts = int(track.get("attempts") or 0)
+            if attempts >= CRM_RESUBMIT_ATTEMPTS:
+                logger.error("CRM sync: order #%s (%s) is not in CRM after %s attempts",
+                             track.get("oid"), u, attempts)
+                cmds.append(["HSET", key, "stage", "lost"])
+                cmds.append(order_event_command("status", {"id": _oid(track), "crm_uuid": u, "status": None,
+                                                           "stage": "lost"}))
+                close.append(u)
+                report["lost"] += 1
+                continue
+            number = NUMBERS.get(track.get("number", "")) or PRIMARY
+            result = await submit_order(_entry(track), number.trade_point)
+            if crm_failed(result):
+                crm_down = True
+                continue
+            logger.warning("CRM sync: order #%s (%s) was missing, resubmitted: %s",
+                           track.get("oid"), u, result.get("success"))
+            cmds.append(["HSET", key, "missed", 0, "attempts", attempts + 1])
+            report["resubmitted"] += 1
+            continue
+
+        report["matched"] += 1
+        status = _crm_status(found)
+        stage = STATUS_MAP.get(status)
+        fields = []
+        if str(found.get("id", "")) != track.get("crm_id", ""):
+            fields += ["crm_id", found.get("id", "")]
+        if status != track.get("crm_status"):
+            fields += ["crm_status", status]
+            cmds.append(order_event_command("status", {
+                "id": _oid(track), "crm_uuid": u, "crm_id": found.get("id"), "status": status, "stage": stage}))
+        if stage in KITCHEN_DONE and not track.get("done"):
+            cmds += eta.done_commands(u, ts, counted=stage != "cancelled")
+            fields += ["done", ts]
+        if stage == "delivered" and not track.get("delivered"):
+            # Обещанное против фактического (с точностью до периода опроса)
+            cmds += eta.accuracy_commands(track, ts)
+            fields += ["delivered", ts]
+        last = track.get("stage", "")
+        if stage and _advances(last, stage) and await notify(track, stage):
+            fields += ["stage", stage]
+            last = stage
+            report["notified"] += 1
+        if fields:
+            cmds.append(["HSET", key, *fields])
+        if last in FINAL or age > STALE_AFTER:
+            close.append(u)
+
+    for u in close:
+        cmds.append(["SREM", f"crm:open:{open_day[u]}", u])
+        cmds.append(["ZREM", eta.QUEUE_KEY, u])
+    report["closed"] = len(close)
+    if cmds:
+        await store.pipeline(cmds)
+    logger.info("CRM sync: open=%s matched=%s notified=%s resubmitted=%s", report["open"], report["matched"],
+                report["notified"], report["resubmitted"], extra={"crm_sync": report})
+    return report
+
+
+async def worker(store, stop=None, interval=CRM_SYNC_INTERVAL):
+    """sync_once раз в interval секунд на общем keep-alive пуле (crm.crm_http), пока не выставлен stop"""
+    while stop is None or not stop.is_set():
+        try:
+            await sync_once(store)
+        except Exception as e:
+            logger.error("CRM sync failed: %s", e, exc_info=True)
+        if stop is None:
+            await asyncio.sleep(interval)
+            continue
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,121 @@
+"""
+⏰ Кроны из vercel.json без Vercel
+На своём сервере (server.py) Vercel Cron не приходит — планировщик в каждом
+воркере читает "crons" из vercel.json и в нужную минуту (по UTC, как Vercel)
+зовёт тот же путь через ASGI-транспорт с Authorization: Bearer $CRON_SECRET
+(или ?key=VERIFY_TOKEN, если секрет не задан). Чтобы из N воркеров и машин
+задание выполнил один, минуту захватывают SET cron:{путь}:{минута} NX.
+Поддерживается обычный синтаксис из 5 полей: *, */n, a-b, a-b/n, списки.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+try:
+    from .config import CRON_SECRET, VERIFY_TOKEN
+    from .background import spawn
+except ImportError:
+    from config import CRON_SECRET, VERIFY_TOKEN
+    from background import spawn
+
+logger = logging.getLogger(__name__)
+
+VERCEL_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vercel.json")
+# минута, час, день месяца, месяц, день недели (0 и 7 — воскресенье)
+_LIMITS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _field(spec, lo, hi):
+    values = set()
+    for part in spec.split(","):
+        rng, _, step = part.partition("/")
+        if rng == "*":
+            a, b = lo, hi
+        elif "-" in rng:
+            a, b = map(int, rng.split("-"))
+        else:
+            a = b = int(rng)
+            if step:
+                b = hi
+        values.update(range(a, b + 1, int(step or 1)))
+    if not values or min(values) < lo or max(values) > hi:
+        raise ValueError(f"cron field {spec!r} out of range {lo}-{hi}")
+    return values
+
+
+def parse(expr):
+    parts = expr.split()
+    if len(parts) != 5:
+        raise ValueError(f"cron expression needs 5 fields: {expr!r}")
+    fields = [_field(p, lo, hi) for p, (lo, hi) in zip(parts, _LIMITS)]
+    fields[4] = {d % 7 for d in fields[4]}
+    return fields, parts[2] != "*", parts[4] != "*"
+
+
+def matches(schedule, dt):
+    (minute, hour, dom, month, dow), dom_set, dow_set = schedule
+    if dt.minute not in minute or dt.hour not in hour or dt.month not in month:
+        return False
+    day_ok, wday_ok = dt.day in dom, (dt.weekday() + 1) % 7 in dow
+    # Как в cron: заданы оба — достаточно любого
+    if dom_set and dow_set:
+        return day_ok or wday_ok
+    return day_ok and wday_ok
+
+
+def load_crons(path=VERCEL_JSON):
+    """[(путь, расписание)] из vercel.json; нет файла или крона — пусто"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            spec = json.load(f)
+    except FileNotFoundError:
+        return []
+    return [(c["path"], parse(c["schedule"])) for c in spec.get("crons", [])]
+
+
+async def _fire(client, store, path, minute):
+    if store is not None:
+        lock = f"cron:{path}:{minute:%Y%m%d%H%M}"
+        if not await store.execute("SET", lock, os.getpid(), "NX", "EX", 3600):
+            return
+    headers, params = {}, {}
+    if CRON_SECRET:
+        headers["Authorization"] = f"Bearer {CRON_SECRET}"
+    else:
+        params["key"] = VERIFY_TOKEN
+    try:
+        resp = await client.get(path, headers=headers, params=params)
+        logger.info("Cron %s → %s", path, resp.status_code, extra={"cron": path})
+    except Exception as e:
+        logger.error("Cron %s failed: %s", path, e)
+
+
+async def run(app, store, stop, crons=None):
+    """Цикл планировщика до stop (asyncio.Event); задания идут фоновыми задачами"""
+    crons = load_crons() if crons is None else crons
+    if not crons:
+        return
+    logger.info("Cron scheduler: %s", ", ".join(path for path, _ in crons))
+    transport = httpx.ASGITransport(app=app)
+    fires = set()
+    async with httpx.AsyncClient(transport=transport, base_url="http://cron", timeout=None) as client:
+        while not stop.is_set():
+            minute = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+            for path, schedule in crons:
+                if matches(schedule, minute):
+                    task = spawn(_fire(client, store, path, minute), name=f"cron {path}")
+                    fires.add(task)
+                    task.add_done_callback(fires.discard)
+            wake = minute + timedelta(minutes=1)
+            try:
+                await asyncio.wait_for(stop.wait(), (wake - datetime.now(timezone.utc)).total_seconds())
+            except asyncio.TimeoutError:
+                pass
+        # Клиент закрывается только после начатых заданий
+        if fires:
+            await asyncio.wait(fires)
@@ -0,0 +1,129 @@
+"""
+⏱ Время доставки с учётом загрузки кухни
+Вместо постоянного BIZ["delivery_time"] — оценка по живой очереди:
+  • kitchen:queue — ZSET незакрытых заказов (uuid → время заказа), пишется
+    store_order тем же пайплайном; сверка с CRM (api/crm_sync.py) убирает заказ,
+    когда кухня его отдала (в пути / доставлен / отменён);
+  • kitchen:done — ZSET отданных кухней заказов за ETA_RATE_WINDOW: скорость
+    кухни = отдано за окно / окно, но не ниже ETA_DEFAULT_RATE (в тихий час
+    скорость ограничена спросом, а не кухней).
+На подтверждении: заказов впереди — ZCOUNT (O(log n)), оценка —
+ETA_PREP + впереди / скорость + ETA_DELIVERY минут, показывается вилкой
+«от — от+ETA_SPREAD». Фактическое время доставки сверка пишет в eta:{день}
+(сколько заказов, суммарная и абсолютная ошибка, опоздания) — /eta для подстройки.
+"""
+
+import math
+import time
+from datetime import datetime
+
+try:
+    from .config import (
+        BIZ, ETA_PREP, ETA_DELIVERY, ETA_SPREAD, ETA_RATE_WINDOW, ETA_DEFAULT_RATE, ETA_MIN_SAMPLES,
+        ETA_QUEUE_MAX_AGE,
+    )
+    from .storage import KITCHEN_QUEUE_KEY as QUEUE_KEY
+except ImportError:
+    from config import (
+        BIZ, ETA_PREP, ETA_DELIVERY, ETA_SPREAD, ETA_RATE_WINDOW, ETA_DEFAULT_RATE, ETA_MIN_SAMPLES,
+        ETA_QUEUE_MAX_AGE,
+    )
+    from storage import KITCHEN_QUEUE_KEY as QUEUE_KEY
+
+DONE_KEY = "kitchen:done"
+ACCURACY_TTL = 86400 * 400
+
+
+def _round5(minutes):
+    return int(math.ceil(minutes / 5) * 5)
+
+
+def format_eta(lo, hi):
+    return f"{lo}-{hi}"
+
+
+def parse_eta(text):
+    """"35-55" → (35, 55); постоянное значение из BIZ тоже понимает"""
+    lo, _, hi = str(text or BIZ["delivery_time"]).partition("-")
+    return int(lo), int(hi or lo)
+
+
+# ==========================================
+# 🧮 ОЦЕНКА
+# ==========================================
+
+async def estimate(store, now=None):
+    """{"eta": "35-55", "ahead": N, "rate": заказов/мин} — один пайплайн; чистит устаревшее"""
+    now = now or time.time()
+    res = await store.pipeline([
+        # Заказ, который сверка так и не закрыла (CRM не ответила), очередь не держит
+        ["ZREMRANGEBYSCORE", QUEUE_KEY, "-inf", now - ETA_QUEUE_MAX_AGE],
+        ["ZCOUNT", QUEUE_KEY, "-inf", now],
+        ["ZREMRANGEBYSCORE", DONE_KEY, "-inf", now - ETA_RATE_WINDOW],
+        ["ZCARD", DONE_KEY],
+    ])
+    ahead, done = int(res[1] or 0), int(res[3] or 0)
+    rate = ETA_DEFAULT_RATE
+    if done >= ETA_MIN_SAMPLES:
+        rate = max(rate, done / (ETA_RATE_WINDOW / 60))
+    lo = _round5(ETA_PREP + ahead / rate + ETA_DELIVERY)
+    return {"eta": format_eta(lo, lo + ETA_SPREAD), "ahead": ahead, "rate": round(rate, 3)}
+
+
+async def safe_estimate(store):
+    """Оценка или постоянное BIZ["delivery_time"], если хранилища нет или оно не ответило"""
+    if store is None:
+        return BIZ["delivery_time"]
+    try:
+        return (await estimate(store))["eta"]
+    except Exception:
+        return BIZ["delivery_time"]
+
+
+# ==========================================
+# 📝 ЗАПИСЬ
+# ==========================================
+
+def done_commands(uuid, ts, counted=True):
+    """Кухня отдала заказ: из очереди — в отданные (отменённый скорость не учитывает)"""
+    cmds = [["ZREM", QUEUE_KEY, uuid]]
+    if counted:
+        cmds.append(["ZADD", DONE_KEY, ts, uuid])
+    return cmds
+
+
+def accuracy_commands(track, ts):
+    """Обещанное против фактического для доставленного заказа — счётчики eta:{день}"""
+    created = int(track.get("created") or ts)
+    lo, hi = parse_eta(track.get("eta"))
+    actual = (ts - created) / 60
+    error = round(actual - (lo + hi) / 2)
+    key = f"eta:{datetime.fromtimestamp(created):%Y-%m-%d}"
+    return [
+        ["HINCRBY", key, "orders", 1],
+        ["HINCRBY", key, "minutes", round(actual)],
+        ["HINCRBY", key, "error", error],
+        ["HINCRBY", key, "abs_error", abs(error)],
+        ["HINCRBY", key, "late", int(actual > hi)],
+        ["HINCRBY", key, "early", int(actual < lo)],
+        ["EXPIRE", key, ACCURACY_TTL],
+    ]
+
+
+def accuracy_report(rows):
+    """Сумма eta:{день} за период → средние ошибки и доли опозданий"""
+    total = {}
+    for row in rows:
+        for k, v in row.items():
+            total[k] = total.get(k, 0) + int(v)
+    n = total.get("orders", 0)
+    if not n:
+        return {"orders": 0}
+    return {
+        "orders": n,
+        "avg_minutes": round(total.get("minutes", 0) / n, 1),
+        "mean_error": round(total.get("error", 0) / n, 1),
+        "mean_abs_error": round(total.get("abs_error", 0) / n, 1),
+        "late": round(total.get("late", 0) / n, 3),
+        "early": round(total.get("early", 0) / n, 3),
+    }
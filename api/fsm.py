@@ -0,0 +1,188 @@
+"""
+🧭 Табличный конечный автомат диалога
+Переход — маленькая async-функция, зарегистрированная на ключ
+(состояние, вид события, значение). Поиск — несколько обращений к dict,
+без перебора веток. Таблица открыта для чтения: её можно выгрузить
+графом (DOT) и проверить любой переход, не отправляя ничего в Graph.
+
+Виды событий:
+  cmd    — набранное слово целиком (без регистра): «стоп», «привет»
+  id     — id кнопки/строки списка целиком: "btn_cart"
+  prefix — id по префиксу до первого «_»: "add_" → аргумент "b1_beef"
+  any    — всё остальное в этом состоянии (свободный текст)
+
+Порядок поиска:
+  1. (*, cmd)                            — глобальные команды
+  2. (state, id), (state, prefix)        — кнопки конкретного шага
+  3. (state, any), если переход modal    — шаг, который перехватывает всё
+  4. (*, id), (*, prefix)                — глобальные кнопки и их текстовые синонимы
+  5. (state, any)                        — свободный текст шага
+  6. (*, any)                            — по умолчанию
+"""
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+ANY = "*"
+KINDS = ("cmd", "id", "prefix", "any")
+
+
+class Transition:
+    __slots__ = ("name", "state", "kind", "key", "fn", "to", "modal",
+                 "calls", "errors", "total_ms", "max_ms")
+
+    def __init__(self, fn, state, kind, key, to, modal):
+        self.name = fn.__name__
+        self.fn = fn
+        self.state, self.kind, self.key = state, kind, key
+        self.to = tuple(to)
+        self.modal = modal
+        self.calls = self.errors = 0
+        self.total_ms = self.max_ms = 0.0
+
+    def describe(self):
+        return {
+            "name": self.name, "state": self.state, "kind": self.kind, "key": self.key,
+            "to": list(self.to), "modal": self.modal, "calls": self.calls, "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+def _prefix(text):
+    head, sep, _ = text.partition("_")
+    return head + sep if sep else None
+
+
+class Router:
+    def __init__(self):
+        self._table = {}
+        self._aliases = {}
+
+    # ------------------------------------------
+    # регистрация
+    # ------------------------------------------
+
+    def on(self, *keys, state=ANY, kind="id", to=(), modal=False):
+        """Декоратор перехода: @fsm.on("btn_cart", "clear_cart", state="main", to=("main",))"""
+        if kind not in KINDS:
+            raise ValueError(f"unknown event kind: {kind}")
+        if kind == "any":
+            keys = (None,)
+        elif kind == "prefix" and not all(k.endswith("_") for k in keys):
+            raise ValueError(f"prefix keys must end with '_': {keys}")
+        if isinstance(to, str):
+            to = (to,)
+        states = (state,) if isinstance(state, str) else tuple(state)
+
+        def wrap(fn):
+            for st in states:
+                for key in keys:
+                    k = (st, kind, key.lower() if kind == "cmd" else key)
+                    if k in self._table:
+                        raise ValueError(f"duplicate transition {k}: {self._table[k].name} / {fn.__name__}")
+                    self._table[k] = Transition(fn, st, kind, k[2], to, modal)
+            return fn
+        return wrap
+
+    def alias(self, target_id, *words):
+        """Набранные слова, которые ведут себя как нажатие кнопки target_id"""
+        for w in words:
+            self._aliases[w.lower().strip()] = target_id
+
+    # ------------------------------------------
+    # диспетчеризация
+    # ------------------------------------------
+
+    def resolve(self, state, text):
+        """(Transition, аргумент) или (None, text)"""
+        table = self._table
+        txt = text.lower().strip()
+        prefix = _prefix(text)
+
+        tr = table.get((ANY, "cmd", txt))
+        if tr:
+            return tr, txt
+
+        tr = table.get((state, "id", text))
+        if tr:
+            return tr, text
+        if prefix:
+            tr = table.get((state, "prefix", prefix))
+            if tr:
+                return tr, text[len(prefix):]
+
+        local_any = table.get((state, "any", None))
+        if local_any and local_any.modal:
+            return local_any, text
+
+        bid = self._aliases.get(txt, text)
+        tr = table.get((ANY, "id", bid))
+        if tr:
+            return tr, bid
+        prefix = _prefix(bid)
+        if prefix:
+            tr = table.get((ANY, "prefix", prefix))
+            if tr:
+                return tr, bid[len(prefix):]
+
+        if local_any:
+            return local_any, text
+        tr = table.get((ANY, "any", None))
+        return tr, text
+
+    async def dispatch(self, state, text, *args):
+        """Находит переход и вызывает fn(*args, arg); возвращает Transition или None"""
+        tr, arg = self.resolve(state, text)
+        if tr is None:
+            logger.warning("FSM: no transition for state=%s text=%r", state, text)
+            return None
+        start = time.perf_counter()
+        try:
+            await tr.fn(*args, arg)
+        except Exception:
+            tr.errors += 1
+            raise
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            tr.calls += 1
+            tr.total_ms += ms
+            if ms > tr.max_ms:
+                tr.max_ms = ms
+            logger.debug("FSM %s [%s] %s:%s → %s (%.1f ms)", tr.name, state, tr.kind, tr.key, tr.to, ms)
+        return tr
+
+    # ------------------------------------------
+    # интроспекция
+    # ------------------------------------------
+
+    def transitions(self):
+        return list(self._table.values())
+
+    def aliases(self):
+        return dict(self._aliases)
+
+    def describe(self):
+        return {
+            "transitions": [tr.describe() for tr in self._table.values()],
+            "aliases": self.aliases(),
+        }
+
+    def reset_stats(self):
+        for tr in self._table.values():
+            tr.calls = tr.errors = 0
+            tr.total_ms = tr.max_ms = 0.0
+
+    def to_dot(self):
+        """Граф переходов для Graphviz: dot -Tsvg fsm.dot > fsm.svg"""
+        lines = ["digraph fsm {", "  rankdir=LR;", '  node [shape=box, style=rounded];',
+                 f'  "{ANY}" [shape=ellipse, label="любое состояние"];']
+        for tr in self._table.values():
+            label = tr.name if tr.kind == "any" else f"{tr.key}"
+            style = ", style=dashed" if tr.kind in ("cmd", "any") else ""
+            for dst in tr.to or (tr.state,):
+                lines.append(f'  "{tr.state}" -> "{dst}" [label="{label}"{style}];')
+        lines.append("}")
+        return "\n".join(lines)
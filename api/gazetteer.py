@@ -0,0 +1,213 @@
+"""
+🗺 Справочник улиц Тараза: адрес → улица, дом, зона доставки, координаты
+Данные — api/gazetteer.json (правится без кода): улицы с синонимами (рус/каз/лат)
+и опорными точками по номерам домов, кольца зон от кухни со стоимостью доставки.
+Загружается один раз при первом адресе и раскладывается в префиксное дерево
+нормализованных синонимов (регистр, ё, казахские буквы, «ул./пр./мкр» убраны).
+Разбор — один проход регулярного выражения по словам и один спуск по дереву:
+  • «кв/подъезд/этаж/дом N» и «N этаж/дом» — в свои поля, где бы ни стояли;
+  • улица — самый длинный синоним с начала слова; синоним от 5 букв совпадает
+    и с падежной формой («Жайбекова» → «Жайбеков»);
+  • дом — первое число после улицы; координаты — между опорными точками улицы;
+  • зона — по расстоянию от кухни, дальше последнего кольца — None (уточнит оператор);
+  • «5 мкр», «мкр 5», «5 микрорайон» — улица «5 мкр» (координат нет);
+  • улицы нет в справочнике — улица и дом прежним разбором по шаблону.
+Геоточка из WhatsApp (locate) сразу даёт зону и координаты.
+"""
+
+import json
+import math
+import os
+import re
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.json")
+STEM_MIN = 5
+
+_FOLD = str.maketrans("ёәғқңөұүһі", "еагкноуухи")
+_TOKEN = re.compile(r"\d+(?:[a-zа-я](?![a-zа-я]))?(?:/\d+)?|[^\W\d_]+(?:-[^\W\d_]+)?")
+_index = None
+
+
+def normalize(text):
+    return text.lower().translate(_FOLD)
+
+
+class _Index:
+    def __init__(self, data):
+        self.origin = data["origin"]
+        self.zones = sorted(data["zones"], key=lambda z: z["km"])
+        self.stop = {normalize(w) for w in data["stopwords"]}
+        self.fields = {normalize(w): field for field, words in data["fields"].items() for w in words}
+        self.districts = {normalize(w) for w in data.get("districts", ())}
+        self.streets = data["streets"]
+        for st in self.streets:
+            st["points"] = sorted(st["points"])
+        # Префиксное дерево: символ → узел, "" → индекс улицы
+        self.trie = {}
+        for i, st in enumerate(self.streets):
+            for alias in {st["name"], *st.get("aliases", ())}:
+                words = [w for w in _TOKEN.findall(normalize(alias)) if w not in self.stop]
+                if not words:
+                    continue
+                node = self.trie
+                for ch in " ".join(words):
+                    node = node.setdefault(ch, {})
+                node.setdefault("", i)
+
+    def match(self, s):
+        """(индекс улицы, длина совпадения) — самый длинный синоним с начала s"""
+        node, best = self.trie, None
+        for pos, ch in enumerate(s):
+            node = node.get(ch)
+            if node is None:
+                break
+            end = pos + 1
+            if "" in node and (end == len(s) or s[end] == " " or end >= STEM_MIN):
+                best = (node[""], end)
+        return best
+
+
+def _load():
+    global _index
+    if _index is None:
+        with open(DATA_FILE, encoding="utf-8") as f:
+            _index = _Index(json.load(f))
+    return _index
+
+
+def _house(building):
+    digits = re.match(r"\d+", building or "")
+    return int(digits.group()) if digits else None
+
+
+def _interpolate(points, house):
+    """Координаты дома между опорными точками улицы (вне диапазона — крайняя точка)"""
+    if house is None or len(points) == 1:
+        return points[len(points) // 2][1:]
+    if house <= points[0][0]:
+        return points[0][1:]
+    for (n1, la1, lo1), (n2, la2, lo2) in zip(points, points[1:]):
+        if house <= n2:
+            k = (house - n1) / (n2 - n1) if n2 != n1 else 0
+            return la1 + (la2 - la1) * k, lo1 + (lo2 - lo1) * k
+    return points[-1][1:]
+
+
+def _regex_parse(address):
+    """Прежний разбор по шаблону: поля по ключевым словам, дом — число в конце"""
+    result = {}
+    for field, pattern in (("room", r"(?:кв\.?|квартира)\s*(\d+)"),
+                           ("entrance", r"(?:подъезд|подьезд|под\.?)\s*(\d+)"),
+                           ("floor", r"(?:этаж|эт\.?)\s*(\d+)")):
+        found = re.search(pattern, address, re.IGNORECASE)
+        result[field] = found.group(1) if found else None
+    clean = re.sub(r"(?:кв\.?|квартира|подъезд|подьезд|под\.?|этаж|эт\.?|\bдом|\bд\.?)\s*\d+\S*", "",
+                   address, flags=re.IGNORECASE)
+    clean = re.sub(r"^[,\s]+|[,\s]+$", "", clean)
+    parts = re.match(r"^(.+?)\s+(\d+\S*)\s*$", clean)
+    if parts:
+        result["street"], result["building"] = parts.group(1).strip(" ,"), parts.group(2).strip()
+    else:
+        result["street"], result["building"] = clean or None, None
+    return result
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    # На масштабе города плоское приближение точнее, чем нужно
+    dx = (lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2)) * 111.32
+    dy = (lat2 - lat1) * 110.57
+    return math.hypot(dx, dy)
+
+
+def locate(lat, lon):
+    """Зона доставки точки: {"lat", "lon", "km", "zone", "fee"} (zone/fee None — вне колец)"""
+    idx = _load()
+    km = distance_km(idx.origin[0], idx.origin[1], lat, lon)
+    zone = next((z for z in idx.zones if km <= z["km"]), None)
+    return {"lat": round(lat, 6), "lon": round(lon, 6), "km": round(km, 2),
+            "zone": zone["id"] if zone else None, "fee": zone["fee"] if zone else None}
+
+
+def zone_label(zone_id, lang="ru"):
+    zone = next((z for z in _load().zones if z["id"] == zone_id), None)
+    return zone.get(lang, zone["ru"]) if zone else ""
+
+
+def parse(address):
+    """Адрес свободным текстом → {"street", "building", "entrance", "floor", "room",
+    "resolved", "lat", "lon", "km", "zone", "fee"}; улицы нет в справочнике —
+    resolved False, улица «N мкр» или по прежнему шаблону, координат и зоны нет"""
+    result = {"street": None, "building": None, "entrance": None, "floor": None, "room": None,
+              "resolved": False, "lat": None, "lon": None, "km": None, "zone": None, "fee": None}
+    if not address:
+        return result
+    idx = _load()
+    tokens = _TOKEN.findall(normalize(address))
+    rest = []                    # слова и числа без полей и служебных слов
+    district = None              # номер микрорайона: «5 мкр», «мкр 5»
+
+    def number(k):
+        return k < len(tokens) and tokens[k][0].isdigit()
+
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        field = idx.fields.get(tok)
+        if field and number(i + 1):
+            if result[field] is None:
+                result[field] = tokens[i + 1]
+            i += 2
+            continue
+        if number(i) and i + 1 < len(tokens):
+            after = tokens[i + 1]
+            if after in idx.districts and district is None:
+                district = tok
+                i += 2
+                continue
+            # «4 дом», «3 этаж» — число перед словом, за которым числа нет
+            if idx.fields.get(after) and not number(i + 2):
+                if result[idx.fields[after]] is None:
+                    result[idx.fields[after]] = tok
+                i += 2
+                continue
+        if tok in idx.districts and number(i + 1) and district is None:
+            district = tokens[i + 1]
+            i += 2
+            continue
+        if tok not in idx.stop:
+            rest.append(tok)
+        i += 1
+
+    street_at = None
+    for start, tok in enumerate(rest):
+        if tok[0].isdigit():
+            continue
+        end = start
+        while end < len(rest) and not rest[end][0].isdigit():
+            end += 1
+        hit = idx.match(" ".join(rest[start:end]))
+        if hit:
+            street_idx, length = hit
+            street_at = start + " ".join(rest[start:end])[:length].count(" ") + 1
+            result["street"] = idx.streets[street_idx]["name"]
+            result["resolved"] = True
+            break
+
+    numbers = [(k, tok) for k, tok in enumerate(rest) if tok[0].isdigit()]
+    if result["building"] is None and numbers:
+        after = [tok for k, tok in numbers if street_at is not None and k >= street_at]
+        result["building"] = after[0] if after else numbers[0][1]
+
+    if not result["resolved"]:
+        if district:
+            result["street"] = f"{district} мкр"
+            return result
+        fallback = _regex_parse(address)
+        result["street"] = fallback["street"]
+        for field in ("building", "entrance", "floor", "room"):
+            if result[field] is None:
+                result[field] = fallback[field]
+        return result
+    lat, lon = _interpolate(idx.streets[street_idx]["points"], _house(result["building"]))
+    result.update(locate(lat, lon))
+    return result
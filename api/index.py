@@ -4,66 +4,295 @@ Vercel Serverless + Upstash Redis + Meta Cloud API
 С поддержкой текстовых заказов
 """
 
-import logging
+import asyncio
 import json
+import logging
+import re
+import uuid
 import httpx
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta
 from fastapi import FastAPI, Request, HTTPException, Query
-from fastapi.responses import PlainTextResponse
-from upstash_redis import Redis
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
 try:
     from .config import (
-        WHATSAPP_TOKEN, WHATSAPP_PHONE_ID, VERIFY_TOKEN,
-        TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID,
-        UPSTASH_REDIS_REST_URL, UPSTASH_REDIS_REST_TOKEN,
-        BIZ, CATEGORIES, MENU_ITEMS, ITEMS_BY_ID, VARIANTS_BY_ID, t,
-        parse_text_order,
+        VERIFY_TOKEN, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, GRAPH_API_URL, TELEGRAM_API_URL,
+        CRON_SECRET, COMPACT_BUDGET, RATE_LIMIT, RATE_WINDOW, REDIS_TIMEOUT,
+        CRON_SCHEDULER, SHUTDOWN_DRAIN_TIMEOUT, CONVO_MAXLEN, CONVO_TEXT_MAX, BIZ, t, parse_text_order,
     )
 except ImportError:
     from config import (
-        WHATSAPP_TOKEN, WHATSAPP_PHONE_ID, VERIFY_TOKEN,
-        TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID,
-        UPSTASH_REDIS_REST_URL, UPSTASH_REDIS_REST_TOKEN,
-        BIZ, CATEGORIES, MENU_ITEMS, ITEMS_BY_ID, VARIANTS_BY_ID, t,
-        parse_text_order,
+        VERIFY_TOKEN, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, GRAPH_API_URL, TELEGRAM_API_URL,
+        CRON_SECRET, COMPACT_BUDGET, RATE_LIMIT, RATE_WINDOW, REDIS_TIMEOUT,
+        CRON_SCHEDULER, SHUTDOWN_DRAIN_TIMEOUT, CONVO_MAXLEN, CONVO_TEXT_MAX, BIZ, t, parse_text_order,
     )
 
-logging.basicConfig(format="%(asctime)s [%(levelname)s] %(message)s", level=logging.INFO)
-logger = logging.getLogger(__name__)
+try:
+    from .logs import setup_logging, RequestIdMiddleware, REQUEST_ID
+except ImportError:
+    from logs import setup_logging, RequestIdMiddleware, REQUEST_ID
+
+try:
+    from .fsm import Router, ANY
+except ImportError:
+    from fsm import Router, ANY
+
+try:
+    from .menu import current_menu, refresh, refresh_menu, reprice_cart
+except ImportError:
+    from menu import current_menu, refresh, refresh_menu, reprice_cart
 
 try:
-    from .crm import send_order_to_crm
+    from .breaker import breaker, CircuitOpen, describe_all as describe_breakers
 except ImportError:
-    from crm import send_order_to_crm
+    from breaker import breaker, CircuitOpen, describe_all as describe_breakers
+
+try:
+    from . import profiler, eta, background, gazetteer
+    from .background import spawn
+except ImportError:
+    import profiler, eta, background, gazetteer
+    from background import spawn
+
+try:
+    from .wa_numbers import NUMBERS, current_number, use_number, close_numbers
+    from .broadcast import resolve_number
+    from .crm import crm_http, close_crm_http
+except ImportError:
+    from wa_numbers import NUMBERS, current_number, use_number, close_numbers
+    from broadcast import resolve_number
+    from crm import crm_http, close_crm_http
+
+setup_logging()
+logger = logging.getLogger(__name__)
+# Статусы отправки — самые частые строки, их удобно сэмплировать отдельно
+wa_logger = logging.getLogger(f"{__name__}.wa")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Пулы создаются лениво при первом запросе, закрываются здесь (см. _shutdown)
+    await _startup()
+    try:
+        yield
+    finally:
+        await _shutdown()
 
-app = FastAPI(title="WhatsApp Bot — Дядя Стейк Бургер")
 
-WA_URL = f"https://graph.facebook.com/v22.0/{WHATSAPP_PHONE_ID}/messages"
-WA_HEADERS = {"Authorization": f"Bearer {WHATSAPP_TOKEN}", "Content-Type": "application/json"}
+app = FastAPI(title="WhatsApp Bot — Дядя Стейк Бургер", lifespan=lifespan)
+app.add_middleware(RequestIdMiddleware)
 
 # ==========================================
-# 💾 UPSTASH REDIS
+# 🔌 ОБЩИЕ КЛИЕНТЫ (создаются лениво)
 # ==========================================
+# upstash_redis тянет aiohttp (~250 мс импорта), crm нужен только на
+# confirm_yes — поэтому всё тяжёлое импортируется при первом использовании.
 
-redis = None
-if UPSTASH_REDIS_REST_URL and UPSTASH_REDIS_REST_TOKEN:
-    redis = Redis(url=UPSTASH_REDIS_REST_URL, token=UPSTASH_REDIS_REST_TOKEN)
+_storage = None
+_storage_ready = False
+_sessions = None
+_http = None
+_http_loop = None
 
 
-def get_session(phone):
-    if redis:
+def get_storage():
+    """Бэкенд хранилища из STORAGE_BACKEND (None — бот работает без памяти)"""
+    global _storage, _storage_ready
+    if not _storage_ready:
         try:
-            data = redis.get(f"session:{phone}")
-            if data:
-                s = json.loads(data) if isinstance(data, str) else data
-                last = datetime.fromisoformat(s.get("last_activity", datetime.now().isoformat()))
-                if datetime.now() - last > timedelta(minutes=30):
-                    s = new_session(phone)
-                s["last_activity"] = datetime.now().isoformat()
-                return s
+            from .storage import create_storage
+        except ImportError:
+            from storage import create_storage
+        _storage = create_storage()
+        if _storage is not None:
+            # Redis тормозит или лежит — автомат размыкается, и кэш сессий сразу
+            # отвечает из памяти вместо ожидания таймаута на каждом запросе
+            _storage.breaker = breaker("redis", timeout=REDIS_TIMEOUT)
+        _storage_ready = True
+    return _storage
+
+
+def session_cache():
+    """L1-кэш сессий поверх хранилища (None — хранилища нет)"""
+    global _sessions
+    if _sessions is None and get_storage() is not None:
+        try:
+            from .session_cache import SessionCache
+        except ImportError:
+            from session_cache import SessionCache
+        _sessions = SessionCache(get_storage())
+    return _sessions
+
+
+def http_client():
+    """Один keep-alive пул на процесс (пересоздаётся, если сменился event loop)"""
+    global _http, _http_loop
+    loop = asyncio.get_running_loop()
+    if _http is None or _http_loop is not loop:
+        _http = httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_keepalive_connections=20))
+        _http_loop = loop
+    return _http
+
+
+_crm_flushing = False
+_crm_queued = False
+
+
+def crm_sync_module():
+    try:
+        from . import crm_sync
+    except ImportError:
+        import crm_sync
+    return crm_sync
+
+
+async def send_order_to_crm(s):
+    """Заказ в CRM под автоматом; CRM недоступна — заказ встаёт в очередь crm:queue"""
+    crm_sync = crm_sync_module()
+    trade_point = current_number().trade_point
+    result = await crm_sync.submit_order(s, trade_point)
+    if crm_sync.crm_failed(result):
+        await queue_crm_order(s, trade_point)
+        return {**result, "queued": True}
+    if result.get("success") and _crm_queued:
+        # CRM снова отвечает — досылаем то, что этот инстанс поставил в очередь
+        spawn(flush_crm_queue(), name="crm-flush")
+    return result
+
+
+async def queue_crm_order(s, trade_point):
+    global _crm_queued
+    store = get_storage()
+    if not store:
+        return
+    entry = {"phone": s["phone"], "cart": s["cart"], "order": s["order"], "trade_point": trade_point,
+             "queued_at": datetime.now().isoformat()}
+    try:
+        await store.execute("LPUSH", crm_sync_module().CRM_QUEUE_KEY, json.dumps(entry, ensure_ascii=False))
+        _crm_queued = True
+        logger.warning("CRM unavailable, order #%s queued", s["order"].get("id"))
+    except Exception as e:
+        logger.error("CRM queue error for #%s: %s", s["order"].get("id"), e)
+
+
+async def flush_crm_queue(limit=20):
+    """Досылает очередь, пока CRM отвечает; запускается после успешной отправки"""
+    global _crm_flushing, _crm_queued
+    store = get_storage()
+    if _crm_flushing or not store:
+        return 0
+    _crm_flushing = True
+    sent = 0
+    try:
+        sent, empty = await crm_sync_module().drain_queue(store, limit)
+        if empty:
+            _crm_queued = False
+    except Exception as e:
+        logger.error("CRM queue flush error: %s", e)
+    finally:
+        _crm_flushing = False
+    return sent
+
+
+def compact_module():
+    try:
+        from . import compact
+    except ImportError:
+        import compact
+    return compact
+
+
+async def set_optout(store, phone, opted_out):
+    try:
+        from .broadcast import set_optout as _set
+    except ImportError:
+        from broadcast import set_optout as _set
+    await _set(store, phone, opted_out)
+
+
+async def prewarm():
+    """Параллельно открывает TCP+TLS к Graph API (пул каждого номера) и хранилищу"""
+    async def graph():
+        await asyncio.gather(*(n.client().get(f"{GRAPH_API_URL}/", timeout=5) for n in NUMBERS.values()))
+
+    async def storage():
+        store = get_storage()
+        if store:
+            await store.ping()
+        await refresh(store)
+
+    results = await asyncio.gather(graph(), storage(), return_exceptions=True)
+    for name, res in zip(("graph", "storage"), results):
+        if isinstance(res, Exception):
+            logger.warning("Prewarm %s failed: %s", name, res)
+
+
+# Планировщик кронов — только на своём сервере (server.py), на Vercel их шлёт платформа
+_cron = {"task": None, "stop": None}
+
+
+async def _startup():
+    # Пул к CRM — в loop сервера; закрывается в close_clients()
+    crm_http()
+    spawn(prewarm(), name="prewarm")
+    if CRON_SCHEDULER:
+        try:
+            from . import cron
+        except ImportError:
+            import cron
+        _cron["stop"] = asyncio.Event()
+        _cron["task"] = asyncio.get_running_loop().create_task(
+            cron.run(app, get_storage(), _cron["stop"]), name="cron")
+
+
+async def close_clients():
+    global _http
+    if _storage is not None:
+        await _storage.close()
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+    await close_crm_http()
+    await close_numbers()
+
+
+async def _shutdown():
+    """Останов воркера: новые кроны не начинаются, фоновые задачи дописываются,
+    грязные сессии уходят в Redis — и только потом закрываются пулы"""
+    if _cron["task"] is not None:
+        _cron["stop"].set()
+        try:
+            await asyncio.wait_for(_cron["task"], SHUTDOWN_DRAIN_TIMEOUT)
         except Exception as e:
-            logger.error(f"Redis get error: {e}")
+            logger.warning("Cron scheduler stop: %r", e)
+    await background.drain(SHUTDOWN_DRAIN_TIMEOUT)
+    if _sessions is not None and _sessions.dirty_count():
+        await _sessions.flush()
+    await close_clients()
+
+
+# ==========================================
+# 💾 СЕССИИ И ЗАКАЗЫ
+# ==========================================
+
+async def get_session(phone):
+    # Ошибки Redis обрабатывает кэш: при недоступности отдаёт копию из памяти.
+    # Профиль клиента приходит тем же запросом и кладётся в s["_profile"].
+    # Ключи — в пространстве номера, на который написал клиент
+    cache = session_cache()
+    if cache:
+        s, profile = await cache.load(current_number().scope(phone))
+        if s:
+            last = datetime.fromisoformat(s.get("last_activity", datetime.now().isoformat()))
+            if datetime.now() - last > timedelta(minutes=30):
+                s = new_session(phone)
+            s["last_activity"] = datetime.now().isoformat()
+        else:
+            s = new_session(phone)
+        s["_profile"] = profile
+        return s
     return new_session(phone)
 
 
@@ -76,17 +305,45 @@ def new_session(phone):
     }
 
 
-def save_session(phone, s):
-    if redis:
+async def save_session(phone, s, state_from=None, convo=None):
+    """state_from — состояние до сообщения: переход попадает в воронку тем же пайплайном;
+    convo — записи переписки этого сообщения (поток convo:{номер}), туда же"""
+    cache = session_cache()
+    if cache:
         try:
-            redis.set(f"session:{phone}", json.dumps(s, ensure_ascii=False), ex=3600)
+            from .storage import funnel_commands, conversation_commands
+        except ImportError:
+            from storage import funnel_commands, conversation_commands
+        scoped = current_number().scope(phone)
+        extra = []
+        if state_from is not None:
+            extra += funnel_commands(phone, state_from, s.get("state", "new"))
+        if convo:
+            extra += conversation_commands(scoped, convo, CONVO_MAXLEN)
+        await cache.save(scoped, s, extra)
+
+
+async def next_order_id(store):
+    """Номер заказа: день + порядковый за день (2610190007) — уникален в пределах
+    TTL заказа и архива; без Redis — день и время до миллисекунд (длиннее, не пересекаются)"""
+    now = datetime.now()
+    if store:
+        try:
+            key = f"orders:seq:{now:%Y%m%d}"
+            seq, _ = await store.pipeline([["INCR", key], ["EXPIRE", key, 86400 * 2]])
+            return int(f"{now:%y%m%d}{int(seq):04d}")
         except Exception as e:
-            logger.error(f"Redis set error: {e}")
+            logger.warning("Order id counter unavailable: %s", e)
+    return int(f"{now:%y%m%d%H%M%S}{now.microsecond // 1000:03d}")
 
 
-def save_order(s):
-    oid = int(datetime.now().strftime("%H%M%S"))
-    if redis:
+async def save_order(s):
+    store = get_storage()
+    oid = await next_order_id(store)
+    s["order"]["id"] = oid
+    # uuid, с которым заказ уйдёт в CRM (и при повторной отправке тоже) — по нему идёт сверка
+    s["order"]["crm_uuid"] = str(uuid.uuid4())
+    if store:
         try:
             order = {
                 "id": oid,
@@ -96,14 +353,29 @@ def save_order(s):
                 "address": s["order"].get("address", ""),
                 "contact_phone": s["order"].get("phone", ""),
                 "payment": s["order"].get("payment", ""),
+                "payment_id": s["order"].get("payment_id", ""),
                 "comment": s["order"].get("comment", ""),
+                "zone": s["order"].get("zone"),
+                "delivery_fee": s["order"].get("delivery_fee"),
+                "lat": s["order"].get("lat"),
+                "lon": s["order"].get("lon"),
+                "geo": bool(s["order"].get("geo")),
                 "status": "new",
+                "number": current_number().phone_id,
+                "lang": s.get("lang", "ru"),
+                "eta": s["order"].get("eta") or BIZ["delivery_time"],
+                "crm_uuid": s["order"]["crm_uuid"],
                 "created_at": datetime.now().isoformat(),
             }
-            redis.set(f"order:{oid}", json.dumps(order, ensure_ascii=False), ex=86400 * 7)
-            redis.lpush("orders:list", str(oid))
+            try:
+                from .storage import merge_profile
+            except ImportError:
+                from storage import merge_profile
+            profile = merge_profile(s.get("_profile"), order)
+            await store.store_order(order, profile=profile, scope=current_number().scope(s["phone"]))
+            s["_profile"] = profile
         except Exception as e:
-            logger.error(f"Redis order save error: {e}")
+            logger.error("Redis order save error: %s", e)
     return oid
 
 
@@ -137,10 +409,11 @@ def cart_text(s):
 
 def add_to_cart(s, variant_id, qty=1):
     qty = max(1, qty)
-    v = VARIANTS_BY_ID.get(variant_id)
+    menu = current_menu()
+    v = menu.variants_by_id.get(variant_id)
     if not v:
         return
-    item = ITEMS_BY_ID[v["item_id"]]
+    item = menu.items_by_id[v["item_id"]]
     existing = next((c for c in s["cart"] if c["vid"] == variant_id), None)
     if existing:
         existing["qty"] += qty
@@ -155,40 +428,76 @@ def add_to_cart(s, variant_id, qty=1):
 # 📤 ОТПРАВКА WHATSAPP
 # ==========================================
 
+# Переписка текущего сообщения: handle() собирает, save_session() пишет одним пайплайном с сессией
+_convo = ContextVar("convo", default=None)
+
+
+def _convo_text(text):
+    return text if len(text) <= CONVO_TEXT_MAX else text[:CONVO_TEXT_MAX - 1] + "…"
+
+
+def _convo_out(kind, r, text, options=()):
+    log = _convo.get()
+    if log is None:
+        return
+    entry = {"dir": "out", "type": kind, "text": _convo_text(text)}
+    if options:
+        entry["options"] = ",".join(options)
+    if r is None:
+        entry["status"] = "skipped"
+    elif r.status_code >= 400:
+        entry["status"] = str(r.status_code)
+    else:
+        try:
+            entry["wamid"] = r.json()["messages"][0]["id"]
+        except Exception:
+            pass
+    log.append(entry)
+
+
+def _log_send(kind, r):
+    if r is None:
+        wa_logger.warning("📤 %s skipped: Graph circuit open", kind)
+    elif r.status_code < 400:
+        wa_logger.info("📤 %s -> %s", kind, r.status_code)
+    else:
+        wa_logger.warning("📤 %s -> %s: %s", kind, r.status_code, r.text[:300])
+
+
 async def send_text(to, text):
-    async with httpx.AsyncClient(timeout=30) as c:
-        r = await c.post(WA_URL, headers=WA_HEADERS, json={
-            "messaging_product": "whatsapp", "to": to, "type": "text",
-            "text": {"body": text}
-        })
-        logger.info(f"📤 send_text -> {r.status_code}")
+    r = await current_number().post({
+        "messaging_product": "whatsapp", "to": to, "type": "text",
+        "text": {"body": text}
+    })
+    _log_send("send_text", r)
+    _convo_out("text", r, text)
 
 
 async def send_buttons(to, text, buttons):
-    async with httpx.AsyncClient(timeout=30) as c:
-        r = await c.post(WA_URL, headers=WA_HEADERS, json={
-            "messaging_product": "whatsapp", "to": to, "type": "interactive",
-            "interactive": {
-                "type": "button", "body": {"text": text},
-                "action": {"buttons": [
-                    {"type": "reply", "reply": {"id": b["id"], "title": b["title"][:20]}}
-                    for b in buttons[:3]
-                ]}
-            }
-        })
-        logger.info(f"📤 send_buttons -> {r.status_code}")
+    r = await current_number().post({
+        "messaging_product": "whatsapp", "to": to, "type": "interactive",
+        "interactive": {
+            "type": "button", "body": {"text": text},
+            "action": {"buttons": [
+                {"type": "reply", "reply": {"id": b["id"], "title": b["title"][:20]}}
+                for b in buttons[:3]
+            ]}
+        }
+    })
+    _log_send("send_buttons", r)
+    _convo_out("buttons", r, text, [b["id"] for b in buttons[:3]])
 
 
 async def send_list(to, text, btn_text, sections):
-    async with httpx.AsyncClient(timeout=30) as c:
-        r = await c.post(WA_URL, headers=WA_HEADERS, json={
-            "messaging_product": "whatsapp", "to": to, "type": "interactive",
-            "interactive": {
-                "type": "list", "body": {"text": text},
-                "action": {"button": btn_text[:20], "sections": sections}
-            }
-        })
-        logger.info(f"📤 send_list -> {r.status_code}")
+    r = await current_number().post({
+        "messaging_product": "whatsapp", "to": to, "type": "interactive",
+        "interactive": {
+            "type": "list", "body": {"text": text},
+            "action": {"button": btn_text[:20], "sections": sections}
+        }
+    })
+    _log_send("send_list", r)
+    _convo_out("list", r, text, [row["id"] for sec in sections for row in sec.get("rows", ())])
 
 
 async def notify_telegram(order_id, s):
@@ -197,11 +506,16 @@ async def notify_telegram(order_id, s):
     lines = ""
     for c in s["cart"]:
         lines += f"  • {c['name_ru']} ({c['var_ru']}) x{c['qty']} — {c['price']*c['qty']:,} тг\n"
+    branch = f"🏪 {current_number().name}\n" if len(NUMBERS) > 1 else ""
+    zone = s["order"].get("zone")
+    delivery = f"🚚 Зона {zone}: {s['order']['delivery_fee']:,} тг\n" if zone else "🚚 Зона не определена\n"
     text = (
         f"🆕 *НОВЫЙ ЗАКАЗ #{order_id}*\n\n"
+        f"{branch}"
         f"📱 {s['phone']}\n"
         f"📞 {s['order'].get('phone','—')}\n"
-        f"📍 {s['order'].get('address','—')}\n\n"
+        f"📍 {s['order'].get('address','—')}\n"
+        f"{delivery}\n"
         f"🛒 *Заказ:*\n{lines}\n"
         f"💰 *Итого: {cart_total(s):,} тг*\n"
         f"💳 {s['order'].get('payment','—')}\n"
@@ -209,344 +523,556 @@ async def notify_telegram(order_id, s):
         f"⏰ {datetime.now().strftime('%H:%M %d.%m.%Y')}"
     )
     try:
-        async with httpx.AsyncClient(timeout=10) as c:
-            await c.post(f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage",
-                         json={"chat_id": TELEGRAM_CHAT_ID, "text": text, "parse_mode": "Markdown"})
+        await breaker("telegram").call(
+            http_client().post, f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage",
+            json={"chat_id": TELEGRAM_CHAT_ID, "text": text, "parse_mode": "Markdown"}, timeout=10,
+            is_failure=lambda r: r.status_code >= 500 or r.status_code == 429)
+    except CircuitOpen:
+        logger.warning("TG notify skipped for #%s: circuit open", order_id)
     except Exception as e:
-        logger.error(f"TG notify failed: {e}")
+        logger.error("TG notify failed: %s", e)
 
 
 # ==========================================
 # 🧠 ДВИЖОК БОТА
 # ==========================================
+# Диалог — таблица переходов (api/fsm.py). Переход меняет s и отправляет
+# сообщения; сессия сохраняется один раз в конце handle().
+
+fsm = Router()
+
+fsm.alias("btn_cart", "корзина", "себет", "cart")
+fsm.alias("btn_menu", "меню", "мәзір", "menu")
+
+LANG_BUTTONS = [{"id": "lang_ru", "title": "🇷🇺 Русский"}, {"id": "lang_kz", "title": "🇰🇿 Қазақша"}]
+QTY_BUTTONS = [{"id": "qty_1", "title": "1 шт"}, {"id": "qty_2", "title": "2 шт"}, {"id": "qty_3", "title": "3 шт"}]
+
+
+def _l(lang, ru, kz):
+    return ru if lang == "ru" else kz
 
-async def handle(phone, text):
-    s = get_session(phone)
+
+def _variant_name(vid, lang):
+    menu = current_menu()
+    v = menu.variants_by_id.get(vid)
+    item = menu.items_by_id.get(v["item_id"]) if v else None
+    return item.get(f"{lang}_name", item["ru_name"]) if item else ""
+
+
+async def handle(phone, text, msg_type="text"):
+    s = await get_session(phone)
+    state_from = s["state"]
+    if profiler.ACTIVE:
+        profiler.tag_state(state_from)
+    convo = None
+    if CONVO_MAXLEN:
+        convo = [{"dir": "in", "type": msg_type, "text": _convo_text(text), "state": state_from}]
+    token = _convo.set(convo)
+    try:
+        await fsm.dispatch(state_from, text, phone, s)
+    finally:
+        _convo.reset(token)
+        await save_session(phone, s, state_from, convo)
+
+
+# === ГЛОБАЛЬНЫЕ КОМАНДЫ ===
+
+@fsm.on("стоп", "отмена", "stop", "бас тарту", kind="cmd", to="new")
+async def on_stop(phone, s, arg):
     lang = s.get("lang", "ru")
-    txt = text.lower().strip()
-    state = s["state"]
-
-    # === ГЛОБАЛЬНЫЕ КОМАНДЫ ===
-    if txt in ["стоп", "отмена", "stop", "бас тарту"]:
-        s = new_session(phone)
-        s["lang"] = lang  # сохраняем язык
-        save_session(phone, s)
-        await send_text(phone, "❌ Отменено. Напишите *меню* / *мәзір*")
-        return
+    s.clear()
+    s.update(new_session(phone))
+    s["lang"] = lang  # сохраняем язык
+    await send_text(phone, "❌ Отменено. Напишите *меню* / *мәзір*")
 
-    if txt in ["язык", "тіл", "lang"]:
-        s["state"] = "choose_lang"
-        save_session(phone, s)
-        await send_buttons(phone, "Тілді таңдаңыз / Выберите язык:", [
-            {"id": "lang_ru", "title": "🇷🇺 Русский"},
-            {"id": "lang_kz", "title": "🇰🇿 Қазақша"},
-        ])
-        return
 
-    # === ВЫБОР ЯЗЫКА ===
-    if state in ["new", "choose_lang"] or txt in ["start", "/start", "привет", "салам", "сәлем", "hello"]:
-        if text in ["lang_ru", "🇷🇺 Русский"]:
-            s["lang"] = "ru"
-            s["state"] = "main"
-            save_session(phone, s)
-            await show_main(phone, s)
-            return
-        if text in ["lang_kz", "🇰🇿 Қазақша"]:
-            s["lang"] = "kz"
-            s["state"] = "main"
-            save_session(phone, s)
-            await show_main(phone, s)
-            return
-        s["state"] = "choose_lang"
-        save_session(phone, s)
-        await send_buttons(phone,
-            "Сәлеметсіз бе! 👋 Добро пожаловать!\n🍔 *Дядя Стейк Бургер*\n\nТілді таңдаңыз / Выберите язык:",
-            [{"id": "lang_ru", "title": "🇷🇺 Русский"}, {"id": "lang_kz", "title": "🇰🇿 Қазақша"}]
-        )
-        return
+@fsm.on("отписаться", "отписка", "unsubscribe", "жазылымнан шығу", kind="cmd")
+async def on_unsubscribe(phone, s, arg):
+    store = get_storage()
+    if store:
+        await set_optout(store, phone, True)
+    await send_text(phone, t("unsubscribed", s.get("lang", "ru")))
 
-    # === КНОПКИ НАЗАД ===
-    if text == "back_main":
-        await show_main(phone, s)
-        return
-    if text == "back_categories":
-        await show_categories(phone, s)
-        return
 
-    # === БЫСТРОЕ ДОБАВЛЕНИЕ (1 тап = 1 шт) ===
-    if text.startswith("add_"):
-        vid = text[4:]
-        add_to_cart(s, vid, 1)
-        v = VARIANTS_BY_ID.get(vid)
-        item = ITEMS_BY_ID.get(v["item_id"]) if v else None
-        name = item.get(f"{lang}_name", item["ru_name"]) if item else ""
-        total = cart_total(s)
-        min_ok = total >= BIZ["min_order"]
-        last_cat = s.get("last_cat", "")
-
-        msg = t("added", lang).format(name=name, qty=1, total=f"{total:,}")
-
-        buttons = []
-        if last_cat:
-            cat = next((c for c in CATEGORIES if c["id"] == last_cat), None)
-            cat_label = cat[lang][:14] if cat else "Меню"
-            buttons.append({"id": f"cat_{last_cat}", "title": f"➕ {cat_label}"[:20]})
-        if min_ok:
-            buttons.append({"id": "btn_cart", "title": "🛒" + (" Корзина" if lang == "ru" else " Себет")})
-            buttons.append({"id": "checkout", "title": "✅" + (" Оформить" if lang == "ru" else " Тапсырыс")})
-        else:
-            buttons.append({"id": "btn_menu", "title": "📋" + (" Другое" if lang == "ru" else " Басқа")})
-            buttons.append({"id": "btn_cart", "title": "🛒" + (" Корзина" if lang == "ru" else " Себет")})
+@fsm.on("подписаться", "subscribe", "жазылу", kind="cmd")
+async def on_subscribe(phone, s, arg):
+    store = get_storage()
+    if store:
+        await set_optout(store, phone, False)
+    await send_text(phone, t("subscribed", s.get("lang", "ru")))
 
-        s["state"] = "main"
-        save_session(phone, s)
-        await send_buttons(phone, msg, buttons[:3])
-        return
 
-    # === ПОДТВЕРЖДЕНИЕ ТЕКСТОВОГО ЗАКАЗА ===
-    if text == "toc_yes":
-        pending = s.get("pending_text_order", [])
-        if pending:
-            for vid, qty in pending:
-                add_to_cart(s, vid, qty)
-            s["pending_text_order"] = []
-            total = cart_total(s)
-            min_ok = total >= BIZ["min_order"]
-            s["state"] = "main"
-            save_session(phone, s)
-
-            msg = f"✅ Добавлено в корзину!\n\n🛒 Итого: *{total:,} тг*" if lang == "ru" else f"✅ Себетке қосылды!\n\n🛒 Барлығы: *{total:,} тг*"
-
-            buttons = []
-            if min_ok:
-                buttons.append({"id": "checkout", "title": "✅" + (" Оформить" if lang == "ru" else " Тапсырыс")})
-                buttons.append({"id": "btn_menu", "title": "➕" + (" Ещё" if lang == "ru" else " Тағы")})
-                buttons.append({"id": "btn_cart", "title": "🛒" + (" Корзина" if lang == "ru" else " Себет")})
-            else:
-                buttons.append({"id": "btn_menu", "title": "📋" + (" Ещё" if lang == "ru" else " Тағы")})
-                buttons.append({"id": "btn_cart", "title": "🛒" + (" Корзина" if lang == "ru" else " Себет")})
-            await send_buttons(phone, msg, buttons[:3])
-        return
+@fsm.on("язык", "тіл", "lang", kind="cmd", to="choose_lang")
+async def on_lang_command(phone, s, arg):
+    s["state"] = "choose_lang"
+    await send_buttons(phone, "Тілді таңдаңыз / Выберите язык:", LANG_BUTTONS)
 
-    if text == "toc_no":
-        s["pending_text_order"] = []
-        s["state"] = "main"
-        save_session(phone, s)
-        cancel_msg = "❌ Отменено. Попробуйте снова или откройте *меню* 📋" if lang == "ru" else "❌ Бас тартылды. Қайтадан жазыңыз немесе *мәзір* ашыңыз 📋"
-        await send_buttons(phone, cancel_msg, [
-            {"id": "btn_menu", "title": "📋" + (" Меню" if lang == "ru" else " Мәзір")},
-        ])
-        return
 
-    # === ВЫБОР КАТЕГОРИИ ===
-    if text.startswith("cat_"):
-        cat_id = text[4:]
-        if cat_id == "steaks":
-            await send_buttons(phone, t("steaks_contact", lang), [
-                {"id": "back_categories", "title": "🔙 " + ("Назад" if lang == "ru" else "Артқа")},
-            ])
-            s["state"] = "main"
-            save_session(phone, s)
-            return
-        await show_items(phone, s, cat_id)
-        return
+# === ВЫБОР ЯЗЫКА ===
 
-    # === ВЫБОР ПОЗИЦИИ (старый flow, если нужен) ===
-    if text.startswith("item_"):
-        item_id = text[5:]
-        await show_item_variants(phone, s, item_id)
-        return
+@fsm.on("start", "/start", "привет", "салам", "сәлем", "hello", kind="cmd", to="choose_lang")
+@fsm.on(state=("new", "choose_lang"), kind="any", modal=True, to="choose_lang")
+async def on_greet(phone, s, arg):
+    s["state"] = "choose_lang"
+    await send_buttons(phone,
+        "Сәлеметсіз бе! 👋 Добро пожаловать!\n🍔 *Дядя Стейк Бургер*\n\nТілді таңдаңыз / Выберите язык:",
+        LANG_BUTTONS
+    )
 
-    if text.startswith("var_"):
-        vid = text[4:]
-        s["sel_variant"] = vid
-        s["state"] = "choose_qty"
-        save_session(phone, s)
-        v = VARIANTS_BY_ID.get(vid)
-        item = ITEMS_BY_ID.get(v["item_id"]) if v else None
-        name = item.get(f"{lang}_name", item["ru_name"]) if item else ""
-        await send_buttons(phone, f"*{name}*\n💰 {v['price']:,} тг\n\n{t('choose_qty', lang)}", [
-            {"id": "qty_1", "title": "1 шт"},
-            {"id": "qty_2", "title": "2 шт"},
-            {"id": "qty_3", "title": "3 шт"},
-        ])
+
+@fsm.on("lang_ru", "🇷🇺 Русский", "lang_kz", "🇰🇿 Қазақша", state=(ANY, "new", "choose_lang"), to="main")
+async def on_lang(phone, s, arg):
+    s["lang"] = "kz" if arg in ("lang_kz", "🇰🇿 Қазақша") else "ru"
+    await show_main(phone, s)
+
+
+# === КНОПКИ НАЗАД ===
+
+@fsm.on("back_main", to="main")
+async def on_back_main(phone, s, arg):
+    await show_main(phone, s)
+
+
+@fsm.on("back_categories", to="main")
+async def on_back_categories(phone, s, arg):
+    await show_categories(phone, s)
+
+
+# === БЫСТРОЕ ДОБАВЛЕНИЕ (1 тап = 1 шт) ===
+
+@fsm.on("add_", kind="prefix", to="main")
+async def on_add(phone, s, vid):
+    lang = s.get("lang", "ru")
+    add_to_cart(s, vid, 1)
+    name = _variant_name(vid, lang)
+    total = cart_total(s)
+    min_ok = total >= BIZ["min_order"]
+    last_cat = s.get("last_cat", "")
+
+    msg = t("added", lang).format(name=name, qty=1, total=f"{total:,}")
+
+    buttons = []
+    if last_cat:
+        cat = current_menu().category(last_cat)
+        cat_label = cat[lang][:14] if cat else "Меню"
+        buttons.append({"id": f"cat_{last_cat}", "title": f"➕ {cat_label}"[:20]})
+    if min_ok:
+        buttons.append({"id": "btn_cart", "title": "🛒" + _l(lang, " Корзина", " Себет")})
+        buttons.append({"id": "checkout", "title": "✅" + _l(lang, " Оформить", " Тапсырыс")})
+    else:
+        buttons.append({"id": "btn_menu", "title": "📋" + _l(lang, " Другое", " Басқа")})
+        buttons.append({"id": "btn_cart", "title": "🛒" + _l(lang, " Корзина", " Себет")})
+
+    s["state"] = "main"
+    await send_buttons(phone, msg, buttons[:3])
+
+
+# === ПОДТВЕРЖДЕНИЕ ТЕКСТОВОГО ЗАКАЗА ===
+
+@fsm.on("toc_yes", to="main")
+async def on_text_order_yes(phone, s, arg):
+    lang = s.get("lang", "ru")
+    pending = s.get("pending_text_order", [])
+    if not pending:
         return
+    for vid, qty in pending:
+        add_to_cart(s, vid, qty)
+    s["pending_text_order"] = []
+    total = cart_total(s)
+    min_ok = total >= BIZ["min_order"]
+    s["state"] = "main"
+
+    msg = f"✅ Добавлено в корзину!\n\n🛒 Итого: *{total:,} тг*" if lang == "ru" else f"✅ Себетке қосылды!\n\n🛒 Барлығы: *{total:,} тг*"
+
+    buttons = []
+    if min_ok:
+        buttons.append({"id": "checkout", "title": "✅" + _l(lang, " Оформить", " Тапсырыс")})
+        buttons.append({"id": "btn_menu", "title": "➕" + _l(lang, " Ещё", " Тағы")})
+        buttons.append({"id": "btn_cart", "title": "🛒" + _l(lang, " Корзина", " Себет")})
+    else:
+        buttons.append({"id": "btn_menu", "title": "📋" + _l(lang, " Ещё", " Тағы")})
+        buttons.append({"id": "btn_cart", "title": "🛒" + _l(lang, " Корзина", " Себет")})
+    await send_buttons(phone, msg, buttons[:3])
+
+
+@fsm.on("toc_no", to="main")
+async def on_text_order_no(phone, s, arg):
+    lang = s.get("lang", "ru")
+    s["pending_text_order"] = []
+    s["state"] = "main"
+    cancel_msg = "❌ Отменено. Попробуйте снова или откройте *меню* 📋" if lang == "ru" else "❌ Бас тартылды. Қайтадан жазыңыз немесе *мәзір* ашыңыз 📋"
+    await send_buttons(phone, cancel_msg, [
+        {"id": "btn_menu", "title": "📋" + _l(lang, " Меню", " Мәзір")},
+    ])
+
 
-    # === FAQ ===
-    if text.startswith("faq_"):
-        key = text
-        if key in ["faq_hours", "faq_delivery", "faq_payment"]:
-            await send_text(phone, t(key, lang))
+# === ВЫБОР КАТЕГОРИИ ===
+
+@fsm.on("cat_", kind="prefix", to=("browse", "main"))
+async def on_category(phone, s, cat_id):
+    lang = s.get("lang", "ru")
+    if cat_id == "steaks":
+        await send_buttons(phone, t("steaks_contact", lang), [
+            {"id": "back_categories", "title": "🔙 " + _l(lang, "Назад", "Артқа")},
+        ])
         s["state"] = "main"
-        save_session(phone, s)
         return
+    await show_items(phone, s, cat_id)
 
-    # === КОЛИЧЕСТВО ===
-    if state == "choose_qty" and (text.startswith("qty_") or txt.isdigit()):
-        qty = int(text.replace("qty_", "")) if "qty_" in text else int(txt)
-        qty = max(1, min(qty, 20))
-        vid = s.get("sel_variant")
-        if vid:
-            add_to_cart(s, vid, qty)
-            v = VARIANTS_BY_ID.get(vid)
-            item = ITEMS_BY_ID.get(v["item_id"]) if v else None
-            name = item.get(f"{lang}_name", item["ru_name"]) if item else ""
-            total = cart_total(s)
-            s["state"] = "main"
-            save_session(phone, s)
-            msg = t("added", lang).format(name=name, qty=qty, total=f"{total:,}")
-            min_ok = total >= BIZ["min_order"]
-            buttons = [
-                {"id": "btn_menu", "title": "📋" + (" Ещё" if lang == "ru" else " Тағы")},
-                {"id": "btn_cart", "title": "🛒" + (" Корзина" if lang == "ru" else " Себет")},
-            ]
-            if min_ok:
-                buttons.append({"id": "checkout", "title": "✅" + (" Оформить" if lang == "ru" else " Тапсырыс")})
-            await send_buttons(phone, msg, buttons)
-        return
 
-    # === КОРЗИНА ===
-    if txt in ["корзина", "себет", "cart"] or text == "btn_cart":
-        await show_cart(phone, s)
+# === ВЫБОР ПОЗИЦИИ (старый flow, если нужен) ===
+
+@fsm.on("item_", kind="prefix", to=("choose_qty", "browse"))
+async def on_item(phone, s, item_id):
+    await show_item_variants(phone, s, item_id)
+
+
+@fsm.on("var_", kind="prefix", to="choose_qty")
+async def on_variant(phone, s, vid):
+    lang = s.get("lang", "ru")
+    s["sel_variant"] = vid
+    s["state"] = "choose_qty"
+    v = current_menu().variants_by_id.get(vid)
+    name = _variant_name(vid, lang)
+    await send_buttons(phone, f"*{name}*\n💰 {v['price']:,} тг\n\n{t('choose_qty', lang)}", QTY_BUTTONS)
+
+
+# === FAQ ===
+
+@fsm.on("faq_", kind="prefix", to="main")
+async def on_faq_item(phone, s, arg):
+    key = f"faq_{arg}"
+    if key in ["faq_hours", "faq_delivery", "faq_payment"]:
+        await send_text(phone, t(key, s.get("lang", "ru")))
+    elif key == "faq_contacts":
+        await send_text(phone, t("contacts", s.get("lang", "ru")))
+    s["state"] = "main"
+
+
+# === КОЛИЧЕСТВО ===
+
+@fsm.on("qty_", state="choose_qty", kind="prefix", to="main")
+async def on_qty(phone, s, arg):
+    qty = max(1, min(int(arg), 20))
+    vid = s.get("sel_variant")
+    if not vid:
         return
+    lang = s.get("lang", "ru")
+    add_to_cart(s, vid, qty)
+    name = _variant_name(vid, lang)
+    total = cart_total(s)
+    s["state"] = "main"
+    msg = t("added", lang).format(name=name, qty=qty, total=f"{total:,}")
+    min_ok = total >= BIZ["min_order"]
+    buttons = [
+        {"id": "btn_menu", "title": "📋" + _l(lang, " Ещё", " Тағы")},
+        {"id": "btn_cart", "title": "🛒" + _l(lang, " Корзина", " Себет")},
+    ]
+    if min_ok:
+        buttons.append({"id": "checkout", "title": "✅" + _l(lang, " Оформить", " Тапсырыс")})
+    await send_buttons(phone, msg, buttons)
+
+
+@fsm.on(state="choose_qty", kind="any", to="main")
+async def on_qty_text(phone, s, text):
+    if text.strip().isdigit():
+        await on_qty(phone, s, text.strip())
+    else:
+        await on_default(phone, s, text)
+
 
-    if text == "clear_cart":
-        s["cart"] = []
+# === КОРЗИНА ===
+
+@fsm.on("btn_cart", to="main")
+async def on_cart(phone, s, arg):
+    await show_cart(phone, s)
+
+
+@fsm.on("clear_cart", to="main")
+async def on_clear_cart(phone, s, arg):
+    s["cart"] = []
+    s["state"] = "main"
+    await send_text(phone, t("cart_empty", s.get("lang", "ru")))
+
+
+@fsm.on("repeat_order", to="main")
+async def on_repeat_order(phone, s, arg):
+    """Корзина из снимка последнего заказа по ценам текущего меню"""
+    lang = s.get("lang", "ru")
+    snapshot = (s.get("_profile") or {}).get("last_cart") or []
+    s["cart"] = [{"vid": vid, "qty": qty, "price": price, "name_ru": name_ru, "name_kz": name_kz}
+                 for vid, qty, price, name_ru, name_kz in snapshot]
+    changes = reprice_cart(s)
+    old, s["cart"] = s["cart"], []
+    for c in old:
+        add_to_cart(s, c["vid"], c["qty"])
+    if not s["cart"]:
         s["state"] = "main"
-        save_session(phone, s)
-        await send_text(phone, t("cart_empty", lang))
+        await send_text(phone, t("repeat_empty", lang))
         return
+    if changes:
+        await send_text(phone, t("cart_repriced", lang).format(changes="\n".join(changes)))
+    await show_cart(phone, s)
 
-    # === ОФОРМЛЕНИЕ ===
-    if text == "checkout":
-        clean_cart(s)
-        total = cart_total(s)
-        if total < BIZ["min_order"]:
-            min_val = f"{BIZ['min_order']:,}"
-            await send_text(phone, t("min_warn", lang).format(min=min_val))
-            return
-        s["state"] = "ask_address"
-        s["order"] = {}
-        save_session(phone, s)
-        await send_text(phone, f"{t('cart_title', lang)}\n\n{cart_text(s)}\n\n{t('ask_address', lang)}")
-        return
 
-    if state == "ask_address":
-        if len(text) < 5:
-            await send_text(phone, t("ask_address", lang))
-            return
-        s["order"]["address"] = text
-        s["state"] = "ask_phone"
-        save_session(phone, s)
-        await send_text(phone, t("ask_phone", lang))
+# === ОФОРМЛЕНИЕ ===
+
+@fsm.on("checkout", to="ask_address")
+async def on_checkout(phone, s, arg):
+    lang = s.get("lang", "ru")
+    clean_cart(s)
+    # Корзину могли собрать по старому меню — цены берём из текущего
+    changes = reprice_cart(s)
+    notice = t("cart_repriced", lang).format(changes="\n".join(changes)) + "\n\n" if changes else ""
+    total = cart_total(s)
+    if total < BIZ["min_order"]:
+        min_val = f"{BIZ['min_order']:,}"
+        await send_text(phone, notice + t("min_warn", lang).format(min=min_val))
+        return
+    s["state"] = "ask_address"
+    s["order"] = {}
+    head = f"{notice}{t('cart_title', lang)}\n\n{cart_text(s)}\n\n"
+    profile = _saved_profile(s)
+    if not profile:
+        await send_text(phone, head + t("ask_address", lang))
         return
+    # Постоянный клиент: адрес из профиля — и сразу подтверждение
+    addresses = profile["addresses"][:2]
+    buttons = [{"id": "same_0", "title": t("same_as_last", lang)[:20]}]
+    if len(addresses) > 1:
+        buttons.append({"id": "same_1", "title": ("📍 " + addresses[1])[:20]})
+    buttons.append({"id": "new_address", "title": t("new_address", lang)[:20]})
+    await send_buttons(phone, head + t("checkout_saved", lang).format(
+        addresses="\n".join(f"📍 {a}" for a in addresses),
+        phone=profile["phone"], pay=_payment_label(profile, lang),
+    ), buttons)
 
-    if state == "ask_phone":
-        s["order"]["phone"] = text
-        s["state"] = "ask_payment"
-        save_session(phone, s)
-        await send_buttons(phone, t("ask_payment", lang), [
-            {"id": "pay_kaspi", "title": "💳 " + t("pay_kaspi", lang)[:17]},
-            {"id": "pay_cash", "title": "💵 " + t("pay_cash", lang)[:17]},
-            {"id": "pay_qr", "title": "📱 " + t("pay_qr", lang)[:17]},
-        ])
+
+def _saved_profile(s):
+    """Профиль, по которому можно оформить заказ без вопросов (или None)"""
+    profile = s.get("_profile") or {}
+    if profile.get("addresses") and profile.get("phone") and profile.get("payment"):
+        return profile
+    return None
+
+
+def _payment_label(profile, lang):
+    pid = profile.get("payment_id", "")
+    return t(f"pay_{pid}", lang) if pid in ("kaspi", "cash", "qr") else profile["payment"]
+
+
+@fsm.on("same_", state="ask_address", kind="prefix", to="confirm")
+async def on_same_as_last(phone, s, arg):
+    lang = s.get("lang", "ru")
+    profile = _saved_profile(s)
+    addresses = profile["addresses"] if profile else []
+    if not arg.isdigit() or int(arg) >= len(addresses):
+        await send_text(phone, t("ask_address", lang))
         return
+    address = addresses[int(arg)]
+    s["order"] = {
+        "address": address,
+        "phone": profile["phone"],
+        "payment": _payment_label(profile, lang),
+        "payment_id": profile.get("payment_id", "other"),
+        "comment": "—",
+    }
+    coords = profile.get("coords", {}).get(address)
+    if coords:
+        s["order"].update(lat=coords[0], lon=coords[1], geo=True)
+    s["state"] = "confirm"
+    await send_confirm(phone, s)
 
-    if state == "ask_payment":
-        pay_map = {
-            "pay_kaspi": t("pay_kaspi", lang),
-            "pay_cash": t("pay_cash", lang),
-            "pay_qr": t("pay_qr", lang),
-        }
-        s["order"]["payment"] = pay_map.get(text, text)
-        s["state"] = "ask_comment"
-        save_session(phone, s)
-        await send_buttons(phone, t("ask_comment", lang), [
-            {"id": "cm_none", "title": t("no_comment", lang)[:20]},
-            {"id": "cm_noonion", "title": t("no_onion", lang)[:20]},
-            {"id": "cm_sauce", "title": t("more_sauce", lang)[:20]},
-        ])
+
+@fsm.on("new_address", state="ask_address", to="ask_address")
+async def on_new_address(phone, s, arg):
+    await send_text(phone, t("ask_address", s.get("lang", "ru")))
+
+
+@fsm.on("geo_", state="ask_address", kind="prefix", to="ask_phone")
+async def on_location(phone, s, arg):
+    """Геоточка из WhatsApp: "geo_{lat},{lon}|{название, адрес}" (см. webhook)"""
+    lang = s.get("lang", "ru")
+    coords, _, label = arg.partition("|")
+    try:
+        lat, lon = (float(v) for v in coords.split(","))
+    except ValueError:
+        await send_text(phone, t("ask_address", lang))
         return
+    s["order"].update(address=label or f"📍 {lat:.5f}, {lon:.5f}", lat=lat, lon=lon, geo=True)
+    s["state"] = "ask_phone"
+    await send_text(phone, t("geo_ok", lang) + "\n\n" + t("ask_phone", lang))
 
-    if state == "ask_comment":
-        cm_map = {
-            "cm_none": "—",
-            "cm_noonion": t("no_onion", lang),
-            "cm_sauce": t("more_sauce", lang),
-        }
-        s["order"]["comment"] = cm_map.get(text, text)
-        s["state"] = "confirm"
-        save_session(phone, s)
-        msg = t("confirm", lang).format(
-            cart=cart_text(s), addr=s["order"]["address"],
-            phone=s["order"]["phone"], pay=s["order"]["payment"],
-            comment=s["order"]["comment"], time=BIZ["delivery_time"]
-        )
-        confirm_title = "✅ Подтверждаю" if lang == "ru" else "✅ Растаймын"
-        cancel_title = "❌ Отменить" if lang == "ru" else "❌ Бас тарту"
-        await send_buttons(phone, msg, [
-            {"id": "confirm_yes", "title": confirm_title[:20]},
-            {"id": "confirm_no", "title": cancel_title[:20]},
-        ])
+
+@fsm.on("geo_", kind="prefix")
+async def on_location_elsewhere(phone, s, arg):
+    await send_text(phone, t("geo_not_now", s.get("lang", "ru")))
+
+
+@fsm.on(state="ask_address", kind="any", to="ask_phone")
+async def on_address(phone, s, text):
+    lang = s.get("lang", "ru")
+    if len(text) < 5:
+        await send_text(phone, t("ask_address", lang))
         return
+    s["order"]["address"] = text
+    s["state"] = "ask_phone"
+    await send_text(phone, t("ask_phone", lang))
 
-    if state == "confirm":
-        if text == "confirm_yes":
-            clean_cart(s)
-            oid = save_order(s)
-            # Отправляем в CRM
-            try:
-                crm_result = await send_order_to_crm(s)
-                if crm_result.get("success"):
-                    logger.info(f"CRM: заказ #{oid} → CRM ID={crm_result.get('order_id')}")
-                else:
-                    logger.warning(f"CRM: заказ #{oid} не отправлен: {crm_result.get('error')}")
-            except Exception as e:
-                logger.error(f"CRM error for #{oid}: {e}")
-            msg = t("order_done", lang).format(id=oid, time=BIZ["delivery_time"])
-            await send_text(phone, msg)
-            await notify_telegram(oid, s)
-            s["cart"] = []
-            s["order"] = {}
-            s["state"] = "main"
-            save_session(phone, s)
-            return
-        elif text == "confirm_no":
-            s["cart"] = []
-            s["order"] = {}
+
+@fsm.on(state="ask_phone", kind="any", to="ask_payment")
+async def on_contact_phone(phone, s, text):
+    lang = s.get("lang", "ru")
+    s["order"]["phone"] = text
+    s["state"] = "ask_payment"
+    await send_buttons(phone, t("ask_payment", lang), [
+        {"id": "pay_kaspi", "title": "💳 " + t("pay_kaspi", lang)[:17]},
+        {"id": "pay_cash", "title": "💵 " + t("pay_cash", lang)[:17]},
+        {"id": "pay_qr", "title": "📱 " + t("pay_qr", lang)[:17]},
+    ])
+
+
+@fsm.on(state="ask_payment", kind="any", to="ask_comment")
+async def on_payment(phone, s, text):
+    lang = s.get("lang", "ru")
+    pay_map = {
+        "pay_kaspi": t("pay_kaspi", lang),
+        "pay_cash": t("pay_cash", lang),
+        "pay_qr": t("pay_qr", lang),
+    }
+    s["order"]["payment"] = pay_map.get(text, text)
+    s["order"]["payment_id"] = text[4:] if text in pay_map else "other"
+    s["state"] = "ask_comment"
+    await send_buttons(phone, t("ask_comment", lang), [
+        {"id": "cm_none", "title": t("no_comment", lang)[:20]},
+        {"id": "cm_noonion", "title": t("no_onion", lang)[:20]},
+        {"id": "cm_sauce", "title": t("more_sauce", lang)[:20]},
+    ])
+
+
+@fsm.on(state="ask_comment", kind="any", to="confirm")
+async def on_comment(phone, s, text):
+    lang = s.get("lang", "ru")
+    cm_map = {
+        "cm_none": "—",
+        "cm_noonion": t("no_onion", lang),
+        "cm_sauce": t("more_sauce", lang),
+    }
+    s["order"]["comment"] = cm_map.get(text, text)
+    s["state"] = "confirm"
+    await send_confirm(phone, s)
+
+
+def _apply_delivery(order):
+    """Зона и стоимость доставки: по геоточке, иначе по адресу через справочник улиц"""
+    if order.get("lat") is not None:
+        place = gazetteer.locate(order["lat"], order["lon"])
+    else:
+        place = gazetteer.parse(order.get("address", ""))
+    order.update(zone=place["zone"], delivery_fee=place["fee"], lat=place["lat"], lon=place["lon"])
+
+
+def _delivery_text(s, lang):
+    order = s["order"]
+    if not order.get("zone"):
+        return t("delivery_unknown", lang)
+    return t("delivery_zone", lang).format(
+        fee=f"{order['delivery_fee']:,}", zone=order["zone"], label=gazetteer.zone_label(order["zone"], lang),
+        total=f"{cart_total(s) + order['delivery_fee']:,}")
+
+
+async def send_confirm(phone, s, notice=""):
+    lang = s.get("lang", "ru")
+    # Время по очереди кухни; то же обещание уйдёт в order_done и в заказ
+    s["order"]["eta"] = await eta.safe_estimate(get_storage())
+    _apply_delivery(s["order"])
+    msg = notice + t("confirm", lang).format(
+        cart=cart_text(s), addr=s["order"]["address"],
+        phone=s["order"]["phone"], pay=s["order"]["payment"],
+        comment=s["order"]["comment"], time=s["order"]["eta"],
+        delivery=_delivery_text(s, lang),
+    )
+    await send_buttons(phone, msg, [
+        {"id": "confirm_yes", "title": _l(lang, "✅ Подтверждаю", "✅ Растаймын")[:20]},
+        {"id": "confirm_no", "title": _l(lang, "❌ Отменить", "❌ Бас тарту")[:20]},
+    ])
+
+
+@fsm.on("confirm_yes", state="confirm", to="main")
+async def on_confirm(phone, s, arg):
+    lang = s.get("lang", "ru")
+    clean_cart(s)
+    # Меню обновилось между оформлением и подтверждением — показываем новые цены ещё раз
+    changes = reprice_cart(s)
+    if changes:
+        if not s["cart"]:
             s["state"] = "main"
-            save_session(phone, s)
-            await send_text(phone, t("order_cancel", lang))
+            await send_text(phone, t("cart_repriced", lang).format(changes="\n".join(changes)))
             return
-
-    # === ГЛАВНОЕ МЕНЮ ===
-    if txt in ["меню", "мәзір", "menu"] or text == "btn_menu":
-        await show_categories(phone, s)
+        await send_confirm(phone, s, t("cart_repriced", lang).format(changes="\n".join(changes)) + "\n\n")
         return
+    oid = await save_order(s)
+    # Отправляем в CRM
+    try:
+        crm_result = await send_order_to_crm(s)
+        if crm_result.get("success"):
+            logger.info("CRM: заказ #%s → CRM ID=%s", oid, crm_result.get("order_id"))
+        else:
+            logger.warning("CRM: заказ #%s не отправлен: %s", oid, crm_result.get("error"))
+    except Exception as e:
+        logger.error("CRM error for #%s: %s", oid, e)
+    msg = t("order_done", lang).format(id=oid, time=s["order"].get("eta") or BIZ["delivery_time"])
+    await send_text(phone, msg)
+    await notify_telegram(oid, s)
+    s["cart"] = []
+    s["order"] = {}
+    s["state"] = "main"
 
-    if text == "btn_faq":
-        await show_faq(phone, s)
-        return
 
-    if text == "btn_contacts":
-        await send_text(phone, t("contacts", lang))
-        s["state"] = "main"
-        save_session(phone, s)
-        return
+@fsm.on("confirm_no", state="confirm", to="main")
+async def on_confirm_cancel(phone, s, arg):
+    s["cart"] = []
+    s["order"] = {}
+    s["state"] = "main"
+    await send_text(phone, t("order_cancel", s.get("lang", "ru")))
+
+
+# === ГЛАВНОЕ МЕНЮ ===
+
+@fsm.on("btn_menu", to="main")
+async def on_menu(phone, s, arg):
+    await show_categories(phone, s)
+
+
+@fsm.on("btn_faq", to="main")
+async def on_faq(phone, s, arg):
+    await show_faq(phone, s)
+
+
+@fsm.on("btn_contacts", to="main")
+async def on_contacts(phone, s, arg):
+    await send_text(phone, t("contacts", s.get("lang", "ru")))
+    s["state"] = "main"
 
-    # === 💬 ТЕКСТОВЫЙ ЗАКАЗ (перед default!) ===
-    if state in ["main", "browse"] and len(txt) >= 3:
-        parsed = parse_text_order(text)
+
+# === ПО УМОЛЧАНИЮ: 💬 ТЕКСТОВЫЙ ЗАКАЗ ИЛИ ГЛАВНОЕ МЕНЮ ===
+
+@fsm.on(kind="any", to="main")
+async def on_default(phone, s, text):
+    lang = s.get("lang", "ru")
+    if s["state"] in ["main", "browse"] and len(text.strip()) >= 3:
+        menu = current_menu()
+        parsed = parse_text_order(text, menu.index["aliases"])
         if parsed:
-            logger.info(f"📝 Text order parsed: {parsed}")
+            logger.info("📝 Text order parsed: %s", parsed)
             # Формируем подтверждение
             lines = []
             total = 0
             for vid, qty in parsed:
-                v = VARIANTS_BY_ID.get(vid)
+                v = menu.variants_by_id.get(vid)
                 if not v:
                     continue
-                item = ITEMS_BY_ID.get(v["item_id"])
+                item = menu.items_by_id.get(v["item_id"])
                 name = item.get(f"{lang}_name", item["ru_name"]) if item else ""
                 var_name = v.get(lang, v["ru"])
                 price = v["price"] * qty
@@ -561,19 +1087,14 @@ async def handle(phone, text):
 
             s["pending_text_order"] = parsed
             s["state"] = "main"
-            save_session(phone, s)
 
-            yes_label = "✅ Да, добавить" if lang == "ru" else "✅ Иә, қосу"
-            no_label = "❌ Нет" if lang == "ru" else "❌ Жоқ"
-            menu_label = "📋 Меню" if lang == "ru" else "📋 Мәзір"
             await send_buttons(phone, msg, [
-                {"id": "toc_yes", "title": yes_label[:20]},
-                {"id": "toc_no", "title": no_label[:20]},
-                {"id": "btn_menu", "title": menu_label},
+                {"id": "toc_yes", "title": _l(lang, "✅ Да, добавить", "✅ Иә, қосу")[:20]},
+                {"id": "toc_no", "title": _l(lang, "❌ Нет", "❌ Жоқ")[:20]},
+                {"id": "btn_menu", "title": _l(lang, "📋 Меню", "📋 Мәзір")},
             ])
             return
 
-    # === ПО УМОЛЧАНИЮ ===
     await show_main(phone, s)
 
 
@@ -584,30 +1105,26 @@ async def handle(phone, text):
 async def show_main(phone, s):
     lang = s.get("lang", "ru")
     s["state"] = "main"
-    save_session(phone, s)
     menu_label = "📋 Меню" if lang == "ru" else "📋 Мәзір"
     faq_label = "❓ Вопросы" if lang == "ru" else "❓ Сұрақтар"
     contact_label = "📞 Контакты" if lang == "ru" else "📞 Байланыс"
+    # Кнопок максимум три: у постоянного клиента «Контакты» уступают место
+    # повтору заказа и остаются в списке FAQ
+    if (s.get("_profile") or {}).get("last_cart"):
+        third = {"id": "repeat_order", "title": t("repeat_order", lang)[:20]}
+    else:
+        third = {"id": "btn_contacts", "title": contact_label}
     await send_buttons(phone, t("main_menu", lang), [
         {"id": "btn_menu", "title": menu_label},
+        third,
         {"id": "btn_faq", "title": faq_label},
-        {"id": "btn_contacts", "title": contact_label},
     ])
 
 
 async def show_categories(phone, s):
     lang = s.get("lang", "ru")
     s["state"] = "main"
-    save_session(phone, s)
-    rows = []
-    for c in CATEGORIES:
-        count = len([i for i in MENU_ITEMS if i['cat'] == c['id']])
-        if c['id'] == 'steaks':
-            desc = "Свяжитесь с нами" if lang == "ru" else "Бізбен байланысыңыз"
-        else:
-            desc = f"{count} " + ("позиций" if lang == "ru" else "тағам")
-        rows.append({"id": f"cat_{c['id']}", "title": c[lang][:24], "description": desc})
-    rows.append({"id": "back_main", "title": "🔙 " + ("Назад" if lang == "ru" else "Артқа")})
+    rows = current_menu().index["category_rows"][lang]
     sections = [{"title": "📋 " + ("Меню" if lang == "ru" else "Мәзір"), "rows": rows}]
     btn = "Открыть меню" if lang == "ru" else "Мәзірді ашу"
     await send_list(phone, t("choose_category", lang), btn, sections)
@@ -615,37 +1132,24 @@ async def show_categories(phone, s):
 
 async def show_items(phone, s, cat_id):
     lang = s.get("lang", "ru")
-    items = [i for i in MENU_ITEMS if i["cat"] == cat_id]
-    cat = next((c for c in CATEGORIES if c["id"] == cat_id), None)
+    menu = current_menu()
+    cat = menu.category(cat_id)
     cat_name = cat[lang] if cat else ""
 
-    rows = []
-    for item in items:
-        name = item.get(f"{lang}_name", item["ru_name"])
-        for v in item["variants"]:
-            v_name = v.get(lang, v["ru"])
-            if len(item["variants"]) == 1:
-                label = f"{name}"
-            else:
-                label = f"{name} {v_name}"
-            rows.append({
-                "id": f"add_{v['id']}",
-                "title": label[:24],
-                "description": f"{v['price']:,} тг"[:72],
-            })
-    rows.append({"id": "back_categories", "title": "🔙 " + ("Назад к меню" if lang == "ru" else "Мәзірге қайту")})
+    rows = menu.index["item_rows"][lang].get(cat_id) or [
+        {"id": "back_categories", "title": "🔙 " + ("Назад к меню" if lang == "ru" else "Мәзірге қайту")}
+    ]
 
     sections = [{"title": cat_name[:24], "rows": rows}]
     btn = "Выбрать" if lang == "ru" else "Таңдау"
     await send_list(phone, f"*{cat_name}*\n" + ("👆 Нажмите — добавится 1 шт" if lang == "ru" else "👆 Басыңыз — 1 дана қосылады"), btn, sections)
     s["state"] = "browse"
     s["last_cat"] = cat_id
-    save_session(phone, s)
 
 
 async def show_item_variants(phone, s, item_id):
     lang = s.get("lang", "ru")
-    item = ITEMS_BY_ID.get(item_id)
+    item = current_menu().items_by_id.get(item_id)
     if not item:
         return
 
@@ -657,16 +1161,11 @@ async def show_item_variants(phone, s, item_id):
         v = item["variants"][0]
         s["sel_variant"] = v["id"]
         s["state"] = "choose_qty"
-        save_session(phone, s)
         text = f"*{name}*\n{desc}\n💰 *{v['price']:,} тг*"
         if note:
             text += f"\n📎 {note}"
         text += f"\n\n{t('choose_qty', lang)}"
-        await send_buttons(phone, text, [
-            {"id": "qty_1", "title": "1 шт"},
-            {"id": "qty_2", "title": "2 шт"},
-            {"id": "qty_3", "title": "3 шт"},
-        ])
+        await send_buttons(phone, text, QTY_BUTTONS)
     else:
         text = f"*{name}*\n{desc}"
         if note:
@@ -684,7 +1183,6 @@ async def show_item_variants(phone, s, item_id):
         btn = "Выбрать" if lang == "ru" else "Таңдау"
         await send_list(phone, text, btn, sections)
         s["state"] = "browse"
-        save_session(phone, s)
 
 
 async def show_cart(phone, s):
@@ -692,7 +1190,6 @@ async def show_cart(phone, s):
     cart = s.get("cart", [])
     if not cart:
         s["state"] = "main"
-        save_session(phone, s)
         await send_text(phone, t("cart_empty", lang))
         return
 
@@ -717,17 +1214,16 @@ async def show_cart(phone, s):
             {"id": "clear_cart", "title": clear_label},
         ])
     s["state"] = "main"
-    save_session(phone, s)
 
 
 async def show_faq(phone, s):
     lang = s.get("lang", "ru")
     s["state"] = "main"
-    save_session(phone, s)
     rows = [
         {"id": "faq_hours", "title": "🕐 " + ("Время работы" if lang == "ru" else "Жұмыс уақыты")},
         {"id": "faq_delivery", "title": "🚚 " + ("Доставка" if lang == "ru" else "Жеткізу")},
         {"id": "faq_payment", "title": "💳 " + ("Оплата" if lang == "ru" else "Төлем")},
+        {"id": "faq_contacts", "title": "📞 " + ("Контакты" if lang == "ru" else "Байланыс")},
     ]
     sections = [{"title": "FAQ", "rows": rows}]
     title = "❓ Частые вопросы" if lang == "ru" else "❓ Сұрақтар"
@@ -754,14 +1250,21 @@ async def verify(
 @app.post("/webhook")
 async def webhook(request: Request):
     try:
-        body = await request.json()
+        raw = await request.body()
+        # Статусы доставки приходят чаще сообщений: тело без "messages" —
+        # только колбэки, пишем их одной записью и сразу отвечаем
+        if b'"messages"' not in raw:
+            return await ingest_statuses(json.loads(raw))
+        body = json.loads(raw)
         if body.get("object") != "whatsapp_business_account":
             return {"status": "ok"}
 
         for entry in body.get("entry", []):
             for change in entry.get("changes", []):
                 value = change.get("value", {})
-                
+                # Номер, на который написали: креды, пул, точка CRM, ключи сессий
+                use_number(value.get("metadata", {}).get("phone_number_id"))
+
                 # Extract contact name if available
                 contact_name = ""
                 for contact in value.get("contacts", []):
@@ -771,31 +1274,29 @@ async def webhook(request: Request):
                 for msg in value.get("messages", []):
                     phone = msg.get("from")
                     msg_type = msg.get("type")
+                    REQUEST_ID.set(msg.get("id") or REQUEST_ID.get())
 
-                    # Save contact to database
-                    if phone and redis:
+                    # Лимит на номер и отметка контакта — один скрипт в Redis.
+                    # Лишние сообщения не читают сессию и не уходят в Graph
+                    store = get_storage()
+                    if phone and store:
                         try:
-                            now = datetime.now(tz=None).isoformat()
-                            key = f"contact:{phone}"
-                            existing = redis.get(key)
-                            if existing:
-                                data = json.loads(existing)
-                                data["last_seen"] = now
-                                data["msg_count"] = data.get("msg_count", 0) + 1
-                                if contact_name and not data.get("name"):
-                                    data["name"] = contact_name
-                            else:
-                                data = {
-                                    "phone": phone,
-                                    "name": contact_name,
-                                    "first_seen": now,
-                                    "last_seen": now,
-                                    "msg_count": 1,
-                                }
-                            redis.set(key, json.dumps(data, ensure_ascii=False), ex=86400*365)
-                            redis.sadd("contacts:all", phone)
+                            allowed, notify = await store.admit(phone, contact_name, RATE_LIMIT, RATE_WINDOW,
+                                                                current_number().namespace)
+                        except CircuitOpen:
+                            # Redis недоступен — без лимита и учёта контакта
+                            allowed, notify = True, False
                         except Exception as ce:
-                            logger.warning(f"Contact save error: {ce}")
+                            allowed, notify = True, False
+                            logger.warning("Contact save error: %s", ce)
+                        RATE_STATS["checked"] += 1
+                        if not allowed:
+                            RATE_STATS["limited"] += 1
+                            logger.info("Rate limited %s", phone, extra={"rate_limited": True, "notified": notify})
+                            if notify:
+                                RATE_STATS["notified"] += 1
+                                await send_text(phone, t("slow_down", "ru"))
+                            continue
 
                     text = ""
                     if msg_type == "text":
@@ -806,32 +1307,73 @@ async def webhook(request: Request):
                             text = inter["button_reply"]["id"]
                         elif inter.get("type") == "list_reply":
                             text = inter["list_reply"]["id"]
+                    elif msg_type == "location":
+                        loc = msg["location"]
+                        label = ", ".join(v for v in (loc.get("name"), loc.get("address")) if v)
+                        text = f"geo_{loc['latitude']},{loc['longitude']}|{label}"
 
                     if text and phone:
-                        logger.info(f"💬 [{phone}]: {text}")
-                        await handle(phone, text)
-
+                        refresh_menu(store)
+                        logger.info("💬 [%s]: %s", phone, text, extra={"msg_type": msg_type})
+                        if profiler.sampled():
+                            await profiler.run(handle(phone, text, msg_type))
+                        else:
+                            await handle(phone, text, msg_type)
+
+        if _collect_statuses(body):
+            await ingest_statuses(body)
         return {"status": "ok"}
     except Exception as e:
-        logger.error(f"Webhook error: {e}", exc_info=True)
+        logger.error("Webhook error: %s", e, exc_info=True)
         return {"status": "error"}
 
 
+# Счётчики лимитера этого инстанса (/health); по дням — поле limited в stats:{день}
+RATE_STATS = {"checked": 0, "limited": 0, "notified": 0}
+
+
+def _collect_statuses(body):
+    return [st for entry in body.get("entry", ()) for change in entry.get("changes", ())
+            for st in change.get("value", {}).get("statuses", ())]
+
+
+async def ingest_statuses(body):
+    if body.get("object") != "whatsapp_business_account":
+        return {"status": "ok"}
+    statuses = _collect_statuses(body)
+    store = get_storage()
+    if statuses and store:
+        try:
+            await store.record_statuses(statuses)
+        except Exception as e:
+            logger.warning("Status save error: %s", e)
+    if logger.isEnabledFor(logging.DEBUG):
+        for st in statuses:
+            logger.debug("📬 %s → %s", st.get("id"), st.get("status"))
+    return {"status": "ok"}
+
+
+def _number_param(number):
+    """?number= (phone_number_id или имя из WHATSAPP_NUMBERS; пусто — основной) → Number"""
+    try:
+        return resolve_number(number)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.get("/contacts")
-async def get_contacts(key: str = ""):
-    """Получить базу контактов"""
+async def get_contacts(key: str = "", number: str = ""):
+    """Получить базу контактов номера (number — как в /conversation)"""
     if key != VERIFY_TOKEN:
         return {"error": "unauthorized"}
     
-    if not redis:
+    store = get_storage()
+    if not store:
         return {"error": "no redis"}
     
-    phones = redis.smembers("contacts:all")
-    contacts = []
-    for phone in sorted(phones):
-        data = redis.get(f"contact:{phone}")
-        if data:
-            contacts.append(json.loads(data))
+    namespace = _number_param(number).namespace
+    phones = await store.contact_phones(namespace)
+    contacts = await store.load_contacts(sorted(phones), namespace)
     
     return {
         "total": len(contacts),
@@ -839,9 +1381,263 @@ async def get_contacts(key: str = ""):
     }
 
 
+@app.get("/conversation")
+async def get_conversation(key: str = "", phone: str = "", number: str = "", limit: int = 50,
+                           before: str = "", after: str = ""):
+    """Переписка клиента для поддержки: последние limit записей (новые первыми);
+    ?before=<next> — страница старше, ?after=<id> — всё, что новее id (по порядку).
+    number — phone_number_id (или имя) номера, на который писал клиент (по умолчанию основной)"""
+    if key != VERIFY_TOKEN:
+        return {"error": "unauthorized"}
+    store = get_storage()
+    if not store:
+        return {"error": "no redis"}
+    if not phone:
+        raise HTTPException(status_code=400, detail="phone is required")
+    scoped = _number_param(number).scope(phone)
+    limit = max(1, min(limit, 500))
+    messages = await store.load_conversation(scoped, limit, before=before, after=after)
+    page = {"phone": phone, "count": len(messages), "messages": messages}
+    if not after:
+        page["next"] = messages[-1]["id"] if len(messages) == limit else None
+    return page
+
+
+def _date_range(date_from, date_to):
+    """Дни 'YYYY-MM-DD' от from до to включительно (по умолчанию — сегодня)"""
+    try:
+        end = datetime.strptime(date_to, "%Y-%m-%d") if date_to else datetime.now()
+        start = datetime.strptime(date_from, "%Y-%m-%d") if date_from else end
+    except ValueError:
+        raise HTTPException(status_code=400, detail="dates must be YYYY-MM-DD")
+    if start > end or (end - start).days > 366:
+        raise HTTPException(status_code=400, detail="range must be 1..367 days")
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days + 1)]
+
+
+# Шаги воронки и состояния FSM, которые к ним относятся; ordered пишет store_order
+FUNNEL = [
+    ("choose_lang", ("new", "choose_lang")),
+    ("browse", ("main", "browse", "choose_qty")),
+    ("ask_address", ("ask_address",)),
+    ("confirm", ("confirm",)),
+    ("ordered", ("ordered",)),
+]
+
+
+@app.get("/orders/stream")
+async def orders_stream(request: Request, key: str = "", last_event_id: str = "", backlog: int = 0):
+    """Живая лента заказов для кухни (SSE): события new и status из orders:stream.
+    EventSource сам переподключается с заголовком Last-Event-ID и получает пропущенное"""
+    if key != VERIFY_TOKEN:
+        raise HTTPException(status_code=401, detail="unauthorized")
+    store = get_storage()
+    if not store:
+        raise HTTPException(status_code=503, detail="no redis")
+    try:
+        from . import order_feed
+    except ImportError:
+        import order_feed
+    last_id = request.headers.get("last-event-id") or last_event_id
+    if last_id and not re.fullmatch(r"\d+-\d+", last_id):
+        raise HTTPException(status_code=400, detail="bad Last-Event-ID")
+    return StreamingResponse(
+        order_feed.events(store, last_id, max(0, min(backlog, 200))), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/eta")
+async def get_eta(key: str = "", date_from: str = Query("", alias="from"), date_to: str = Query("", alias="to")):
+    """Текущая оценка (очередь, скорость кухни) и точность обещаний за период"""
+    if key != VERIFY_TOKEN:
+        return {"error": "unauthorized"}
+    store = get_storage()
+    if not store:
+        return {"error": "no redis"}
+    days = _date_range(date_from, date_to)
+    return {"now": await eta.estimate(store), "from": days[0], "to": days[-1],
+            "accuracy": eta.accuracy_report(await store.load_eta_accuracy(days))}
+
+
+@app.get("/funnel")
+async def get_funnel(key: str = "", date_from: str = Query("", alias="from"), date_to: str = Query("", alias="to"),
+                     top: int = 15):
+    """Воронка за период: уникальные номера по шагам, конверсия и отвал между шагами, частые переходы"""
+    if key != VERIFY_TOKEN:
+        return {"error": "unauthorized"}
+    store = get_storage()
+    if not store:
+        return {"error": "no redis"}
+    days = _date_range(date_from, date_to)
+    counts, transitions = await store.load_funnel(days, FUNNEL)
+    steps = []
+    for i, ((step, _), phones) in enumerate(zip(FUNNEL, counts)):
+        row = {"step": step, "phones": phones}
+        if i:
+            prev = counts[i - 1]
+            row["conversion"] = round(phones / prev, 3) if prev else None
+            row["drop_off"] = round(1 - phones / prev, 3) if prev else None
+        steps.append(row)
+    return {
+        "from": days[0], "to": days[-1],
+        "steps": steps,
+        "overall": round(counts[-1] / counts[0], 3) if counts[0] else None,
+        "transitions": dict(sorted(transitions.items(), key=lambda kv: -kv[1])[:top]),
+    }
+
+
+@app.get("/stats")
+async def get_stats(key: str = "", date_from: str = Query("", alias="from"), date_to: str = Query("", alias="to"),
+                    top: int = 10):
+    """Продажи за период из дневных счётчиков: ?from=2024-06-01&to=2024-06-30 (по умолчанию — сегодня)"""
+    if key != VERIFY_TOKEN:
+        return {"error": "unauthorized"}
+    store = get_storage()
+    if not store:
+        return {"error": "no redis"}
+    days = _date_range(date_from, date_to)
+    rows = await store.load_daily_stats(days)
+    # Дни без счётчиков (например, до их появления) — из счётчиков архива, которые
+    # посчитала компакция: ещё один пайплайн, архив не распаковывается
+    missing = [i for i, row in enumerate(rows) if not row]
+    if missing:
+        archived = await store.load_archived_stats([days[i] for i in missing])
+        for i, row in zip(missing, archived):
+            rows[i] = row
+
+    totals = {}
+    for row in rows:
+        for field, value in row.items():
+            totals[field] = totals.get(field, 0) + value
+
+    def group(prefix):
+        return {f[len(prefix):]: v for f, v in totals.items() if f.startswith(prefix)}
+
+    variants = current_menu().variants_by_id
+    items_by_id = current_menu().items_by_id
+    top_items = []
+    for vid, qty in sorted(group("item:").items(), key=lambda kv: -kv[1])[:top]:
+        v = variants.get(vid)
+        name = f"{items_by_id[v['item_id']]['ru_name']} {v['ru']}" if v else vid
+        top_items.append({"vid": vid, "name": name, "qty": qty})
+
+    orders, revenue = totals.get("orders", 0), totals.get("revenue", 0)
+    return {
+        "from": days[0], "to": days[-1],
+        "orders": orders, "revenue": revenue,
+        "avg_check": round(revenue / orders) if orders else 0,
+        "rate_limited": totals.get("limited", 0),
+        "top_items": top_items,
+        "payments": group("pay:"),
+        "hours": dict(sorted(group("hour:").items())),
+        "days": [{"date": d, "orders": r.get("orders", 0), "revenue": r.get("revenue", 0)}
+                 for d, r in zip(days, rows)],
+    }
+
+
+@app.get("/cron/compact")
+async def cron_compact(request: Request, key: str = ""):
+    """Архив старых заказов и чистка индексов (Vercel Cron или ?key=VERIFY_TOKEN)"""
+    auth = request.headers.get("authorization", "")
+    if key != VERIFY_TOKEN and not (CRON_SECRET and auth == f"Bearer {CRON_SECRET}"):
+        return {"error": "unauthorized"}
+    store = get_storage()
+    if not store:
+        return {"error": "no redis"}
+    return await compact_module().compact(store, budget=COMPACT_BUDGET,
+                                          namespaces=[n.namespace for n in NUMBERS.values()])
+
+
+@app.get("/cron/crm-sync")
+async def cron_crm_sync(request: Request, key: str = ""):
+    """Сверка с CRM: очередь, статусы заказов, повторная отправка потерянных"""
+    auth = request.headers.get("authorization", "")
+    if key != VERIFY_TOKEN and not (CRON_SECRET and auth == f"Bearer {CRON_SECRET}"):
+        return {"error": "unauthorized"}
+    store = get_storage()
+    if not store:
+        return {"error": "no redis"}
+    return await crm_sync_module().sync_once(store)
+
+
+@app.get("/profile")
+async def profile_status(key: str = "", rate: float = Query(None), seconds: int = 600):
+    """Профилирование на этом инстансе: ?rate=0.05&seconds=600 — включить, ?rate=0 — выключить"""
+    if key != VERIFY_TOKEN:
+        return {"error": "unauthorized"}
+    if rate is not None:
+        profiler.configure(rate, seconds)
+    return profiler.summary()
+
+
+@app.get("/profile/flame")
+async def profile_flame(key: str = "", state: str = "", min_ms: float = 0):
+    """Свёрнутые стеки профилей из буфера (flamegraph.pl / speedscope); ?state= — только это состояние"""
+    if key != VERIFY_TOKEN:
+        return {"error": "unauthorized"}
+    return PlainTextResponse(profiler.collapsed(state or None, min_ms))
+
+
+@app.get("/delivery")
+async def get_delivery(key: str = "", date_from: str = Query("", alias="from"), date_to: str = Query("", alias="to"),
+                       wamid: str = ""):
+    """Доставка исходящих: статусы за период и доля отказов по кодам ошибок Graph;
+    ?wamid=... — история одного сообщения (хранится 2 дня)"""
+    if key != VERIFY_TOKEN:
+        return {"error": "unauthorized"}
+    store = get_storage()
+    if not store:
+        return {"error": "no redis"}
+    if wamid:
+        return {"wamid": wamid, **await store.load_message_status(wamid)}
+
+    days = _date_range(date_from, date_to)
+    rows = await store.load_delivery_stats(days)
+    totals = {}
+    for row in rows:
+        for field, value in row.items():
+            totals[field] = totals.get(field, 0) + value
+
+    # sent приходит не всегда (например, сразу failed) — база для долей: все попытки
+    attempts = max(totals.get("sent", 0), totals.get("delivered", 0) + totals.get("failed", 0))
+
+    def rate(n):
+        return round(n / attempts, 4) if attempts else 0.0
+
+    errors = sorted(((f[4:], n) for f, n in totals.items() if f.startswith("err:")), key=lambda kv: -kv[1])
+    return {
+        "from": days[0], "to": days[-1],
+        **{s: totals.get(s, 0) for s in ("sent", "delivered", "read", "failed")},
+        "delivery_rate": rate(totals.get("delivered", 0)),
+        "failure_rate": rate(totals.get("failed", 0)),
+        "errors": [{"code": code, "count": n, "rate": rate(n)} for code, n in errors],
+        "days": [{"date": d, **{s: r.get(s, 0) for s in ("sent", "delivered", "read", "failed")}}
+                 for d, r in zip(days, rows)],
+    }
+
+
+@app.get("/fsm")
+async def get_fsm(key: str = "", format: str = "json"):
+    """Таблица переходов со счётчиками и временем; format=dot — граф для Graphviz"""
+    if key != VERIFY_TOKEN:
+        return {"error": "unauthorized"}
+    if format == "dot":
+        return PlainTextResponse(fsm.to_dot())
+    return fsm.describe()
+
+
 @app.get("/health")
 async def health():
-    return {"status": "ok", "bot": "Дядя Стейк Бургер WhatsApp Bot", "redis": redis is not None}
+    store = get_storage()
+    cache = session_cache()
+    return {"status": "ok", "bot": "Дядя Стейк Бургер WhatsApp Bot",
+            "redis": store is not None, "storage": store.name if store else None,
+            "menu": current_menu().version,
+            "numbers": [n.describe() for n in NUMBERS.values()],
+            "rate_limit": {"limit": RATE_LIMIT, "window": RATE_WINDOW, **RATE_STATS},
+            "breakers": describe_breakers(),
+            "background": background.pending(),
+            "sessions": {"degraded": cache.degraded, "dirty": cache.dirty_count(), **cache.stats} if cache else None}
 
 
 @app.get("/")
@@ -0,0 +1,174 @@
+"""
+📝 Логирование — JSON-строки, ленивое форматирование, сэмплинг, маскировка
+Каждая строка получает request_id (id входящего сообщения WhatsApp или HTTP-запроса)
+"""
+
+import contextvars
+import json
+import logging
+import random
+import re
+import uuid
+
+try:
+    from .config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLING
+except ImportError:
+    from config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLING
+
+REQUEST_ID = contextvars.ContextVar("request_id", default="-")
+
+# Стандартные атрибуты LogRecord — всё остальное считаем структурными полями из extra=
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+# ==========================================
+# 🙈 МАСКИРОВКА
+# ==========================================
+
+_SECRET_PATTERNS = [
+    (re.compile(r"Bearer\s+[\w.|:-]+"), "Bearer ***"),
+    (re.compile(r"\bbot\d+:[\w-]+"), "bot***"),             # Telegram токен в URL
+    (re.compile(r"\bEAA[A-Za-z0-9]{20,}"), "EAA***"),        # Meta access token
+    (re.compile(r"\b\d{2,4}\|[A-Za-z0-9]{20,}"), "***"),     # Laravel Sanctum (CRM)
+]
+# Казахстанский номер: +7/8 и ровно 10 цифр (разделители — пробел, скобки, дефис).
+# Даты, время, суммы и номера заказов под шаблон не попадают
+_PHONE_RE = re.compile(r"(?<![\d+])\+?[78](?:[\s()-]{0,2}\d){10}(?!\d)")
+
+
+def _mask_phone(m):
+    digits = re.sub(r"\D", "", m.group(0))
+    if len(digits) < 10:
+        return m.group(0)
+    return f"***{digits[-4:]}"
+
+
+def redact(text):
+    """Убирает токены и телефоны (оставляет последние 4 цифры)"""
+    if not isinstance(text, str):
+        return text
+    for pattern, repl in _SECRET_PATTERNS:
+        text = pattern.sub(repl, text)
+    return _PHONE_RE.sub(_mask_phone, text)
+
+
+# ==========================================
+# 🎲 СЭМПЛИНГ
+# ==========================================
+
+def _parse_sampling(spec):
+    rates = {}
+    for part in spec.split(","):
+        name, _, rate = part.partition("=")
+        if name.strip() and rate.strip():
+            try:
+                rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+            except ValueError:
+                pass
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только долю INFO/DEBUG строк для указанных логгеров.
+    WARNING и выше не сэмплируются никогда."""
+
+    def __init__(self, spec=""):
+        super().__init__()
+        self.rates = _parse_sampling(spec)
+        self._cache = {}
+
+    def _rate(self, name):
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            # Самое длинное совпадение: "api.index.wa" важнее "api.index"
+            best = -1
+            for key, r in self.rates.items():
+                if (name == key or name.startswith(key + ".") or name.endswith("." + key)) and len(key) > best:
+                    rate, best = r, len(key)
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = REQUEST_ID.get()
+        return True
+
+
+# ==========================================
+# 🧾 ФОРМАТТЕРЫ
+# ==========================================
+
+class JsonFormatter(logging.Formatter):
+    """Одна строка = один JSON-объект. Сообщение форматируется только здесь,
+    т.е. уже после фильтров уровня и сэмплинга."""
+
+    def format(self, record):
+        out = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "rid": getattr(record, "request_id", "-"),
+            "msg": redact(record.getMessage()),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                out[key] = redact(value) if isinstance(value, str) else value
+        if record.exc_info:
+            out["exc"] = redact(self.formatException(record.exc_info))
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s [%(levelname)s] [%(request_id)s] %(message)s")
+
+    def format(self, record):
+        return redact(super().format(record))
+
+
+def setup_logging():
+    """Настраивает корневой логгер один раз (повторный вызов — no-op)"""
+    root = logging.getLogger()
+    if any(getattr(h, "_bot_handler", False) for h in root.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler._bot_handler = True
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SamplingFilter(LOG_SAMPLING))
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, LOG_LEVEL.upper(), logging.INFO))
+    # httpx пишет каждый запрос на INFO — вместе с URL, где бывает токен
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:12]
+
+
+class RequestIdMiddleware:
+    """ASGI middleware: проставляет request_id на время HTTP-запроса"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rid = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                rid = value.decode("latin-1")[:64]
+                break
+        token = REQUEST_ID.set(rid or new_request_id())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            REQUEST_ID.reset(token)
@@ -0,0 +1,531 @@
+"""
+🧪 In-memory Redis — подмножество команд Redis поверх dict
+Для нагрузочных тестов и локального запуска без Upstash. Ответы в том же виде,
+что отдаёт Redis по сети (HGETALL — плоский список, числа — int)
+"""
+
+import fnmatch
+import hashlib
+import threading
+import time
+import zlib
+
+# sha1(lua) → python-аналог fn(redis, keys, argv); регистрирует код, которому нужен EVAL
+SCRIPTS = {}
+
+
+def register_script(lua):
+    """Декоратор: @register_script(LUA) над def fn(redis, keys, argv)"""
+    def wrap(fn):
+        SCRIPTS[hashlib.sha1(lua.encode()).hexdigest()] = fn
+        return fn
+    return wrap
+
+
+class RedisError(Exception):
+    pass
+
+
+def _scan_page(items, cursor, count):
+    """Страница SCAN/SSCAN: порядок — по crc32 элемента, курсор — crc32 + 1 следующего.
+    Как и в Redis, удаление и добавление во время обхода не заставляет пропускать
+    элементы, которые были в наборе всё это время"""
+    order = sorted((zlib.crc32(_s(i).encode()) + 1, i) for i in items)
+    start = int(cursor)
+    page = [(h, i) for h, i in order if h >= start]
+    chunk = page[:count]
+    nxt = page[count][0] if len(page) > count else 0
+    return str(nxt), [i for _, i in chunk]
+
+
+def _s(value):
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
+
+
+class MemoryRedis:
+    """Потокобезопасное хранилище: {key: (type, value)} + {key: expire_at}"""
+
+    def __init__(self):
+        self._data = {}
+        self._expire = {}
+        self._lock = threading.RLock()
+        self.commands = 0
+
+    # ------------------------------------------
+    # служебное
+    # ------------------------------------------
+
+    def _alive(self, key):
+        exp = self._expire.get(key)
+        if exp is not None and exp <= time.monotonic():
+            self._data.pop(key, None)
+            self._expire.pop(key, None)
+        return key in self._data
+
+    def _get(self, key, kind):
+        if not self._alive(key):
+            return None
+        k, value = self._data[key]
+        if k != kind:
+            raise RedisError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _get_or_create(self, key, kind, factory):
+        value = self._get(key, kind)
+        if value is None:
+            value = factory()
+            self._data[key] = (kind, value)
+        return value
+
+    def _drop_if_empty(self, key):
+        if key in self._data and not self._data[key][1]:
+            self._data.pop(key, None)
+            self._expire.pop(key, None)
+
+    def execute(self, command):
+        """Выполняет одну команду: ["SET", "k", "v", "EX", 60]"""
+        if not command:
+            raise RedisError("ERR empty command")
+        name = _s(command[0]).upper()
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        if handler is None:
+            raise RedisError(f"ERR unknown command '{name}'")
+        with self._lock:
+            self.commands += 1
+            return handler(*[_s(a) for a in command[1:]])
+
+    def pipeline(self, commands):
+        return [self.execute(c) for c in commands]
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+            self._expire.clear()
+
+    # ------------------------------------------
+    # ключи
+    # ------------------------------------------
+
+    def cmd_ping(self, *args):
+        return args[0] if args else "PONG"
+
+    def cmd_del(self, *keys):
+        n = 0
+        for key in keys:
+            if self._alive(key):
+                self._data.pop(key)
+                self._expire.pop(key, None)
+                n += 1
+        return n
+
+    def cmd_exists(self, *keys):
+        return sum(1 for k in keys if self._alive(k))
+
+    def cmd_expire(self, key, seconds):
+        if not self._alive(key):
+            return 0
+        self._expire[key] = time.monotonic() + int(seconds)
+        return 1
+
+    def cmd_ttl(self, key):
+        if not self._alive(key):
+            return -2
+        exp = self._expire.get(key)
+        return -1 if exp is None else max(0, int(exp - time.monotonic()))
+
+    def cmd_type(self, key):
+        return self._data[key][0] if self._alive(key) else "none"
+
+    def cmd_scan(self, cursor, *args):
+        opts = _options(args)
+        match, count = opts.get("MATCH", "*"), int(opts.get("COUNT", 10))
+        nxt, chunk = _scan_page([k for k in list(self._data) if self._alive(k)], cursor, count)
+        return [nxt, [k for k in chunk if fnmatch.fnmatchcase(k, match)]]
+
+    def cmd_evalsha(self, sha, numkeys, *args):
+        fn = SCRIPTS.get(sha)
+        if fn is None:
+            raise RedisError("NOSCRIPT No matching script")
+        n = int(numkeys)
+        return fn(self, list(args[:n]), list(args[n:]))
+
+    def cmd_eval(self, script, numkeys, *args):
+        return self.cmd_evalsha(hashlib.sha1(script.encode()).hexdigest(), numkeys, *args)
+
+    # ------------------------------------------
+    # строки
+    # ------------------------------------------
+
+    def cmd_get(self, key):
+        return self._get(key, "string")
+
+    def cmd_mget(self, *keys):
+        return [self._get(k, "string") if self._alive(k) and self._data[k][0] == "string" else None for k in keys]
+
+    def cmd_set(self, key, value, *args):
+        flags = [a.upper() for a in args]
+        exists = self._alive(key)
+        if ("NX" in flags and exists) or ("XX" in flags and not exists):
+            return None
+        self._data[key] = ("string", value)
+        self._expire.pop(key, None)
+        for flag, unit in (("EX", 1.0), ("PX", 0.001)):
+            if flag in flags:
+                self._expire[key] = time.monotonic() + int(args[flags.index(flag) + 1]) * unit
+        return "OK"
+
+    def cmd_incrby(self, key, amount):
+        value = int(self._get(key, "string") or 0) + int(amount)
+        self._data[key] = ("string", str(value))
+        return value
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, 1)
+
+    # ------------------------------------------
+    # множества
+    # ------------------------------------------
+
+    def cmd_sadd(self, key, *members):
+        s = self._get_or_create(key, "set", set)
+        before = len(s)
+        s.update(members)
+        return len(s) - before
+
+    def cmd_srem(self, key, *members):
+        s = self._get(key, "set") or set()
+        n = sum(1 for m in members if m in s)
+        s.difference_update(members)
+        self._drop_if_empty(key)
+        return n
+
+    def cmd_smembers(self, key):
+        return sorted(self._get(key, "set") or ())
+
+    def cmd_sismember(self, key, member):
+        return int(member in (self._get(key, "set") or ()))
+
+    def cmd_scard(self, key):
+        return len(self._get(key, "set") or ())
+
+    def cmd_sscan(self, key, cursor, *args):
+        opts = _options(args)
+        match, count = opts.get("MATCH", "*"), int(opts.get("COUNT", 10))
+        nxt, chunk = _scan_page(self._get(key, "set") or (), cursor, count)
+        return [nxt, [m for m in chunk if fnmatch.fnmatchcase(m, match)]]
+
+    # ------------------------------------------
+    # HyperLogLog (здесь — точное множество: тот же ответ, без погрешности)
+    # ------------------------------------------
+
+    def cmd_pfadd(self, key, *members):
+        s = self._get_or_create(key, "hll", set)
+        before = len(s)
+        s.update(members)
+        return int(len(s) != before or not before)
+
+    def cmd_pfcount(self, *keys):
+        union = set()
+        for key in keys:
+            union |= self._get(key, "hll") or set()
+        return len(union)
+
+    # ------------------------------------------
+    # списки
+    # ------------------------------------------
+
+    def cmd_lpush(self, key, *values):
+        lst = self._get_or_create(key, "list", list)
+        for v in values:
+            lst.insert(0, v)
+        return len(lst)
+
+    def cmd_rpush(self, key, *values):
+        lst = self._get_or_create(key, "list", list)
+        lst.extend(values)
+        return len(lst)
+
+    def cmd_llen(self, key):
+        return len(self._get(key, "list") or ())
+
+    def cmd_lindex(self, key, index):
+        lst = self._get(key, "list") or []
+        try:
+            return lst[int(index)]
+        except IndexError:
+            return None
+
+    def cmd_lrange(self, key, start, stop):
+        lst = self._get(key, "list") or []
+        start, stop = int(start), int(stop)
+        stop = stop + 1 if stop >= 0 else len(lst) + stop + 1
+        return lst[start if start >= 0 else max(0, len(lst) + start):stop]
+
+    def cmd_ltrim(self, key, start, stop):
+        lst = self._get(key, "list")
+        if lst is not None:
+            lst[:] = self.cmd_lrange(key, start, stop)
+            self._drop_if_empty(key)
+        return "OK"
+
+    def cmd_lrem(self, key, count, value):
+        lst = self._get(key, "list") or []
+        count = int(count)
+        removed = 0
+        idx = range(len(lst)) if count >= 0 else range(len(lst) - 1, -1, -1)
+        drop = []
+        for i in idx:
+            if lst[i] == value and (count == 0 or removed < abs(count)):
+                drop.append(i)
+                removed += 1
+        for i in sorted(drop, reverse=True):
+            del lst[i]
+        self._drop_if_empty(key)
+        return removed
+
+    def cmd_rpop(self, key):
+        lst = self._get(key, "list") or []
+        value = lst.pop() if lst else None
+        self._drop_if_empty(key)
+        return value
+
+    # ------------------------------------------
+    # хэши
+    # ------------------------------------------
+
+    def cmd_hset(self, key, *pairs):
+        h = self._get_or_create(key, "hash", dict)
+        added = 0
+        for f, v in zip(pairs[::2], pairs[1::2]):
+            added += f not in h
+            h[f] = v
+        return added
+
+    def cmd_hsetnx(self, key, field, value):
+        h = self._get_or_create(key, "hash", dict)
+        if field in h:
+            return 0
+        h[field] = value
+        return 1
+
+    def cmd_hget(self, key, field):
+        return (self._get(key, "hash") or {}).get(field)
+
+    def cmd_hmget(self, key, *fields):
+        h = self._get(key, "hash") or {}
+        return [h.get(f) for f in fields]
+
+    def cmd_hgetall(self, key):
+        h = self._get(key, "hash") or {}
+        return [x for kv in h.items() for x in kv]
+
+    def cmd_hdel(self, key, *fields):
+        h = self._get(key, "hash") or {}
+        n = sum(1 for f in fields if h.pop(f, None) is not None)
+        self._drop_if_empty(key)
+        return n
+
+    def cmd_hincrby(self, key, field, amount):
+        h = self._get_or_create(key, "hash", dict)
+        h[field] = str(int(h.get(field, 0)) + int(amount))
+        return int(h[field])
+
+    def cmd_hlen(self, key):
+        return len(self._get(key, "hash") or ())
+
+    # ------------------------------------------
+    # упорядоченные множества (dict член → счёт, сортировка при чтении)
+    # ------------------------------------------
+
+    def _zsorted(self, key):
+        z = self._get(key, "zset") or {}
+        return sorted(z.items(), key=lambda kv: (kv[1], kv[0]))
+
+    def cmd_zadd(self, key, *args):
+        flags = set()
+        while args and args[0].upper() in ("NX", "XX", "GT", "LT", "CH"):
+            flags.add(args[0].upper())
+            args = args[1:]
+        z = self._get_or_create(key, "zset", dict)
+        added = 0
+        for i in range(0, len(args), 2):
+            score, member = float(args[i]), args[i + 1]
+            exists = member in z
+            if ("NX" in flags and exists) or ("XX" in flags and not exists):
+                continue
+            if exists and (("GT" in flags and score <= z[member]) or ("LT" in flags and score >= z[member])):
+                continue
+            added += not exists
+            z[member] = score
+        self._drop_if_empty(key)
+        return added
+
+    def cmd_zrem(self, key, *members):
+        z = self._get(key, "zset") or {}
+        n = sum(1 for m in members if z.pop(m, None) is not None)
+        self._drop_if_empty(key)
+        return n
+
+    def cmd_zcard(self, key):
+        return len(self._get(key, "zset") or ())
+
+    def cmd_zscore(self, key, member):
+        score = (self._get(key, "zset") or {}).get(member)
+        return None if score is None else _num(score)
+
+    def cmd_zcount(self, key, lo, hi):
+        return sum(1 for _, sc in self._zsorted(key) if _in_range(sc, lo, hi))
+
+    def cmd_zrank(self, key, member):
+        for i, (m, _) in enumerate(self._zsorted(key)):
+            if m == member:
+                return i
+        return None
+
+    def cmd_zrange(self, key, start, stop, *args):
+        items = self._zsorted(key)
+        start, stop = int(start), int(stop)
+        n = len(items)
+        start = max(0, start + n if start < 0 else start)
+        stop = stop + n if stop < 0 else min(stop, n - 1)
+        return _zreply(items[start:stop + 1], "WITHSCORES" in (a.upper() for a in args))
+
+    def cmd_zrangebyscore(self, key, lo, hi, *args):
+        items = [(m, sc) for m, sc in self._zsorted(key) if _in_range(sc, lo, hi)]
+        upper = [a.upper() for a in args]
+        if "LIMIT" in upper:
+            i = upper.index("LIMIT")
+            offset, count = int(args[i + 1]), int(args[i + 2])
+            items = items[offset:offset + count if count >= 0 else None]
+        return _zreply(items, "WITHSCORES" in upper)
+
+    def cmd_zremrangebyscore(self, key, lo, hi):
+        z = self._get(key, "zset") or {}
+        gone = [m for m, sc in z.items() if _in_range(sc, lo, hi)]
+        for m in gone:
+            del z[m]
+        self._drop_if_empty(key)
+        return len(gone)
+
+    # ------------------------------------------
+    # потоки ({"last": (ms, seq), "entries": [((ms, seq), [поле, значение, ...])]})
+    # ------------------------------------------
+
+    def cmd_xadd(self, key, *args):
+        args = list(args)
+        maxlen = None
+        if args and args[0].upper() == "MAXLEN":
+            args.pop(0)
+            if args[0] in ("~", "="):
+                args.pop(0)
+            maxlen = int(args.pop(0))
+        xid, fields = args[0], args[1:]
+        if not fields or len(fields) % 2:
+            raise RedisError("ERR wrong number of arguments for 'xadd' command")
+        stream = self._get_or_create(key, "stream", lambda: {"last": (0, 0), "entries": []})
+        last = stream["last"]
+        if xid == "*":
+            ms = max(int(time.time() * 1000), last[0])
+            new = (ms, last[1] + 1 if ms == last[0] else 0)
+        else:
+            new = _xid(xid)
+        if new <= last:
+            raise RedisError("ERR The ID specified in XADD is equal or smaller than the target stream top item")
+        stream["last"] = new
+        stream["entries"].append((new, fields))
+        # MAXLEN ~ в Redis обрезает «не меньше N», здесь — ровно N
+        if maxlen is not None and len(stream["entries"]) > maxlen:
+            del stream["entries"][:len(stream["entries"]) - maxlen]
+        return _xfmt(new)
+
+    def cmd_xlen(self, key):
+        stream = self._get(key, "stream")
+        return len(stream["entries"]) if stream else 0
+
+    def _xslice(self, key, lo, hi, args):
+        stream = self._get(key, "stream")
+        entries = stream["entries"] if stream else []
+        (a, ax), (b, bx) = _xbound(lo, 0), _xbound(hi, 1 << 64)
+        return [(i, f) for i, f in entries
+                if (i > a if ax else i >= a) and (i < b if bx else i <= b)], _options(args)
+
+    def cmd_xrange(self, key, start, end, *args):
+        items, opts = self._xslice(key, start, end, args)
+        return _xreply(items[:int(opts["COUNT"])] if "COUNT" in opts else items)
+
+    def cmd_xrevrange(self, key, end, start, *args):
+        items, opts = self._xslice(key, start, end, args)
+        items = items[::-1]
+        return _xreply(items[:int(opts["COUNT"])] if "COUNT" in opts else items)
+
+    def cmd_xread(self, *args):
+        """XREAD [COUNT n] [BLOCK ms] STREAMS k... id... — без ожидания: BLOCK не держит поток"""
+        upper = [a.upper() for a in args]
+        i = upper.index("STREAMS")
+        opts = _options(args[:i])
+        rest = args[i + 1:]
+        keys, ids = rest[:len(rest) // 2], rest[len(rest) // 2:]
+        out = []
+        for key, after in zip(keys, ids):
+            stream = self._get(key, "stream")
+            if after == "$":
+                continue
+            items = [(i, f) for i, f in (stream["entries"] if stream else ()) if i > _xid(after)]
+            if "COUNT" in opts:
+                items = items[:int(opts["COUNT"])]
+            if items:
+                out.append([key, _xreply(items)])
+        return out or None
+
+
+def _num(score):
+    # Redis отдаёт счёт строкой: 1.5 → "1.5", 3.0 → "3"
+    return str(int(score)) if score == int(score) else repr(score)
+
+
+def _bound(value):
+    """"(5" → (5.0, строго), "-inf" → (-inf, нестрого)"""
+    exclusive = value.startswith("(")
+    value = value[1:] if exclusive else value
+    return float(value.replace("inf", "Infinity") if "inf" in value else value), exclusive
+
+
+def _in_range(score, lo, hi):
+    (a, ax), (b, bx) = _bound(lo), _bound(hi)
+    return (score > a if ax else score >= a) and (score < b if bx else score <= b)
+
+
+def _zreply(items, with_scores):
+    if not with_scores:
+        return [m for m, _ in items]
+    return [x for m, sc in items for x in (m, _num(sc))]
+
+
+def _xid(value, seq_default=0):
+    ms, _, seq = value.partition("-")
+    return int(ms), int(seq) if seq else seq_default
+
+
+def _xbound(value, seq_default):
+    """XRANGE: "-", "+", "(1-2" (строго), "1" (seq по краю диапазона)"""
+    if value == "-":
+        return (0, 0), False
+    if value == "+":
+        return (1 << 64, 1 << 64), False
+    exclusive = value.startswith("(")
+    return _xid(value[1:] if exclusive else value, seq_default), exclusive
+
+
+def _xfmt(xid):
+    return f"{xid[0]}-{xid[1]}"
+
+
+def _xreply(items):
+    return [[_xfmt(i), list(f)] for i, f in items]
+
+
+def _options(args):
+    """["MATCH", "x*", "COUNT", "100"] → {"MATCH": "x*", "COUNT": "100"}"""
+    return {args[i].upper(): args[i + 1] for i in range(0, len(args) - 1, 2)}
@@ -0,0 +1,198 @@
+"""
+📋 Меню с горячей перезагрузкой
+Встроенное меню — api/config.py. Поверх него можно опубликовать документ
+{"categories", "items", "aliases"} в Redis (menu:doc + счётчик menu:version)
+или в файл MENU_FILE — инстансы раз в MENU_CHECK_INTERVAL сверяют версию
+одним GET/stat, а при изменении собирают новый снимок в фоне и подменяют
+его одной операцией присваивания. Запрос всегда работает с целым снимком.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+try:
+    from .config import (
+        CATEGORIES, MENU_ITEMS, _ALIASES, MENU_INDEX, build_menu_index,
+        MENU_SOURCE, MENU_FILE, MENU_CHECK_INTERVAL, t,
+    )
+    from .background import spawn
+except ImportError:
+    from config import (
+        CATEGORIES, MENU_ITEMS, _ALIASES, MENU_INDEX, build_menu_index,
+        MENU_SOURCE, MENU_FILE, MENU_CHECK_INTERVAL, t,
+    )
+    from background import spawn
+
+logger = logging.getLogger(__name__)
+
+DOC_KEY = "menu:doc"
+VERSION_KEY = "menu:version"
+BUILTIN = "builtin"
+
+
+class Menu:
+    """Неизменяемый снимок меню со всеми производными индексами"""
+    __slots__ = ("version", "categories", "items", "aliases",
+                 "items_by_id", "variants_by_id", "index")
+
+    def __init__(self, version, categories, items, aliases, index=None):
+        self.version = str(version)
+        self.categories = categories
+        self.items = items
+        self.aliases = aliases
+        self.items_by_id = {i["id"]: i for i in items}
+        self.variants_by_id = {}
+        for item in items:
+            for v in item["variants"]:
+                self.variants_by_id[v["id"]] = {**v, "item_id": item["id"]}
+        self.index = index or build_menu_index(categories, items, aliases)
+
+    def category(self, cat_id):
+        return next((c for c in self.categories if c["id"] == cat_id), None)
+
+
+def build_menu(doc, version=None):
+    """Снимок из документа; ValueError — документ битый (текущее меню остаётся)"""
+    categories = doc.get("categories") or []
+    items = doc.get("items") or []
+    aliases = [tuple(a) for a in doc.get("aliases") or _ALIASES]
+    if not categories or not items:
+        raise ValueError("menu document has no categories or items")
+    cat_ids = {c["id"] for c in categories}
+    seen = set()
+    for item in items:
+        if item.get("cat") not in cat_ids:
+            raise ValueError(f"item {item.get('id')}: unknown category {item.get('cat')}")
+        if not item.get("variants"):
+            raise ValueError(f"item {item.get('id')}: no variants")
+        item.setdefault("kz_name", item["ru_name"])
+        for key in ("ru_desc", "kz_desc", "note_ru", "note_kz"):
+            item.setdefault(key, "")
+        for v in item["variants"]:
+            if v["id"] in seen:
+                raise ValueError(f"duplicate variant id {v['id']}")
+            if not isinstance(v.get("price"), int) or v["price"] <= 0:
+                raise ValueError(f"variant {v['id']}: bad price {v.get('price')!r}")
+            v.setdefault("kz", v["ru"])
+            seen.add(v["id"])
+    for keywords, vid, _prio in aliases:
+        if vid not in seen:
+            raise ValueError(f"alias {keywords} → unknown variant {vid}")
+    return Menu(doc.get("version", "doc") if version is None else version, categories, items, aliases)
+
+
+def builtin_document():
+    return {"categories": CATEGORIES, "items": MENU_ITEMS, "aliases": [list(a) for a in _ALIASES]}
+
+
+_current = Menu(BUILTIN, CATEGORIES, MENU_ITEMS, _ALIASES, MENU_INDEX)
+_checked_at = 0.0
+_refreshing = None
+
+
+def current_menu():
+    return _current
+
+
+def _swap(menu):
+    global _current
+    old = _current.version
+    _current = menu
+    logger.info("Menu reloaded: %s → %s (%s items)", old, menu.version, len(menu.items))
+
+
+# ------------------------------------------
+# источники
+# ------------------------------------------
+
+async def _remote_version(store):
+    if MENU_SOURCE == "file":
+        st = await asyncio.to_thread(os.stat, MENU_FILE)
+        return f"file:{st.st_mtime_ns}:{st.st_size}"
+    return await store.execute("GET", VERSION_KEY)
+
+
+async def _fetch(store, version):
+    if MENU_SOURCE == "file":
+        def read():
+            with open(MENU_FILE, encoding="utf-8") as f:
+                return json.load(f)
+        return await asyncio.to_thread(read), version
+    raw = await store.execute("GET", DOC_KEY)
+    if not raw:
+        return None, version
+    doc = json.loads(raw)
+    # Версия берётся из самого документа: если публикация идёт прямо сейчас,
+    # следующая проверка увидит более новый счётчик и перечитает ещё раз
+    return doc, str(doc.get("version", version))
+
+
+async def refresh(store, force=False):
+    """Сверяет версию и при изменении собирает и подменяет снимок"""
+    global _checked_at
+    _checked_at = time.monotonic()
+    if MENU_SOURCE == "builtin" or (MENU_SOURCE != "file" and store is None):
+        return _current
+    try:
+        version = await _remote_version(store)
+        if not version:
+            if _current.version != BUILTIN:
+                _swap(Menu(BUILTIN, CATEGORIES, MENU_ITEMS, _ALIASES, MENU_INDEX))
+            return _current
+        if str(version) == _current.version and not force:
+            return _current
+        doc, version = await _fetch(store, str(version))
+        if doc is None:
+            return _current
+        # Сборка индексов — чистый CPU, уводим из event loop
+        menu = await asyncio.to_thread(build_menu, doc, version)
+        _swap(menu)
+    except Exception as e:
+        logger.error("Menu refresh failed, keeping %s: %s", _current.version, e)
+    return _current
+
+
+def refresh_menu(store):
+    """Не блокирует запрос: раз в MENU_CHECK_INTERVAL запускает refresh() в фоне"""
+    global _refreshing
+    if time.monotonic() - _checked_at < MENU_CHECK_INTERVAL:
+        return None
+    if _refreshing is not None and not _refreshing.done():
+        return _refreshing
+    _refreshing = spawn(refresh(store), name="menu-refresh")
+    return _refreshing
+
+
+async def publish(store, doc):
+    """Записывает документ в Redis (MENU_SOURCE=redis); возвращает новую версию"""
+    build_menu(json.loads(json.dumps(doc)), "check")   # не публикуем битое меню
+    version = await store.execute("INCR", VERSION_KEY)
+    await store.execute("SET", DOC_KEY, json.dumps({**doc, "version": str(version)}, ensure_ascii=False))
+    return str(version)
+
+
+# ------------------------------------------
+# корзина против актуального меню
+# ------------------------------------------
+
+def reprice_cart(s, menu=None):
+    """Приводит цены корзины к текущему меню, позиции, которых больше нет, убирает.
+    Возвращает строки изменений для клиента (пусто — ничего не поменялось)"""
+    menu = menu or _current
+    lang = s.get("lang", "ru")
+    changes, cart = [], []
+    for c in s.get("cart", []):
+        name = c.get(f"name_{lang}", c.get("name_ru", ""))
+        v = menu.variants_by_id.get(c.get("vid"))
+        if v is None:
+            changes.append(f"• {name} — {t('item_gone', lang)}")
+            continue
+        if v["price"] != c.get("price"):
+            changes.append(f"• {name}: {c.get('price', 0):,} → {v['price']:,} тг")
+            c["price"] = v["price"]
+        cart.append(c)
+    s["cart"] = cart
+    return changes
@@ -0,0 +1,175 @@
+"""
+📺 Живая лента заказов для кухни (SSE /orders/stream)
+Источник — поток orders:stream: store_order пишет туда новый заказ (new) тем же
+пайплайном, сверка с CRM — смену статуса (status). На процесс один опросчик:
+XREAD раз в ORDERS_STREAM_POLL сек (Upstash REST не умеет блокирующий XREAD),
+пока есть хоть один подписчик, и раздаёт события по очередям подписчиков.
+Опросчик — фоновая задача (background.spawn); ушёл последний подписчик — она
+отменяется, не дожидаясь очередного опроса.
+  • память на соединение постоянна — очередь не длиннее ORDERS_STREAM_BUFFER;
+  • медленный экран никого не тормозит: переполнил очередь — соединение
+    закрывается, EventSource переподключается с Last-Event-ID и дочитывает
+    пропущенное из Redis страницами;
+  • Last-Event-ID (или ?last_event_id= при первом подключении) — продолжить
+    с события после него; ?backlog=N — начать с N последних.
+"""
+
+import asyncio
+import logging
+import time
+
+try:
+    from . import background
+    from .config import ORDERS_STREAM_POLL, ORDERS_STREAM_BUFFER, ORDERS_STREAM_HEARTBEAT, ORDERS_STREAM_MAX_AGE
+    from .storage import ORDERS_STREAM_KEY as KEY
+except ImportError:
+    import background
+    from config import ORDERS_STREAM_POLL, ORDERS_STREAM_BUFFER, ORDERS_STREAM_HEARTBEAT, ORDERS_STREAM_MAX_AGE
+    from storage import ORDERS_STREAM_KEY as KEY
+
+logger = logging.getLogger(__name__)
+
+REPLAY_PAGE = 100
+_subscribers = set()
+_poller = {"task": None, "ready": None, "last": None}
+
+
+class Subscriber:
+    __slots__ = ("queue", "lagged")
+
+    def __init__(self):
+        self.queue = asyncio.Queue(ORDERS_STREAM_BUFFER)
+        self.lagged = False
+
+
+def _xid(value):
+    ms, _, seq = str(value).partition("-")
+    return int(ms), int(seq or 0)
+
+
+def _format(xid, fields):
+    # data — однострочный JSON, поэтому одна строка data:
+    return f"id: {xid}\nevent: {fields.get('type', 'message')}\ndata: {fields.get('data', '{}')}\n\n"
+
+
+def stats():
+    return {"subscribers": len(_subscribers), "polling": _poller["task"] is not None and not _poller["task"].done(),
+            "last_id": _poller["last"]}
+
+
+# ==========================================
+# 📡 ОПРОСЧИК (один на процесс)
+# ==========================================
+
+def _publish(entries):
+    for sub in list(_subscribers):
+        for entry in entries:
+            try:
+                sub.queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                # Дальше этот экран дочитает из Redis после переподключения
+                sub.lagged = True
+                _subscribers.discard(sub)
+                break
+
+
+async def _poll(store, ready):
+    # Старт — с хвоста потока: всё, что раньше, подписчик берёт из истории сам
+    try:
+        tail = await store.execute("XREVRANGE", KEY, "+", "-", "COUNT", 1)
+        _poller["last"] = tail[0][0] if tail else "0-0"
+    except Exception as e:
+        logger.warning("Orders feed start failed: %s", e)
+        _poller["last"] = f"{int(time.time() * 1000)}-0"
+    ready.set_result(None)
+    while _subscribers:
+        try:
+            res = await store.execute("XREAD", "COUNT", REPLAY_PAGE, "STREAMS", KEY, _poller["last"])
+            rows = (res or {}).get(KEY, [])
+        except Exception as e:
+            logger.warning("Orders feed poll failed: %s", e)
+            rows = []
+        if rows:
+            _poller["last"] = rows[-1][0]
+            _publish(rows)
+        if len(rows) < REPLAY_PAGE:
+            await asyncio.sleep(ORDERS_STREAM_POLL)
+
+
+async def subscribe(store):
+    """Подписка; первый подписчик запускает опросчик и ждёт, пока тот найдёт хвост потока"""
+    sub = Subscriber()
+    _subscribers.add(sub)
+    task = _poller["task"]
+    if task is None or task.done():
+        ready = asyncio.get_running_loop().create_future()
+        _poller.update(ready=ready, task=background.spawn(_poll(store, ready), name="orders-feed"))
+    try:
+        await asyncio.shield(_poller["ready"])
+    except BaseException:
+        unsubscribe(sub)
+        raise
+    return sub
+
+
+def unsubscribe(sub):
+    """Отписка; последний подписчик останавливает опросчик"""
+    _subscribers.discard(sub)
+    task = _poller["task"]
+    if not _subscribers and task is not None:
+        # Сразу забываем задачу: новый подписчик не должен ждать уже отменённую
+        _poller.update(task=None, ready=None)
+        if not task.done():
+            task.cancel()
+
+
+# ==========================================
+# 📤 СОБЫТИЯ ОДНОГО СОЕДИНЕНИЯ
+# ==========================================
+
+async def _replay(store, after):
+    """Пропущенное после after — страницами по REPLAY_PAGE"""
+    while True:
+        rows = await store.execute("XRANGE", KEY, f"({after}", "+", "COUNT", REPLAY_PAGE)
+        for row in rows:
+            yield row
+        if len(rows) < REPLAY_PAGE:
+            return
+        after = rows[-1][0]
+
+
+async def events(store, last_id="", backlog=0):
+    """Текст SSE: сначала пропущенное (или backlog последних), затем живые события"""
+    sub = await subscribe(store)
+    started = time.monotonic()
+    try:
+        yield f"retry: {int(ORDERS_STREAM_POLL * 1000) + 2000}\n\n"
+        # Подписка раньше чтения истории: событие попадёт или в историю, или в очередь;
+        # дубль отсекается по id
+        sent = last_id
+        if last_id:
+            async for xid, fields in _replay(store, last_id):
+                yield _format(xid, fields)
+                sent = xid
+        elif backlog:
+            rows = await store.execute("XREVRANGE", KEY, "+", "-", "COUNT", backlog)
+            for xid, fields in reversed(rows):
+                yield _format(xid, fields)
+                sent = xid
+        while True:
+            try:
+                xid, fields = await asyncio.wait_for(sub.queue.get(), ORDERS_STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+            else:
+                if not sent or _xid(xid) > _xid(sent):
+                    yield _format(xid, fields)
+                    sent = xid
+            if sub.lagged and sub.queue.empty():
+                logger.info("Orders feed: slow client dropped at %s", sent)
+                return
+            if ORDERS_STREAM_MAX_AGE and time.monotonic() - started > ORDERS_STREAM_MAX_AGE:
+                return
+    finally:
+        unsubscribe(sub)
+
@@ -0,0 +1,187 @@
+"""
+🔬 Профилирование живых запросов по запросу
+Выключено по умолчанию: webhook зовёт handle() напрямую, поток-сэмплер не запущен.
+Включается PROFILE_RATE или /profile?key=...&rate=0.05&seconds=600 (на этом инстансе):
+тогда доля rate входящих сообщений идёт через run(). Поток-сэмплер раз в
+PROFILE_INTERVAL мс снимает стек каждого такого запроса:
+  • запрос сейчас на CPU — стек потока event loop от корутины запроса вглубь;
+  • запрос ждёт (Redis, Graph, CRM) — цепочка cr_await его корутин + [await].
+Это wall-clock профиль: видно и CPU, и ожидание. Готовый профиль (состояние FSM
+на входе, длительность, свёрнутые стеки) кладётся в кольцевой буфер
+PROFILE_BUFFER; /profile/flame отдаёт сумму в формате collapsed stacks
+(flamegraph.pl, speedscope, inferno).
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+try:
+    from .config import PROFILE_RATE, PROFILE_INTERVAL, PROFILE_BUFFER
+except ImportError:
+    from config import PROFILE_RATE, PROFILE_INTERVAL, PROFILE_BUFFER
+
+# Запросы под профилировщиком прямо сейчас (читает поток-сэмплер)
+ACTIVE = set()
+PROFILES = deque(maxlen=PROFILE_BUFFER)
+_current = ContextVar("profile", default=None)
+_settings = {"rate": PROFILE_RATE, "until": None}
+_wake = threading.Event()
+_sampler = None
+
+
+class Profile:
+    __slots__ = ("state", "coro", "thread", "started", "ms", "samples", "stacks")
+
+    def __init__(self, coro, thread):
+        self.state = "?"
+        self.coro = coro
+        self.thread = thread
+        self.started = time.monotonic()
+        self.ms = 0.0
+        self.samples = 0
+        self.stacks = Counter()
+
+
+# ==========================================
+# 🎚 ВКЛЮЧЕНИЕ
+# ==========================================
+
+def rate():
+    """Текущая доля профилируемых сообщений (истёкшее включение — 0)"""
+    until = _settings["until"]
+    if until is not None and time.monotonic() >= until:
+        _settings.update(rate=0.0, until=None)
+    return _settings["rate"]
+
+
+def configure(new_rate, seconds=None):
+    _settings["rate"] = max(0.0, min(1.0, float(new_rate)))
+    _settings["until"] = time.monotonic() + seconds if seconds and _settings["rate"] else None
+
+
+def sampled():
+    r = _settings["rate"] and rate()
+    return bool(r) and random.random() < r
+
+
+def tag_state(state):
+    """Состояние FSM на входе в handle() — метка профиля"""
+    prof = _current.get()
+    if prof is not None:
+        prof.state = state
+
+
+# ==========================================
+# 📸 СЭМПЛЕР
+# ==========================================
+
+def _name(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _running_stack(coro, thread, frames):
+    """Стек запроса, если он сейчас исполняется в потоке loop, иначе None"""
+    top = coro.cr_frame
+    frame = frames.get(thread)
+    if top is None or frame is None:
+        return None
+    stack = []
+    while frame is not None:
+        stack.append(_name(frame.f_code))
+        if frame is top:
+            return stack[::-1]
+        frame = frame.f_back
+    return None
+
+
+def _awaiting_stack(coro):
+    stack, awaitable = [], coro
+    while awaitable is not None and getattr(awaitable, "cr_frame", None) is not None:
+        stack.append(_name(awaitable.cr_frame.f_code))
+        awaitable = awaitable.cr_await
+    stack.append("[await]")
+    return stack
+
+
+def _sample_loop():
+    interval = PROFILE_INTERVAL / 1000
+    while True:
+        if not ACTIVE:
+            _wake.wait()
+            _wake.clear()
+            continue
+        frames = sys._current_frames()
+        for prof in list(ACTIVE):
+            coro = prof.coro
+            if coro is None:
+                continue             # запрос только что завершился
+            try:
+                stack = _running_stack(coro, prof.thread, frames) or _awaiting_stack(coro)
+            except Exception:
+                continue
+            prof.stacks[";".join(stack)] += 1
+            prof.samples += 1
+        del frames
+        time.sleep(interval)
+
+
+def _ensure_sampler():
+    global _sampler
+    if _sampler is None:
+        _sampler = threading.Thread(target=_sample_loop, name="profiler", daemon=True)
+        _sampler.start()
+
+
+async def run(coro):
+    """await coro под профилировщиком; профиль — в PROFILES"""
+    prof = Profile(coro, threading.get_ident())
+    token = _current.set(prof)
+    ACTIVE.add(prof)
+    _ensure_sampler()
+    _wake.set()
+    try:
+        return await coro
+    finally:
+        ACTIVE.discard(prof)
+        _current.reset(token)
+        prof.ms = (time.monotonic() - prof.started) * 1000
+        prof.coro = None
+        PROFILES.append(prof)
+
+
+# ==========================================
+# 📤 ВЫГРУЗКА
+# ==========================================
+
+def collapsed(state=None, min_ms=0):
+    """Сумма профилей буфера в формате collapsed stacks: "state:X;a;b;c N" по строке"""
+    total = Counter()
+    for prof in list(PROFILES):
+        if (state and prof.state != state) or prof.ms < min_ms:
+            continue
+        for stack, n in prof.stacks.items():
+            total[f"state:{prof.state};{stack}"] += n
+    return "".join(f"{stack} {n}\n" for stack, n in sorted(total.items()))
+
+
+def summary():
+    by_state = {}
+    for prof in list(PROFILES):
+        row = by_state.setdefault(prof.state, {"requests": 0, "samples": 0, "ms": []})
+        row["requests"] += 1
+        row["samples"] += prof.samples
+        row["ms"].append(prof.ms)
+    for row in by_state.values():
+        ms = sorted(row.pop("ms"))
+        row["avg_ms"] = round(sum(ms) / len(ms), 1)
+        row["max_ms"] = round(ms[-1], 1)
+    until = _settings["until"]
+    return {"rate": rate(), "interval_ms": PROFILE_INTERVAL, "buffer": f"{len(PROFILES)}/{PROFILE_BUFFER}",
+            "active": len(ACTIVE), "expires_in": round(until - time.monotonic()) if until else None,
+            "states": by_state}
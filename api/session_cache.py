@@ -0,0 +1,168 @@
+"""
+🧠 L1-кэш сессий в памяти процесса
+Тёплый инстанс обычно обрабатывает подряд несколько нажатий одного клиента —
+держим последнюю сессию (JSON + версия) в LRU с TTL и сверяем версию с Redis
+одним лёгким запросом вместо чтения всей сессии. Тем же запросом приходит
+профиль клиента (адреса, телефон, оплата) — в сессии он лежит под ключом
+"_profile" и в Redis вместе с ней не пишется.
+Если Redis недоступен — отдаём сессию из памяти, а записи копим как «грязные»
+и дописываем в Redis, когда он снова отвечает.
+"""
+
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+
+try:
+    from .config import SESSION_CACHE_SIZE, SESSION_CACHE_TTL
+    from .background import spawn
+except ImportError:
+    from config import SESSION_CACHE_SIZE, SESSION_CACHE_TTL
+    from background import spawn
+
+logger = logging.getLogger(__name__)
+
+
+def new_version():
+    return uuid.uuid4().hex[:12]
+
+
+class _Entry:
+    __slots__ = ("raw", "version", "stored_at", "dirty", "base_version")
+
+    def __init__(self, raw, version, dirty=False, base_version=None):
+        self.raw = raw
+        self.version = version
+        self.stored_at = time.monotonic()
+        self.dirty = dirty
+        # Версия в Redis, поверх которой сделана «грязная» запись
+        self.base_version = base_version
+
+
+class SessionCache:
+    def __init__(self, storage, max_size=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL):
+        self.storage = storage
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.degraded = False
+        self._flushing = False
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "fallbacks": 0, "writebacks": 0}
+
+    # ------------------------------------------
+    # LRU
+    # ------------------------------------------
+
+    def _get(self, phone):
+        entry = self._entries.get(phone)
+        if entry is None:
+            return None
+        # Грязные записи не выкидываем по TTL — они ещё не доехали до Redis
+        if not entry.dirty and time.monotonic() - entry.stored_at > self.ttl:
+            del self._entries[phone]
+            return None
+        self._entries.move_to_end(phone)
+        return entry
+
+    def _put(self, phone, entry):
+        self._entries[phone] = entry
+        self._entries.move_to_end(phone)
+        while len(self._entries) > self.max_size:
+            old_phone, old = self._entries.popitem(last=False)
+            if old.dirty:
+                logger.warning("Session L1 evicted unsaved session of %s", old_phone)
+
+    def dirty_count(self):
+        return sum(1 for e in self._entries.values() if e.dirty)
+
+    # ------------------------------------------
+    # чтение / запись
+    # ------------------------------------------
+
+    async def load(self, phone):
+        """(сессия | None, профиль | None); сессии нет ни в Redis, ни в памяти — None"""
+        entry = self._get(phone)
+        try:
+            if entry is not None and not entry.dirty:
+                changed, raw, profile = await self.storage.load_session_if_changed(phone, entry.version)
+                if not changed:
+                    self.stats["hits"] += 1
+                    self._recovered()
+                    return json.loads(entry.raw), profile
+                self.stats["stale"] += 1
+            else:
+                self.stats["misses"] += 1
+                changed, raw, profile = await self.storage.load_session_if_changed(phone, "")
+            self._recovered()
+        except Exception as e:
+            self._degrade(e)
+            if entry is not None:
+                self.stats["fallbacks"] += 1
+                return json.loads(entry.raw), None
+            return None, None
+
+        if entry is not None and entry.dirty:
+            # Пока Redis лежал, мы писали поверх entry.base_version. Если за это
+            # время сессию никто не трогал — наша версия новее, иначе берём Redis
+            current = json.loads(raw) if raw else None
+            if current is None or current.get("_v") == entry.base_version:
+                return json.loads(entry.raw), profile
+            entry.dirty = False
+
+        if not raw:
+            self._entries.pop(phone, None)
+            return None, profile
+        s = json.loads(raw)
+        self._put(phone, _Entry(raw, s.get("_v", "")))
+        return s, profile
+
+    async def save(self, phone, s, extra=()):
+        """extra — команды для того же пайплайна; пока Redis недоступен, они теряются"""
+        prev = self._entries.get(phone)
+        base = prev.base_version if prev is not None and prev.dirty else (prev.version if prev else None)
+        s["_v"] = new_version()
+        raw = json.dumps({k: v for k, v in s.items() if k != "_profile"}, ensure_ascii=False)
+        try:
+            await self.storage.store_session_raw(phone, raw, s["_v"], extra=extra)
+            self._put(phone, _Entry(raw, s["_v"]))
+            self._recovered()
+        except Exception as e:
+            self._put(phone, _Entry(raw, s["_v"], dirty=True, base_version=base))
+            self._degrade(e)
+
+    # ------------------------------------------
+    # деградация и восстановление
+    # ------------------------------------------
+
+    def _degrade(self, error):
+        if not self.degraded:
+            logger.error("Session storage unavailable, serving sessions from memory: %s", error)
+        self.degraded = True
+
+    def _recovered(self):
+        if self.degraded:
+            logger.warning("Session storage is back, writing back %s sessions", self.dirty_count())
+        self.degraded = False
+        if not self._flushing and any(e.dirty for e in self._entries.values()):
+            self._flushing = True
+            spawn(self.flush(), name="session-writeback")
+
+    async def flush(self):
+        """Дописывает грязные сессии, если в Redis их никто не обновил без нас"""
+        try:
+            dirty = [(p, e) for p, e in self._entries.items() if e.dirty]
+            if not dirty:
+                return
+            versions = await self.storage.session_versions([p for p, _ in dirty])
+            for (phone, entry), remote in zip(dirty, versions):
+                if remote in (None, "", entry.base_version):
+                    await self.storage.store_session_raw(phone, entry.raw, entry.version)
+                    self.stats["writebacks"] += 1
+                entry.dirty = False
+                entry.stored_at = time.monotonic()
+        except Exception as e:
+            self._degrade(e)
+        finally:
+            self._flushing = False
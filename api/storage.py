@@ -0,0 +1,576 @@
+"""
+💾 Хранилище — сессии, контакты, заказы
+Три бэкенда с одинаковым async-интерфейсом:
+  • upstash — Upstash REST (aiohttp, keep-alive, пайплайны одним HTTP-запросом)
+  • redis   — нативный протокол Redis с пулом соединений (self-hosting)
+  • memory  — api.memredis в памяти процесса (тесты, бенчмарки)
+Доменные операции описаны один раз в Storage поверх двух примитивов:
+execute(*cmd) и pipeline([cmd, ...]).
+"""
+
+import asyncio
+import json
+import logging
+from datetime import datetime
+
+try:
+    from .memredis import MemoryRedis, register_script
+except ImportError:
+    from memredis import MemoryRedis, register_script
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL = 3600
+CONTACT_TTL = 86400 * 365
+ORDER_TTL = 86400 * 7
+STATS_TTL = 86400 * 400
+STATUS_TTL = 86400 * 2
+PROFILE_TTL = 86400 * 365
+PROFILE_ADDRESSES = 3
+CRM_TRACK_TTL = 86400 * 3
+FUNNEL_TTL = 86400 * 400
+CONVO_TTL = 86400 * 30
+KITCHEN_QUEUE_KEY = "kitchen:queue"
+# Лента заказов для кухни (api/order_feed.py): новые заказы и смена статуса в CRM
+ORDERS_STREAM_KEY = "orders:stream"
+ORDERS_STREAM_MAXLEN = 1000
+# archive:stats:{день} — счётчики дня (поля как в stats:{день}), посчитанные компакцией по архиву
+ARCHIVE_STATS_KEY = "archive:stats"
+
+
+# Профиль клиента (profile:{phone}) читается тем же вызовом, что и сессия:
+# {1 | сессия | false, профиль | false}
+_SESSION_IF_CHANGED = """
+local p = redis.call('GET', KEYS[3])
+local v = redis.call('GET', KEYS[2])
+if v and ARGV[1] ~= '' and v == ARGV[1] then return {1, p} end
+return {redis.call('GET', KEYS[1]), p}
+"""
+
+
+@register_script(_SESSION_IF_CHANGED)
+def _session_if_changed(r, keys, argv):
+    p = r.cmd_get(keys[2])
+    v = r.cmd_get(keys[1])
+    if v is not None and argv[0] and v == argv[0]:
+        return [1, p]
+    return [r.cmd_get(keys[0]), p]
+
+
+# Скользящее окно на номер (оценка по двум соседним фиксированным окнам:
+# prev * доля_оставшегося + cur) и, если сообщение пропущено, — отметка контакта.
+# Один скрипт = один запрос на входящее сообщение.
+# KEYS: rl:{phone}, contact:{phone}, contacts:all, stats:{день} (контакты — в пространстве номера)
+# ARGV: now_ms, window_ms, limit, phone, now_iso, name, contact_ttl, stats_ttl
+# → {1, 0} — пропустить; {0, 1} — отбросить и один раз за окно ответить «помедленнее»; {0, 0} — молча отбросить
+_ADMIT = """
+local now, win, limit = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local cur = math.floor(now / win)
+local h = redis.call('HMGET', KEYS[1], 'w', 'c', 'p', 'n')
+local w, c, p, n = tonumber(h[1]) or cur, tonumber(h[2]) or 0, tonumber(h[3]) or 0, tonumber(h[4]) or -1
+if w ~= cur then
+  if w == cur - 1 then p = c else p = 0 end
+  c = 0
+  w = cur
+end
+local ttl = math.ceil(win * 2 / 1000)
+if p * (win - now % win) / win + c >= limit then
+  local notify = 0
+  if n ~= cur then notify = 1 end
+  redis.call('HSET', KEYS[1], 'w', w, 'c', c, 'p', p, 'n', cur)
+  redis.call('EXPIRE', KEYS[1], ttl)
+  redis.call('HINCRBY', KEYS[4], 'limited', 1)
+  redis.call('EXPIRE', KEYS[4], ARGV[8])
+  return {0, notify}
+end
+if ARGV[6] ~= '' then redis.call('HSETNX', KEYS[2], 'name', ARGV[6]) end
+redis.call('HSETNX', KEYS[2], 'phone', ARGV[4])
+redis.call('HSETNX', KEYS[2], 'first_seen', ARGV[5])
+redis.call('HSET', KEYS[2], 'last_seen', ARGV[5])
+redis.call('HINCRBY', KEYS[2], 'msg_count', 1)
+redis.call('EXPIRE', KEYS[2], ARGV[7])
+redis.call('SADD', KEYS[3], ARGV[4])
+redis.call('HSET', KEYS[1], 'w', w, 'c', c + 1, 'p', p, 'n', n)
+redis.call('EXPIRE', KEYS[1], ttl)
+return {1, 0}
+"""
+
+
+@register_script(_ADMIT)
+def _admit(r, keys, argv):
+    now, win, limit = int(argv[0]), int(argv[1]), int(argv[2])
+    cur = now // win
+    h = r.cmd_hmget(keys[0], "w", "c", "p", "n")
+    w, c, p, n = [int(x) if x is not None else d for x, d in zip(h, (cur, 0, 0, -1))]
+    if w != cur:
+        p = c if w == cur - 1 else 0
+        c, w = 0, cur
+    ttl = -(-win * 2 // 1000)
+    if p * (win - now % win) / win + c >= limit:
+        notify = 1 if n != cur else 0
+        r.cmd_hset(keys[0], "w", str(w), "c", str(c), "p", str(p), "n", str(cur))
+        r.cmd_expire(keys[0], ttl)
+        r.cmd_hincrby(keys[3], "limited", 1)
+        r.cmd_expire(keys[3], argv[7])
+        return [0, notify]
+    if argv[5]:
+        r.cmd_hsetnx(keys[1], "name", argv[5])
+    r.cmd_hsetnx(keys[1], "phone", argv[3])
+    r.cmd_hsetnx(keys[1], "first_seen", argv[4])
+    r.cmd_hset(keys[1], "last_seen", argv[4])
+    r.cmd_hincrby(keys[1], "msg_count", 1)
+    r.cmd_expire(keys[1], argv[6])
+    r.cmd_sadd(keys[2], argv[3])
+    r.cmd_hset(keys[0], "w", str(w), "c", str(c + 1), "p", str(p), "n", str(n))
+    r.cmd_expire(keys[0], ttl)
+    return [1, 0]
+
+
+def contacts_key(namespace=""):
+    """Множество номеров клиентов бизнес-номера (namespace из wa_numbers; пусто — основной)"""
+    return f"contacts:{namespace}:all" if namespace else "contacts:all"
+
+
+def contact_key(phone, namespace=""):
+    return f"contact:{namespace}:{phone}" if namespace else f"contact:{phone}"
+
+
+def merge_profile(profile, order):
+    """Профиль после заказа: адрес — первым (без повторов, не больше
+    PROFILE_ADDRESSES), контактный номер и способ оплаты — последние.
+    Адрес из геоточки (order["geo"]) хранит координаты в coords {адрес: [lat, lon]}:
+    по названию точки адрес не разобрать"""
+    profile = dict(profile or {})
+    address = order.get("address", "")
+    addresses = [a for a in profile.get("addresses", []) if a != address]
+    profile["addresses"] = ([address] + addresses)[:PROFILE_ADDRESSES] if address else addresses
+    coords = {a: c for a, c in profile.get("coords", {}).items() if a in profile["addresses"] and a != address}
+    if address and order.get("geo") and order.get("lat") is not None:
+        coords[address] = [order["lat"], order["lon"]]
+    profile["coords"] = coords
+    for key, src in (("phone", "contact_phone"), ("payment", "payment"), ("payment_id", "payment_id")):
+        if order.get(src):
+            profile[key] = order[src]
+    # Снимок корзины для «Повторить заказ»: [vid, qty, цена, имя ru, имя kz]
+    profile["last_cart"] = [[c["vid"], int(c.get("qty", 1)), c.get("price", 0),
+                             c.get("name_ru", ""), c.get("name_kz", "")] for c in order.get("cart", [])]
+    profile["last_order"] = order.get("id")
+    profile["orders"] = int(profile.get("orders", 0)) + 1
+    profile["updated_at"] = order.get("created_at") or datetime.now().isoformat()
+    return profile
+
+
+def _stats_commands(order):
+    """HINCRBY по дневному хэшу: заказы, выручка, штуки по вариантам, оплата, час"""
+    created = datetime.fromisoformat(order.get("created_at") or datetime.now().isoformat())
+    key = f"stats:{created:%Y-%m-%d}"
+    cmds = [
+        ["HINCRBY", key, "orders", 1],
+        ["HINCRBY", key, "revenue", int(order.get("total", 0))],
+        ["HINCRBY", key, f"pay:{order.get('payment_id') or 'other'}", 1],
+        ["HINCRBY", key, f"hour:{created:%H}", 1],
+    ]
+    for c in order.get("cart", []):
+        cmds.append(["HINCRBY", key, f"item:{c['vid']}", int(c.get("qty", 1))])
+    cmds.append(["EXPIRE", key, STATS_TTL])
+    return cmds
+
+
+def funnel_commands(phone, state_from, state_to, day=None):
+    """Воронка за день: HLL уникальных номеров по состояниям (funnel:{день}:{состояние})
+    и счётчик переходов «откуда>куда» (хэш funnel:{день}:t)"""
+    day = day or datetime.now().strftime("%Y-%m-%d")
+    cmds = []
+    for state in {state_from, state_to}:
+        cmds += [["PFADD", f"funnel:{day}:{state}", phone], ["EXPIRE", f"funnel:{day}:{state}", FUNNEL_TTL]]
+    if state_from != state_to:
+        cmds += [["HINCRBY", f"funnel:{day}:t", f"{state_from}>{state_to}", 1],
+                 ["EXPIRE", f"funnel:{day}:t", FUNNEL_TTL]]
+    return cmds
+
+
+def conversation_commands(phone, entries, maxlen):
+    """Переписка в поток convo:{phone}: запись — dict (dir, type, text, ...), поток обрезается
+    до ~maxlen последних (MAXLEN ~ — Redis режет целыми узлами, это дёшево)"""
+    key = f"convo:{phone}"
+    cmds = [["XADD", key, "MAXLEN", "~", maxlen, "*", *[x for kv in e.items() for x in kv]] for e in entries]
+    if cmds:
+        cmds.append(["EXPIRE", key, CONVO_TTL])
+    return cmds
+
+
+def order_event_command(kind, data):
+    """Событие ленты заказов: kind — new | status, data — dict (уходит клиенту как есть)"""
+    return ["XADD", ORDERS_STREAM_KEY, "MAXLEN", "~", ORDERS_STREAM_MAXLEN, "*",
+            "type", kind, "data", json.dumps(data, ensure_ascii=False)]
+
+
+def _track_commands(order):
+    # crm:track:{uuid} — что нужно сверке (api/crm_sync.py); crm:open:{день} — незавершённые заказы дня
+    uuid, day = order["crm_uuid"], order["created_at"][:10]
+    return [
+        ["HSET", f"crm:track:{uuid}", "oid", order["id"], "phone", order["phone"],
+         "number", order.get("number", ""), "lang", order.get("lang", "ru"), "eta", order.get("eta", ""),
+         "created", int(datetime.fromisoformat(order["created_at"]).timestamp()),
+         "order", json.dumps(order, ensure_ascii=False)],
+        ["EXPIRE", f"crm:track:{uuid}", CRM_TRACK_TTL],
+        ["SADD", f"crm:open:{day}", uuid],
+        ["EXPIRE", f"crm:open:{day}", CRM_TRACK_TTL],
+        # Очередь кухни для оценки времени доставки (api/eta.py)
+        ["ZADD", KITCHEN_QUEUE_KEY, datetime.fromisoformat(order["created_at"]).timestamp(), uuid],
+    ]
+
+
+def _normalize(command, result):
+    """Приводит ответы разных клиентов к одному виду (redis-py и upstash
+    по-своему «форматируют» часть команд, memredis отдаёт сырой протокол)"""
+    name = str(command[0]).upper()
+    if name == "HGETALL":
+        if isinstance(result, list):
+            return {result[i]: result[i + 1] for i in range(0, len(result), 2)}
+        return dict(result or {})
+    if name == "SMEMBERS":
+        return sorted(result or ())
+    if name in ("SCAN", "SSCAN"):
+        cursor, items = result
+        return int(cursor), list(items)
+    if name == "ZSCORE":
+        return None if result is None else float(result)
+    if name in ("XRANGE", "XREVRANGE"):
+        return _stream_entries(result)
+    if name == "XREAD":
+        # {поток: [(id, {поле: значение})]}; redis-py (RESP3) уже отдаёт словарь
+        rows = result.items() if isinstance(result, dict) else (result or ())
+        return {key: _stream_entries(entries) for key, entries in rows}
+    return result
+
+
+def _stream_entries(entries):
+    """[(id, {поле: значение})] из плоских списков (Upstash, memredis) или пар redis-py"""
+    out = []
+    for xid, fields in entries or ():
+        if not isinstance(fields, dict):
+            fields = {fields[i]: fields[i + 1] for i in range(0, len(fields), 2)}
+        out.append((xid, fields))
+    return out
+
+
+class Storage:
+    name = "base"
+    # Автомат (api/breaker.py): бот ставит его в get_storage(), CLI работают без него
+    breaker = None
+
+    async def execute(self, *command):
+        if self.breaker is None:
+            return await self._execute(*command)
+        return await self.breaker.call(self._execute, *command)
+
+    async def pipeline(self, commands):
+        """Выполняет команды одним запросом, возвращает список результатов"""
+        if self.breaker is None:
+            return await self._pipeline(commands)
+        return await self.breaker.call(self._pipeline, commands)
+
+    async def _execute(self, *command):
+        raise NotImplementedError
+
+    async def _pipeline(self, commands):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def ping(self):
+        return await self.execute("PING")
+
+    # ------------------------------------------
+    # сессии
+    # ------------------------------------------
+
+    # Рядом с session:{phone} лежит session:{phone}:v — версия (см. session_cache).
+    # Проверка «не изменилась ли» и чтение при изменении — один запрос.
+
+    async def load_session_if_changed(self, phone, version):
+        """(changed, raw_json | None, профиль | None): changed=False — версия
+        совпала и сессию не читали. Профиль приходит в том же запросе"""
+        res, profile = await self.execute("EVAL", _SESSION_IF_CHANGED, 3, f"session:{phone}",
+                                          f"session:{phone}:v", f"profile:{phone}", version)
+        profile = json.loads(profile) if profile else None
+        if res == 1:
+            return False, None, profile
+        return True, res, profile
+
+    async def store_session_raw(self, phone, raw, version, ttl=SESSION_TTL, extra=()):
+        """extra — команды, которые едут тем же пайплайном (воронка)"""
+        await self.pipeline([
+            ["SET", f"session:{phone}", raw, "EX", ttl],
+            ["SET", f"session:{phone}:v", version, "EX", ttl],
+            *extra,
+        ])
+
+    async def session_versions(self, phones):
+        return await self.pipeline([["GET", f"session:{p}:v"] for p in phones]) if phones else []
+
+    # ------------------------------------------
+    # контакты (хэш — обновление без чтения, одним пайплайном)
+    # ------------------------------------------
+
+    async def admit(self, phone, name="", limit=15, window=30, namespace=""):
+        """Лимит входящих на номер + отметка контакта одним скриптом.
+        (пропустить, ответить «помедленнее»); limit <= 0 — без лимита;
+        namespace — пространство бизнес-номера: свои contact:* и contacts:all для рассылок"""
+        now = datetime.now()
+        contact = contact_key(phone, namespace)
+        args = [f"rl:{phone}", contact, contacts_key(namespace), f"stats:{now:%Y-%m-%d}",
+                int(now.timestamp() * 1000), int(window * 1000), limit if limit > 0 else 1 << 30,
+                phone, now.isoformat(), name, CONTACT_TTL, STATS_TTL]
+        try:
+            allowed, notify = await self.execute("EVAL", _ADMIT, 4, *args)
+        except Exception as e:
+            # Скрипт пишет лимит после контакта: старый JSON-контакт ломает его до учёта
+            if "WRONGTYPE" not in str(e):
+                raise
+            await self._migrate_contact(contact)
+            allowed, notify = await self.execute("EVAL", _ADMIT, 4, *args)
+        return bool(int(allowed)), bool(int(notify))
+
+    async def _migrate_contact(self, key):
+        """Старый формат: JSON-строка в contact:{phone} → хэш"""
+        raw = await self.execute("GET", key)
+        data = json.loads(raw) if raw else {}
+        fields = [x for k, v in data.items() if v not in (None, "") for x in (k, str(v))]
+        cmds = [["DEL", key]]
+        if fields:
+            cmds.append(["HSET", key, *fields])
+        await self.pipeline(cmds)
+
+    async def load_contacts(self, phones, namespace=""):
+        phones = list(phones)
+        try:
+            rows = await self.pipeline([["HGETALL", contact_key(p, namespace)] for p in phones]) if phones else []
+        except Exception:
+            rows = []
+            for p in phones:
+                try:
+                    rows.append(await self.execute("HGETALL", contact_key(p, namespace)))
+                except Exception:
+                    raw = await self.execute("GET", contact_key(p, namespace))
+                    rows.append(json.loads(raw) if raw else {})
+        contacts = []
+        for row in rows:
+            if row:
+                if "msg_count" in row:
+                    row["msg_count"] = int(row["msg_count"])
+                contacts.append(row)
+        return contacts
+
+    async def contact_phones(self, namespace=""):
+        return await self.execute("SMEMBERS", contacts_key(namespace))
+
+    # ------------------------------------------
+    # заказы
+    # ------------------------------------------
+
+    async def store_order(self, order, ttl=ORDER_TTL, profile=None, scope=None):
+        """Заказ, счётчики дня, событие ленты кухни, (если передан) профиль
+        и (если есть crm_uuid) запись сверки с CRM — одним пайплайном.
+        scope — ключ клиента в пространстве номера (по умолчанию его телефон)"""
+        oid, phone = order["id"], scope or order["phone"]
+        cmds = [
+            ["SET", f"order:{oid}", json.dumps(order, ensure_ascii=False), "EX", ttl],
+            ["LPUSH", "orders:list", str(oid)],
+            *_stats_commands(order),
+            ["PFADD", f"funnel:{order['created_at'][:10]}:ordered", order["phone"]],
+            ["EXPIRE", f"funnel:{order['created_at'][:10]}:ordered", FUNNEL_TTL],
+            order_event_command("new", order),
+        ]
+        if profile is not None:
+            cmds.append(["SET", f"profile:{phone}", json.dumps(profile, ensure_ascii=False), "EX", PROFILE_TTL])
+        if order.get("crm_uuid"):
+            cmds += _track_commands(order)
+        await self.pipeline(cmds)
+
+    # ------------------------------------------
+    # статистика продаж: хэш stats:{YYYY-MM-DD} на день, пишется вместе с заказом
+    # ------------------------------------------
+
+    async def record_statuses(self, statuses):
+        """Статусы доставки Meta одной записью: счётчики dlv:{день} и хэш msg:{wamid}"""
+        cmds, days = [], set()
+        for st in statuses:
+            status, wamid = st.get("status"), st.get("id")
+            if not status or not wamid:
+                continue
+            ts = int(st.get("timestamp") or 0) or int(datetime.now().timestamp())
+            day = f"dlv:{datetime.fromtimestamp(ts):%Y-%m-%d}"
+            days.add(day)
+            cmds.append(["HINCRBY", day, status, 1])
+            fields = [status, ts, "to", st.get("recipient_id", "")]
+            for err in st.get("errors") or ():
+                cmds.append(["HINCRBY", day, f"err:{err.get('code')}", 1])
+                fields += ["err", err.get("code"), "err_title", err.get("title", "")]
+            cmds += [["HSET", f"msg:{wamid}", *fields], ["EXPIRE", f"msg:{wamid}", STATUS_TTL]]
+        cmds += [["EXPIRE", d, STATS_TTL] for d in sorted(days)]
+        if cmds:
+            await self.pipeline(cmds)
+        return len(cmds)
+
+    async def load_delivery_stats(self, days):
+        rows = await self.pipeline([["HGETALL", f"dlv:{d}"] for d in days]) if days else []
+        return [{k: int(v) for k, v in row.items()} for row in rows]
+
+    async def load_funnel(self, days, steps):
+        """steps — [(шаг, (состояния, ...)), ...] → ([уникальных номеров на шаге за период],
+        {переход: число}). PFCOUNT по всем ключам шага считает объединение — номер,
+        побывавший на шаге в разные дни, учитывается один раз"""
+        cmds = [["PFCOUNT", *[f"funnel:{d}:{st}" for d in days for st in states]] for _, states in steps]
+        cmds += [["HGETALL", f"funnel:{d}:t"] for d in days]
+        res = await self.pipeline(cmds)
+        transitions = {}
+        for row in res[len(steps):]:
+            for k, v in row.items():
+                transitions[k] = transitions.get(k, 0) + int(v)
+        return [int(n) for n in res[:len(steps)]], transitions
+
+    async def load_eta_accuracy(self, days):
+        rows = await self.pipeline([["HGETALL", f"eta:{d}"] for d in days]) if days else []
+        return [{k: int(v) for k, v in row.items()} for row in rows]
+
+    async def load_conversation(self, phone, count=50, before="", after=""):
+        """Страница переписки: по умолчанию — последние count (новые первыми);
+        before=id — ещё более старые, after=id — более новые (по возрастанию)"""
+        key = f"convo:{phone}"
+        if after:
+            rows = await self.execute("XRANGE", key, f"({after}", "+", "COUNT", count)
+        else:
+            rows = await self.execute("XREVRANGE", key, f"({before}" if before else "+", "-", "COUNT", count)
+        return [{"id": xid, **fields} for xid, fields in rows]
+
+    async def load_message_status(self, wamid):
+        return await self.execute("HGETALL", f"msg:{wamid}")
+
+    async def load_daily_stats(self, days, prefix="stats"):
+        """[{поле: int}, ...] по списку дат 'YYYY-MM-DD' — один пайплайн на весь диапазон"""
+        rows = await self.pipeline([["HGETALL", f"{prefix}:{d}"] for d in days]) if days else []
+        return [{k: int(v) for k, v in row.items()} for row in rows]
+
+    async def load_archived_stats(self, days):
+        """То же по счётчикам архивных дней — их пишет компакция (api/compact.py)"""
+        return await self.load_daily_stats(days, prefix=ARCHIVE_STATS_KEY)
+
+
+# ==========================================
+# 🟢 UPSTASH REST
+# ==========================================
+
+class UpstashStorage(Storage):
+    name = "upstash"
+
+    def __init__(self, url, token):
+        self.url, self.token = url, token
+        self._client = None
+        self._loop = None
+
+    async def _redis(self):
+        # aiohttp-сессия привязана к event loop — держим одну на loop
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            from upstash_redis.asyncio import Redis
+            self._client = Redis(url=self.url, token=self.token, rest_retries=1, rest_retry_interval=0.1)
+            await self._client.__aenter__()
+            self._loop = loop
+        return self._client
+
+    async def _execute(self, *command):
+        r = await self._redis()
+        return _normalize(command, await r.execute(list(command)))
+
+    async def _pipeline(self, commands):
+        r = await self._redis()
+        p = r.pipeline()
+        for cmd in commands:
+            p.execute(list(cmd))
+        results = await p.exec()
+        return [_normalize(c, res) for c, res in zip(commands, results)]
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+# ==========================================
+# 🔴 НАТИВНЫЙ REDIS
+# ==========================================
+
+class RedisStorage(Storage):
+    name = "redis"
+
+    def __init__(self, url, pool_size=20):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=redis требует пакет redis>=5") from e
+        self._client = aioredis.from_url(url, decode_responses=True, max_connections=pool_size)
+
+    async def _execute(self, *command):
+        return _normalize(command, await self._client.execute_command(*command))
+
+    async def _pipeline(self, commands):
+        async with self._client.pipeline(transaction=False) as p:
+            for cmd in commands:
+                p.execute_command(*cmd)
+            results = await p.execute()
+        return [_normalize(c, res) for c, res in zip(commands, results)]
+
+    async def close(self):
+        await self._client.aclose()
+
+
+# ==========================================
+# 🧪 В ПАМЯТИ
+# ==========================================
+
+class MemoryStorage(Storage):
+    name = "memory"
+
+    def __init__(self, redis=None):
+        self.redis = redis or MemoryRedis()
+
+    async def _execute(self, *command):
+        return _normalize(command, self.redis.execute(command))
+
+    async def _pipeline(self, commands):
+        return [_normalize(c, res) for c, res in zip(commands, self.redis.pipeline(commands))]
+
+
+def create_storage(backend=None):
+    """Бэкенд из STORAGE_BACKEND; по умолчанию — Upstash, если заданы ключи,
+    иначе нативный Redis по REDIS_URL, иначе None (бот без памяти)"""
+    # config читается здесь, а не при импорте: моки импортируют модуль ради
+    # Lua-аналогов раньше, чем бот получает своё окружение
+    try:
+        from .config import (
+            STORAGE_BACKEND, REDIS_URL, REDIS_POOL_SIZE,
+            UPSTASH_REDIS_REST_URL, UPSTASH_REDIS_REST_TOKEN,
+        )
+    except ImportError:
+        from config import (
+            STORAGE_BACKEND, REDIS_URL, REDIS_POOL_SIZE,
+            UPSTASH_REDIS_REST_URL, UPSTASH_REDIS_REST_TOKEN,
+        )
+    backend = (backend or STORAGE_BACKEND or "").lower()
+    if not backend:
+        if UPSTASH_REDIS_REST_URL and UPSTASH_REDIS_REST_TOKEN:
+            backend = "upstash"
+        elif REDIS_URL:
+            backend = "redis"
+        else:
+            return None
+    if backend == "upstash":
+        return UpstashStorage(UPSTASH_REDIS_REST_URL, UPSTASH_REDIS_REST_TOKEN)
+    if backend == "redis":
+        return RedisStorage(REDIS_URL, REDIS_POOL_SIZE)
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -0,0 +1,140 @@
+"""
+📱 Несколько номеров WhatsApp в одном деплое
+Реестр — WHATSAPP_NUMBERS (JSON-список или путь к JSON-файлу):
+    [{"phone_id": "9296...", "token": "EAAR...", "name": "Тараз",
+      "trade_point": 1, "namespace": "", "rate": 0}, ...]
+Без реестра — один номер из WHATSAPP_PHONE_ID / WHATSAPP_TOKEN.
+Webhook выбирает номер по metadata.phone_number_id и кладёт его в contextvar —
+отправка, точка продаж CRM и ключи сессий берутся из current_number().
+У каждого номера свой keep-alive пул и ограничитель темпа: второй номер
+добавляет пропускную способность, а не делит её с первым. Отправка идёт через
+автомат graph:{имя}: при разомкнутом автомате post() сразу возвращает None.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from contextvars import ContextVar
+
+import httpx
+
+try:
+    from .config import WHATSAPP_TOKEN, WHATSAPP_PHONE_ID, WHATSAPP_NUMBERS, GRAPH_API_URL, GRAPH_TIMEOUT
+    from .broadcast import RateLimiter
+    from .breaker import breaker, CircuitOpen
+except ImportError:
+    from config import WHATSAPP_TOKEN, WHATSAPP_PHONE_ID, WHATSAPP_NUMBERS, GRAPH_API_URL, GRAPH_TIMEOUT
+    from broadcast import RateLimiter
+    from breaker import breaker, CircuitOpen
+
+logger = logging.getLogger(__name__)
+
+
+def _graph_failed(response):
+    # 4xx — ошибка запроса (битый payload, окно 24 ч), а не недоступность Graph
+    return response.status_code >= 500 or response.status_code == 429
+
+
+class Number:
+    """Один бизнес-номер: креды, пул соединений, темп, точка CRM, пространство ключей"""
+
+    def __init__(self, phone_id, token, name="", trade_point=None, namespace="", rate=0):
+        self.phone_id = str(phone_id)
+        self.token = token
+        self.name = name or self.phone_id
+        self.trade_point = trade_point
+        # Пусто — ключи как у однономерного бота (session:{phone}, profile:{phone})
+        self.namespace = namespace
+        self.rate = float(rate or 0)
+        self.url = f"{GRAPH_API_URL}/{self.phone_id}/messages"
+        self.headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+        self.limiter = RateLimiter(self.rate) if self.rate > 0 else None
+        self.breaker = breaker(f"graph:{self.name}", timeout=GRAPH_TIMEOUT)
+        # Подмена сети для бенчмарков и прогонов без Graph (httpx.MockTransport)
+        self.transport = None
+        self._client = None
+        self._loop = None
+
+    def scope(self, phone):
+        """Ключ клиента в хранилище с учётом пространства номера"""
+        return f"{self.namespace}:{phone}" if self.namespace else phone
+
+    def client(self):
+        # httpx-пул привязан к event loop — пересоздаём, если loop сменился
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(timeout=30, headers=self.headers, transport=self.transport,
+                                             limits=httpx.Limits(max_keepalive_connections=20))
+            self._loop = loop
+        return self._client
+
+    async def post(self, payload):
+        """Ответ Graph или None — автомат разомкнут, сообщение не отправлено"""
+        if self.limiter is not None:
+            await self.limiter.wait()
+        try:
+            return await self.breaker.call(self.client().post, self.url, json=payload, is_failure=_graph_failed)
+        except CircuitOpen:
+            return None
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def describe(self):
+        return {"phone_id": self.phone_id, "name": self.name, "trade_point": self.trade_point,
+                "namespace": self.namespace, "rate": self.rate}
+
+
+def load_registry(spec=WHATSAPP_NUMBERS):
+    """{phone_id: Number} в порядке реестра; первый номер — основной"""
+    spec = (spec or "").strip()
+    if not spec:
+        return {str(WHATSAPP_PHONE_ID): Number(WHATSAPP_PHONE_ID, WHATSAPP_TOKEN)}
+    if not spec.startswith("["):
+        with open(os.path.expanduser(spec), encoding="utf-8") as f:
+            spec = f.read()
+    registry = {}
+    namespaces = set()
+    for row in json.loads(spec):
+        if not row.get("phone_id") or not row.get("token"):
+            raise ValueError(f"WHATSAPP_NUMBERS: phone_id and token are required: {row.get('name', row)}")
+        number = Number(row["phone_id"], row["token"], row.get("name", ""), row.get("trade_point"),
+                        row.get("namespace", ""), row.get("rate", 0))
+        if number.phone_id in registry:
+            raise ValueError(f"WHATSAPP_NUMBERS: duplicate phone_id {number.phone_id}")
+        if number.namespace in namespaces:
+            raise ValueError(f"WHATSAPP_NUMBERS: namespace {number.namespace!r} is used twice")
+        namespaces.add(number.namespace)
+        registry[number.phone_id] = number
+    if not registry:
+        raise ValueError("WHATSAPP_NUMBERS is empty")
+    return registry
+
+
+NUMBERS = load_registry()
+PRIMARY = next(iter(NUMBERS.values()))
+_current = ContextVar("wa_number", default=None)
+
+
+def current_number():
+    """Номер, на который пришло обрабатываемое сообщение (вне webhook — основной)"""
+    return _current.get() or PRIMARY
+
+
+def use_number(phone_id):
+    """Делает номер текущим для этого запроса; неизвестный id — основной номер"""
+    number = NUMBERS.get(str(phone_id)) if phone_id else None
+    if number is None:
+        if phone_id and len(NUMBERS) > 1:
+            logger.warning("Unknown phone_number_id %s, using %s", phone_id, PRIMARY.name)
+        number = PRIMARY
+    _current.set(number)
+    return number
+
+
+async def close_numbers():
+    for number in NUMBERS.values():
+        await number.aclose()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+⏱ Бенчмарк холодного старта: импорт api.index → первый ответ на сообщение.
+Каждый прогон — отдельный процесс (настоящий холодный старт). Внешние вызовы
+Graph API подменяются MockTransport, Redis отключён — меряем только наш код.
+
+    python bench_coldstart.py                     # 10 прогонов, медиана/p90
+    python bench_coldstart.py --importtime        # топ-15 модулей по времени импорта
+    python bench_coldstart.py --record bench_coldstart.jsonl   # история по релизам
+"""
+import argparse, json, os, statistics, subprocess, sys, time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+CHILD = r'''
+import time
+t0 = time.perf_counter()
+import asyncio, json, sys
+import api.index as idx
+from api import wa_numbers
+t1 = time.perf_counter()
+import httpx
+
+PAYLOAD = {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {
+    "contacts": [{"profile": {"name": "Bench"}}],
+    "messages": [{"from": "77000000000", "id": "wamid.bench", "type": "text", "text": {"body": "привет"}}],
+}}]}]}
+
+async def main():
+    replies = []
+    def graph(request):
+        replies.append(time.perf_counter())
+        return httpx.Response(200, json={"messages": [{"id": "wamid.out"}]})
+    # Ответы уходят через пул номера (wa_numbers.Number.client)
+    for number in wa_numbers.NUMBERS.values():
+        number.transport = httpx.MockTransport(graph)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=idx.app), base_url="http://bench") as c:
+        await c.post("/webhook", json=PAYLOAD)
+    if not replies:
+        sys.exit("no reply reached the mocked Graph API")
+    return replies[0]
+
+t2 = asyncio.run(main())
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "first_reply_ms": (t2 - t1) * 1000}))
+'''
+
+
+def child_env():
+    env = dict(os.environ)
+    for k in ("UPSTASH_REDIS_REST_URL", "UPSTASH_REDIS_REST_TOKEN", "TELEGRAM_BOT_TOKEN", "CRM_TOKEN"):
+        env.pop(k, None)
+    env["LOG_LEVEL"] = "WARNING"
+    env["PYTHONDONTWRITEBYTECODE"] = "0"
+    return env
+
+
+def run_once():
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=child_env(),
+                         capture_output=True, text=True)
+    if out.returncode:
+        raise SystemExit(f"прогон упал:\n{out.stderr.strip()}")
+    wall = (time.perf_counter() - start) * 1000
+    data = json.loads(out.stdout.strip().splitlines()[-1])
+    data["wall_ms"] = wall
+    return data
+
+
+def importtime(top=15):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import api.index"],
+                         cwd=ROOT, env=child_env(), capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = [p.strip() for p in line[len("import time:"):].split("|")]
+        rows.append((int(cum_us), int(self_us), name))
+    rows.sort(reverse=True)
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for cum, self_, name in rows[:top]:
+        print(f"{cum / 1000:14.1f} {self_ / 1000:8.1f}  {name}")
+
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", "--runs", type=int, default=10)
+    ap.add_argument("--importtime", action="store_true")
+    ap.add_argument("--record", metavar="FILE", help="дописать результат в JSONL-файл")
+    args = ap.parse_args()
+
+    if args.importtime:
+        importtime()
+        return
+
+    runs = [run_once() for _ in range(args.runs)]
+    result = {"ts": datetime.now().isoformat(timespec="seconds"), "rev": git_rev(), "runs": args.runs}
+    for key in ("wall_ms", "import_ms", "first_reply_ms"):
+        values = sorted(r[key] for r in runs)
+        result[key] = {
+            "p50": round(statistics.median(values), 1),
+            "p90": round(values[min(len(values) - 1, int(len(values) * 0.9))], 1),
+        }
+        print(f"{key:>15}: p50={result[key]['p50']:8.1f}  p90={result[key]['p90']:8.1f}")
+
+    if args.record:
+        with open(args.record, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
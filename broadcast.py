@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+📣 Рассылка по базе контактов (задания и курсор — в Redis, см. api/broadcast.py)
+
+    python broadcast.py create --text "🔥 Сегодня -20% на бургеры" --segment active:30
+    python broadcast.py create --template promo_june --language ru --enqueue
+    python broadcast.py create --template promo_june --number Астана   # с другого номера (WHATSAPP_NUMBERS)
+    python broadcast.py run JOB_ID              # выполнить или продолжить после обрыва
+    python broadcast.py status JOB_ID [--outcomes]
+    python broadcast.py worker                  # брать задания из очереди (create --enqueue)
+    python broadcast.py optout 77001234567 [--remove]
+
+Ctrl+C — мягкая пауза: страница дописывается, курсор сохраняется, run продолжит.
+"""
+import argparse, asyncio, json, os, signal, sys
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api"))
+
+import broadcast
+from logs import setup_logging
+from storage import create_storage
+from wa_numbers import close_numbers
+
+
+def _print_job(job):
+    number = broadcast.resolve_number(job.get("number", ""))
+    print(f"{job['id']}: {job['status']} · {number.name} · сегмент {job['segment']} · "
+          f"{job['rate']:g} msg/s × {job['concurrency']}")
+    print(f"  охвачено {job['matched']}, отправлено {job['sent']}, ошибок {job['failed']}, "
+          f"отписаны {job['optout']}")
+    if job["status"] == "paused" and job["resume_at"]:
+        print(f"  автомат номера разомкнут, продолжить после {datetime.fromtimestamp(job['resume_at']):%H:%M:%S}")
+
+
+async def main_async(args):
+    store = create_storage()
+    if store is None:
+        raise SystemExit("❌ хранилище не настроено (UPSTASH_REDIS_REST_URL / REDIS_URL)")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        if args.cmd == "create":
+            if args.text:
+                message = {"type": "text", "text": args.text}
+            else:
+                message = {"type": "template", "name": args.template, "language": args.language}
+                if args.components:
+                    with open(args.components, encoding="utf-8") as f:
+                        message["components"] = json.load(f)
+            job_id = await broadcast.create_job(store, message, args.segment, args.rate,
+                                                args.concurrency, enqueue=args.enqueue, number=args.number)
+            print(job_id)
+        elif args.cmd == "run":
+            _print_job(await broadcast.run_job(store, args.job, page_size=args.page_size, stop=stop))
+        elif args.cmd == "status":
+            job = await broadcast.job_status(store, args.job)
+            if job is None:
+                raise SystemExit(f"❌ нет задания {args.job}")
+            _print_job(job)
+            if args.outcomes:
+                outcomes = await broadcast.job_outcomes(store, args.job)
+                for code, n in Counter(outcomes.values()).most_common():
+                    print(f"  {code:<8}{n}")
+        elif args.cmd == "worker":
+            await broadcast.worker(store, stop=stop)
+        elif args.cmd == "optout":
+            await broadcast.set_optout(store, args.phone, not args.remove)
+    finally:
+        await close_numbers()
+        await store.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("create")
+    msg = c.add_mutually_exclusive_group(required=True)
+    msg.add_argument("--text", help="обычное сообщение (только тем, кто писал за последние 24 ч)")
+    msg.add_argument("--template", help="имя одобренного шаблона WhatsApp")
+    c.add_argument("--language", default="ru")
+    c.add_argument("--components", help="JSON-файл с components шаблона")
+    c.add_argument("--segment", default="all", help="all | active:ДНЕЙ | min_msgs:N, через запятую")
+    c.add_argument("--rate", type=float, help="сообщений в секунду (BROADCAST_RATE)")
+    c.add_argument("--concurrency", type=int, help="одновременных запросов (BROADCAST_CONCURRENCY)")
+    c.add_argument("--enqueue", action="store_true", help="поставить в очередь для worker")
+    c.add_argument("--number", default="", help="phone_id или имя номера из WHATSAPP_NUMBERS (по умолчанию основной)")
+    r = sub.add_parser("run")
+    r.add_argument("job")
+    r.add_argument("--page-size", type=int, default=100)
+    s = sub.add_parser("status")
+    s.add_argument("job")
+    s.add_argument("--outcomes", action="store_true", help="разбивка итогов по кодам")
+    sub.add_parser("worker")
+    o = sub.add_parser("optout")
+    o.add_argument("phone")
+    o.add_argument("--remove", action="store_true")
+    args = ap.parse_args()
+    setup_logging()
+    try:
+        asyncio.run(main_async(args))
+    except ValueError as e:
+        raise SystemExit(f"❌ {e}")
+
+
+if __name__ == "__main__":
+    main()
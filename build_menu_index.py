@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+"""Сборка api/menu_index.json — предрассчитанный индекс меню для холодного старта"""
+import json, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api"))
+
+import config
+
+index = config.build_menu_index()
+index["fingerprint"] = config._source_fingerprint()
+
+with open(config.MENU_INDEX_FILE, "w", encoding="utf-8") as f:
+    json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+
+print(f"✅ {config.MENU_INDEX_FILE}: {len(index['aliases'])} алиасов, "
+      f"{sum(len(r) for r in index['item_rows']['ru'].values())} строк меню")
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+🧾 Бюджет внешних вызовов на шаг диалога (без сети)
+
+    python -m pytest -q tests/test_call_budget.py     # сверить с call_budget.json
+    python call_budget.py --update                     # записать замер как новый бюджет
+    python call_budget.py --update --scenarios checkout,returning
+
+Сценарии loadtest.py и «returning» (повторный заказ того же клиента) идут через
+webhook() в этом процессе против моков (mock_services.py): Upstash REST, Graph,
+CRM, Telegram. Каждый шаг считается отдельно — HTTP к Redis, команды Redis,
+запросы к Graph/CRM/Telegram и байты в обе стороны. Фоновые задачи шага
+дожидаются до замера, так что вызовы не «переезжают» в следующий шаг.
+Периодическое (проверка меню) вынесено за скобки: один прогревочный диалог
+до замера и MENU_CHECK_INTERVAL на час.
+
+Счётчики в call_budget.json — потолок без запаса: шаг, которому понадобился
+лишний запрос, роняет тест. Байты — с запасом BYTES_SLACK (тексты, id, время).
+Стало дешевле — подсказка обновить бюджет, не ошибка.
+"""
+import argparse, asyncio, json, math, os, sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from loadtest import SCENARIOS as LOAD_SCENARIOS, BotTarget, make_payload
+from mock_services import MockServer, env_for
+
+BUDGET_FILE = os.path.join(ROOT, "call_budget.json")
+BYTES_SLACK = 1.2
+COUNTERS = ("redis_http", "redis_cmds", "graph", "crm", "telegram")
+
+SCENARIOS = {
+    **LOAD_SCENARIOS,
+    # Тот же клиент после checkout: «Повторить заказ» и «Как в прошлый раз»
+    "returning": [
+        ("text", "привет"), ("button", "lang_ru"), ("button", "repeat_order"),
+        ("button", "checkout"), ("button", "same_0"), ("button", "confirm_yes"),
+    ],
+}
+# Сценарий → сценарий, чей номер он продолжает
+SAME_CLIENT = {"returning": "checkout"}
+
+
+def bot_env(url):
+    """Окружение бота против моков; ставится до первого импорта api.config"""
+    return {**env_for(url), "LOG_LEVEL": "WARNING", "STORAGE_BACKEND": "upstash",
+            "RATE_LIMIT": "0", "MENU_CHECK_INTERVAL": "3600"}
+
+
+def load_budget(path=BUDGET_FILE):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _phone(scenarios, scenario):
+    return f"7798{scenarios.index(SAME_CLIENT.get(scenario, scenario)):07d}"
+
+
+def _delta(before, after):
+    def d(service, key):
+        return after[service].get(key, 0) - before[service].get(key, 0)
+    return {
+        "redis_http": d("upstash", "calls"),
+        "redis_cmds": d("upstash", "commands"),
+        "graph": d("graph", "calls"),
+        "crm": d("crm", "calls"),
+        "telegram": d("telegram", "calls"),
+        "bytes": sum(d(s, "bytes_in") + d(s, "bytes_out") for s in after),
+    }
+
+
+async def _step(target, mock, payload, background):
+    before = mock.state.snapshot()
+    await target.send(payload)
+    await background.drain(30)
+    return _delta(before, mock.state.snapshot())
+
+
+async def measure(target, mock, scenarios):
+    """{сценарий: [{"input", счётчики..., "bytes"}]} — один клиент, шаги по очереди"""
+    from api import background
+    # Прогрев: загрузка меню и пулы соединений не должны попасть в первый шаг
+    for i, (kind, value) in enumerate(SCENARIOS["browse"]):
+        await _step(target, mock, make_payload("77970000000", kind, value, i), background)
+    missing = [s for s in scenarios if SAME_CLIENT.get(s, s) not in scenarios]
+    if missing:
+        raise SystemExit(f"сценарии {', '.join(missing)} продолжают {', '.join(SAME_CLIENT[s] for s in missing)}")
+    result = {}
+    for scenario in scenarios:
+        phone = _phone(scenarios, scenario)
+        result[scenario] = []
+        for i, (kind, value) in enumerate(SCENARIOS[scenario]):
+            cost = await _step(target, mock, make_payload(phone, kind, value, f"{scenario}{i}"), background)
+            result[scenario].append({"input": value, **cost})
+    return result
+
+
+def compare(measured, budget):
+    """→ (превышения, подешевевшие шаги) строками для отчёта"""
+    over, cheaper = [], []
+    for scenario, steps in measured.items():
+        planned = budget.get(scenario)
+        if planned is None or [s["input"] for s in planned] != [s["input"] for s in steps]:
+            over.append(f"{scenario}: сценарий не совпадает с бюджетом — python call_budget.py --update")
+            continue
+        for i, (got, limit) in enumerate(zip(steps, planned)):
+            where = f"{scenario}#{i} {got['input']!r}"
+            for key in (*COUNTERS, "bytes"):
+                if got[key] > limit.get(key, 0):
+                    over.append(f"{where}: {key} {got[key]} > {limit.get(key, 0)}")
+            if any(got[key] < limit.get(key, 0) for key in COUNTERS):
+                cheaper.append(where)
+    return over, cheaper
+
+
+def to_budget(measured):
+    return {scenario: [{**step, "bytes": int(math.ceil(step["bytes"] * BYTES_SLACK / 100) * 100)}
+                       for step in steps]
+            for scenario, steps in measured.items()}
+
+
+def report(measured, budget):
+    print(f"\n{'scenario':<11}{'#':>3} {'input':<26}{'r.http':>7}{'r.cmd':>7}{'graph':>7}{'crm':>5}{'tg':>4}"
+          f"{'bytes':>9}")
+    for scenario, steps in measured.items():
+        planned = budget.get(scenario, [])
+        for i, step in enumerate(steps):
+            limit = planned[i] if i < len(planned) else {}
+
+            def cell(key, width):
+                mark = "!" if limit and step[key] > limit.get(key, 0) else ""
+                return f"{str(step[key]) + mark:>{width}}"
+            print(f"{scenario:<11}{i:>3} {step['input'][:25]:<26}{cell('redis_http', 7)}{cell('redis_cmds', 7)}"
+                  f"{cell('graph', 7)}{cell('crm', 5)}{cell('telegram', 4)}{cell('bytes', 9)}")
+
+
+async def measure_with(mock, scenarios=tuple(SCENARIOS)):
+    """Замер против запущенных моков (бот — в этом процессе)"""
+    for s in scenarios:
+        if s not in SCENARIOS:
+            raise SystemExit(f"неизвестный сценарий: {s} (есть: {', '.join(SCENARIOS)})")
+    async with BotTarget("inprocess", 1, bot_env(mock.url)) as target:
+        return await measure(target, mock, list(scenarios))
+
+
+async def main_async(scenarios):
+    with MockServer() as mock:
+        return await measure_with(mock, scenarios)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--update", action="store_true", help="сохранить замер как бюджет")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--budget", default=BUDGET_FILE)
+    args = ap.parse_args()
+    if not args.update:
+        ap.error("проверка бюджета — python -m pytest -q tests/test_call_budget.py; здесь только --update")
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    measured = asyncio.run(main_async(scenarios))
+    try:
+        budget = load_budget(args.budget)
+    except FileNotFoundError:
+        budget = {}
+    report(measured, budget)
+    budget.update(to_budget(measured))
+    # Шаг — строка: в диффе бюджета видно, какой шаг подорожал
+    blocks = [f'  {json.dumps(name, ensure_ascii=False)}: [\n' + ",\n".join(
+        f"    {json.dumps(step, ensure_ascii=False)}" for step in steps) + "\n  ]"
+        for name, steps in budget.items()]
+    with open(args.budget, "w", encoding="utf-8") as f:
+        f.write("{\n" + ",\n".join(blocks) + "\n}\n")
+    print(f"✅ {args.budget}: {', '.join(measured)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+🗜 Компакция и архив заказов (логика — api/compact.py)
+
+    python compact.py run [--days 3] [--budget 60]   # архив старых заказов, чистка orders:list и contacts:all
+    python compact.py days                           # какие дни есть в архиве
+    python compact.py export 2024-06-01 [--to 2024-06-30] > orders.ndjson
+    python compact.py stats 2024-06-01               # счётчики дня по архиву (как stats:{день})
+    python compact.py summarize [2024-06-01 ...]     # пересчитать archive:stats:{день} (по умолчанию все дни архива)
+
+Архив — ARCHIVE_DIR (gzip NDJSON по дням) или, если каталог не задан, Redis.
+Прерванный прогон безопасно повторить: он продолжит с того же места.
+"""
+import argparse, asyncio, json, os, sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api"))
+
+import compact
+from logs import setup_logging
+from storage import create_storage
+from wa_numbers import NUMBERS
+
+
+def _days(day_from, day_to):
+    start = datetime.strptime(day_from, "%Y-%m-%d")
+    end = datetime.strptime(day_to or day_from, "%Y-%m-%d")
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days + 1)]
+
+
+async def main_async(args):
+    store = create_storage()
+    if store is None:
+        raise SystemExit("❌ хранилище не настроено (UPSTASH_REDIS_REST_URL / REDIS_URL)")
+    try:
+        archive = compact.DirArchive(args.archive_dir) if args.archive_dir else compact.create_archive(store)
+        if args.cmd == "run":
+            report = await compact.compact(store, archive, args.days, args.batch, args.budget,
+                                           namespaces=[n.namespace for n in NUMBERS.values()])
+            o, c = report["orders"], report["contacts"]
+            print(f"📦 {archive.name}: в архив {o['archived']} заказов ({', '.join(o['days']) or '—'}), "
+                  f"висячих ссылок убрано {o['dangling']}")
+            print(f"👥 контактов проверено {c['scanned']}, убрано истёкших {c['removed']}")
+            if not (o["done"] and c["done"]):
+                print("⏸ не уложились в бюджет — запустите ещё раз")
+        elif args.cmd == "days":
+            for day in await archive.days():
+                print(day)
+        elif args.cmd == "export":
+            for day in _days(args.day, args.to):
+                for order in await archive.read(day):
+                    print(json.dumps(order, ensure_ascii=False))
+        elif args.cmd == "stats":
+            row = compact.daily_counters(await archive.read(args.day))
+            print(json.dumps(row, ensure_ascii=False, indent=2, sort_keys=True))
+        elif args.cmd == "summarize":
+            for day in args.day or await archive.days():
+                row = await compact.summarize_day(store, archive, day)
+                print(f"{day}: заказов {row.get('orders', 0)}")
+    finally:
+        await store.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--archive-dir", help="каталог архива (по умолчанию ARCHIVE_DIR или Redis)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run")
+    r.add_argument("--days", type=int, default=compact.ARCHIVE_AFTER_DAYS, help="архивировать заказы старше N дней")
+    r.add_argument("--batch", type=int, default=compact.COMPACT_BATCH)
+    r.add_argument("--budget", type=float, help="секунд на прогон (по умолчанию — до конца)")
+    sub.add_parser("days")
+    e = sub.add_parser("export")
+    e.add_argument("day")
+    e.add_argument("--to")
+    s = sub.add_parser("stats")
+    s.add_argument("day")
+    sub.add_parser("summarize").add_argument("day", nargs="*")
+    args = ap.parse_args()
+    setup_logging()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+🔄 Сверка заказов с CRM (логика — api/crm_sync.py)
+
+    python crm_sync.py once                 # один опрос: очередь, статусы, повторная отправка
+    python crm_sync.py worker [--interval 60]
+    python crm_sync.py show UUID            # что сверка знает о заказе
+
+Ctrl+C в worker — дождаться конца текущего опроса и выйти.
+"""
+import argparse, asyncio, json, os, signal, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api"))
+
+import crm_sync
+from crm import close_crm_http
+from logs import setup_logging
+from storage import create_storage
+
+
+async def main_async(args):
+    store = create_storage()
+    if store is None:
+        raise SystemExit("❌ хранилище не настроено (UPSTASH_REDIS_REST_URL / REDIS_URL)")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        if args.cmd == "once":
+            print(json.dumps(await crm_sync.sync_once(store), ensure_ascii=False, indent=2))
+        elif args.cmd == "worker":
+            await crm_sync.worker(store, stop=stop, interval=args.interval)
+        elif args.cmd == "show":
+            track = await store.execute("HGETALL", f"crm:track:{args.uuid}")
+            if not track:
+                raise SystemExit(f"❌ нет заказа {args.uuid} (или истёк)")
+            track.pop("order", None)
+            print(json.dumps(track, ensure_ascii=False, indent=2))
+    finally:
+        await close_crm_http()
+        await store.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("once")
+    w = sub.add_parser("worker")
+    w.add_argument("--interval", type=float, default=crm_sync.CRM_SYNC_INTERVAL, help="секунд между опросами")
+    s = sub.add_parser("show")
+    s.add_argument("uuid")
+    args = ap.parse_args()
+    setup_logging()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
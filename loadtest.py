@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+📈 Нагрузочный тест бота без сети: моки Graph/Telegram/CRM/Upstash + сценарии разговоров.
+
+    python loadtest.py                                  # in-process, 20 клиентов
+    python loadtest.py --users 100 --iterations 3 --latency graph=80,upstash=10
+    python loadtest.py --mode uvicorn --workers 4       # бот под uvicorn в отдельном процессе
+
+Сначала один клиент проходит каждый сценарий последовательно — так считаются
+внешние вызовы на шаг. Затем --users клиентов гоняют сценарии параллельно —
+пропускная способность и p50/p95/p99 по шагам.
+"""
+import argparse, asyncio, json, os, subprocess, sys, time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+import httpx
+
+from mock_services import MockServer, env_for, free_port, parse_latency
+
+# (тип, значение): text — набранный текст, button/list — id нажатой кнопки/строки
+SCENARIOS = {
+    "browse": [
+        ("text", "привет"), ("button", "lang_ru"), ("button", "btn_menu"),
+        ("list", "cat_burgers"), ("list", "add_b1_beef"), ("list", "cat_drinks"),
+        ("list", "add_dr2_1"), ("button", "btn_cart"),
+    ],
+    "text_order": [
+        ("text", "привет"), ("button", "lang_ru"),
+        ("text", "2 сырных говяжьих и колу"), ("button", "toc_yes"), ("button", "btn_cart"),
+    ],
+    "checkout": [
+        ("text", "привет"), ("button", "lang_ru"), ("button", "btn_menu"),
+        ("list", "cat_burgers"), ("list", "add_b1_beef"), ("list", "add_b2_chkn"),
+        ("button", "checkout"), ("text", "Жамбыла 120, кв 15"), ("text", "+7 701 555 44 33"),
+        ("button", "pay_cash"), ("button", "cm_none"), ("button", "confirm_yes"),
+    ],
+}
+
+
+def make_payload(phone, kind, value, seq, phone_number_id="929651966907277"):
+    msg = {"from": phone, "id": f"wamid.lt.{phone}.{seq}", "timestamp": str(int(time.time())), "type": "text"}
+    if kind == "text":
+        msg["text"] = {"body": value}
+    else:
+        reply_type = "button_reply" if kind == "button" else "list_reply"
+        msg["type"] = "interactive"
+        msg["interactive"] = {"type": reply_type, reply_type: {"id": value, "title": value}}
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "lt", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "77000000000", "phone_number_id": phone_number_id},
+            "contacts": [{"profile": {"name": f"LT {phone[-4:]}"}, "wa_id": phone}],
+            "messages": [msg],
+        }}]}],
+    }
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class BotTarget:
+    """Куда слать вебхуки: app в этом процессе или uvicorn-подпроцесс"""
+
+    def __init__(self, mode, workers, env):
+        self.mode, self.workers, self.env = mode, workers, env
+        self.proc = None
+        self.client = None
+
+    async def __aenter__(self):
+        if self.mode == "inprocess":
+            os.environ.update(self.env)
+            import api.index as idx
+            self.idx = idx
+            self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=idx.app),
+                                            base_url="http://bot", timeout=60)
+        else:
+            port = free_port()
+            self.proc = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "api.index:app", "--host", "127.0.0.1",
+                 "--port", str(port), "--workers", str(self.workers), "--log-level", "warning"],
+                cwd=ROOT, env={**os.environ, **self.env})
+            self.client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60,
+                                            limits=httpx.Limits(max_connections=200))
+            for _ in range(200):
+                try:
+                    if (await self.client.get("/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.05)
+            else:
+                raise RuntimeError("bot did not start")
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        if self.mode == "inprocess":
+            await self.idx.close_clients()
+        if self.proc:
+            self.proc.terminate()
+            self.proc.wait(timeout=10)
+
+    async def send(self, payload):
+        r = await self.client.post("/webhook", json=payload)
+        r.raise_for_status()
+
+
+async def run_conversation(target, phone, scenario, latencies, seq_start=0):
+    for i, (kind, value) in enumerate(SCENARIOS[scenario]):
+        start = time.perf_counter()
+        await target.send(make_payload(phone, kind, value, seq_start + i))
+        latencies[(scenario, i)].append((time.perf_counter() - start) * 1000)
+
+
+async def calibrate(target, mock, scenarios):
+    """Один клиент, последовательно: внешние вызовы на каждый шаг"""
+    calls = {}
+    for n, scenario in enumerate(scenarios):
+        phone = f"7799{n:07d}"
+        for i, (kind, value) in enumerate(SCENARIOS[scenario]):
+            before = mock.state.snapshot()
+            await target.send(make_payload(phone, kind, value, i))
+            after = mock.state.snapshot()
+            calls[(scenario, i)] = {
+                s: {k: after[s].get(k, 0) - before[s].get(k, 0) for k in ("calls", "commands", "bytes_in", "bytes_out")}
+                for s in after
+            }
+    return calls
+
+
+async def load(target, scenarios, users, iterations):
+    latencies = defaultdict(list)
+
+    async def user(u):
+        phone = f"7700{u:07d}"
+        for it in range(iterations):
+            for scenario in scenarios:
+                await run_conversation(target, phone, scenario, latencies, seq_start=it * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(u) for u in range(users)))
+    return latencies, time.perf_counter() - start
+
+
+def report(scenarios, calls, latencies, elapsed, as_json=False):
+    total_msgs = sum(len(v) for v in latencies.values())
+    rows = []
+    for scenario in scenarios:
+        for i, (kind, value) in enumerate(SCENARIOS[scenario]):
+            lat = latencies.get((scenario, i), [])
+            c = calls.get((scenario, i), {})
+            rows.append({
+                "scenario": scenario, "step": i, "input": value, "n": len(lat),
+                "p50_ms": round(percentile(lat, 50), 2), "p95_ms": round(percentile(lat, 95), 2),
+                "p99_ms": round(percentile(lat, 99), 2),
+                "graph": c.get("graph", {}).get("calls", 0),
+                "redis_http": c.get("upstash", {}).get("calls", 0),
+                "redis_cmds": c.get("upstash", {}).get("commands", 0),
+                "crm": c.get("crm", {}).get("calls", 0),
+                "telegram": c.get("telegram", {}).get("calls", 0),
+            })
+    summary = {
+        "messages": total_msgs, "elapsed_s": round(elapsed, 2),
+        "throughput_msg_s": round(total_msgs / elapsed, 1) if elapsed else 0,
+        "external_http_per_msg": round(
+            sum(r["graph"] + r["redis_http"] + r["crm"] + r["telegram"] for r in rows) / max(1, len(rows)), 2),
+    }
+    if as_json:
+        print(json.dumps({"summary": summary, "steps": rows}, ensure_ascii=False, indent=2))
+        return
+    print(f"\n{'scenario':<11}{'#':>3} {'input':<26}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}"
+          f"{'graph':>7}{'r.http':>7}{'r.cmd':>7}{'crm':>5}{'tg':>4}")
+    for r in rows:
+        print(f"{r['scenario']:<11}{r['step']:>3} {r['input'][:25]:<26}{r['n']:>6}{r['p50_ms']:>9.1f}"
+              f"{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['graph']:>7}{r['redis_http']:>7}"
+              f"{r['redis_cmds']:>7}{r['crm']:>5}{r['telegram']:>4}")
+    print(f"\n💬 {summary['messages']} сообщений за {summary['elapsed_s']} с → "
+          f"{summary['throughput_msg_s']} msg/s, внешних HTTP на сообщение: {summary['external_http_per_msg']}")
+
+
+async def main_async(args):
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    for s in scenarios:
+        if s not in SCENARIOS:
+            raise SystemExit(f"неизвестный сценарий: {s} (есть: {', '.join(SCENARIOS)})")
+    with MockServer(latency_ms=parse_latency(args.latency)) as mock:
+        # Виртуальные клиенты жмут кнопки без пауз — лимитер на номер здесь только мешает
+        env = {**env_for(mock.url), "LOG_LEVEL": "WARNING", "STORAGE_BACKEND": args.storage,
+               "RATE_LIMIT": os.environ.get("RATE_LIMIT", "0")}
+        async with BotTarget(args.mode, args.workers, env) as target:
+            calls = await calibrate(target, mock, scenarios)
+            latencies, elapsed = await load(target, scenarios, args.users, args.iterations)
+    report(scenarios, calls, latencies, elapsed, args.json)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=20, help="параллельных клиентов")
+    ap.add_argument("--iterations", type=int, default=1, help="прогонов сценариев на клиента")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess")
+    ap.add_argument("--workers", type=int, default=1, help="воркеров uvicorn (--mode uvicorn)")
+    ap.add_argument("--storage", choices=("upstash", "memory"), default="upstash",
+                    help="upstash — мок Upstash REST, memory — хранилище в памяти бота")
+    ap.add_argument("--latency", default="", help="задержка моков в мс: graph=80,upstash=15")
+    ap.add_argument("--json", action="store_true")
+    asyncio.run(main_async(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
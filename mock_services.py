@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+🧪 Локальные моки внешних сервисов: Graph API, Telegram, CRM DelRes, Upstash REST
+Один сервер, сервис определяется префиксом пути. Redis — api.memredis.MemoryRedis.
+
+    python mock_services.py --port 8900 --latency graph=80,upstash=15
+
+Переменные для бота:
+    GRAPH_API_URL=http://127.0.0.1:8900/graph/v22.0
+    TELEGRAM_API_URL=http://127.0.0.1:8900/telegram
+    CRM_BASE_URL=http://127.0.0.1:8900/crm/api/v1
+    CRM_ORDERS_URL=http://127.0.0.1:8900/crm/api/orders
+    UPSTASH_REDIS_REST_URL=http://127.0.0.1:8900/upstash
+
+GET /_stats — счётчики вызовов/байт по сервисам, POST /_reset — обнулить.
+"""
+import argparse, asyncio, base64, itertools, json, os, socket, sys, threading, time, zlib
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+from api.memredis import MemoryRedis, RedisError
+import api.storage  # noqa: F401 — регистрирует python-аналоги Lua-скриптов для EVAL
+
+SERVICES = ("graph", "telegram", "crm", "upstash")
+
+
+class MockState:
+    def __init__(self, latency_ms=None):
+        self.redis = MemoryRedis()
+        self.latency_ms = dict(latency_ms or {})
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.sent = []           # последние исходящие WhatsApp-сообщения (для сценариев)
+        self.crm_orders = []
+        self.graph_errors = {}   # номер (или "*" — все) → (HTTP-статус, код ошибки Graph) для сценариев с отказами
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {s: defaultdict(int) for s in SERVICES}
+            self.sent.clear()
+
+    def record(self, service, bytes_in, bytes_out, commands=0):
+        with self.lock:
+            st = self.stats[service]
+            st["calls"] += 1
+            st["bytes_in"] += bytes_in
+            st["bytes_out"] += bytes_out
+            if commands:
+                st["commands"] += commands
+
+    def snapshot(self):
+        with self.lock:
+            return {s: dict(v) for s, v in self.stats.items()}
+
+
+def _b64(value):
+    if isinstance(value, str):
+        return "OK" if value == "OK" else base64.b64encode(value.encode()).decode()
+    if isinstance(value, list):
+        return [_b64(v) for v in value]
+    return value
+
+
+def _upstash_result(state, command, encode):
+    try:
+        result = state.redis.execute(command)
+        return {"result": _b64(result) if encode else result}
+    except RedisError as e:
+        return {"error": str(e)}
+
+
+def create_app(state):
+    app = FastAPI(title="mock services", openapi_url=None, docs_url=None, redoc_url=None)
+
+    async def delay(service):
+        ms = state.latency_ms.get(service)
+        if ms:
+            await asyncio.sleep(ms / 1000)
+
+    def reply(service, raw, payload, commands=0, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        state.record(service, len(raw), len(body), commands)
+        return JSONResponse(content=payload, status_code=status)
+
+    @app.post("/graph/{version}/{phone_id}/messages")
+    async def graph_send(phone_id: str, request: Request):
+        raw = await request.body()
+        await delay("graph")
+        msg = json.loads(raw or b"{}")
+        error = state.graph_errors.get(msg.get("to")) or state.graph_errors.get("*")
+        if error:
+            status, code = error
+            return reply("graph", raw, {"error": {"message": "mock error", "code": code}}, status=status)
+        wamid = f"wamid.mock{next(state.ids)}"
+        with state.lock:
+            state.sent.append({"phone_id": phone_id, "id": wamid, **msg})
+            del state.sent[:-1000]
+        return reply("graph", raw, {"messaging_product": "whatsapp",
+                                    "contacts": [{"wa_id": msg.get("to")}],
+                                    "messages": [{"id": wamid}]})
+
+    @app.get("/graph/{path:path}")
+    async def graph_get(path: str, request: Request):
+        await delay("graph")
+        return reply("graph", b"", {"error": {"message": "mock", "code": 100}}, status=400)
+
+    @app.post("/telegram/{bot}/sendMessage")
+    async def telegram_send(bot: str, request: Request):
+        raw = await request.body()
+        await delay("telegram")
+        return reply("telegram", raw, {"ok": True, "result": {"message_id": next(state.ids)}})
+
+    @app.post("/crm/api/v1/order/orders")
+    async def crm_create(request: Request):
+        raw = await request.body()
+        await delay("crm")
+        order = json.loads(raw or b"{}")
+        order["id"] = 100000 + next(state.ids)
+        order.setdefault("status", "new")
+        with state.lock:
+            state.crm_orders.append(order)
+        return reply("crm", raw, {"success": True, "data": {"id": order["id"]}}, status=201)
+
+    @app.get("/crm/api/orders")
+    async def crm_list(request: Request, start_date: str = "", end_date: str = "",
+                       per_page: int = 15, page: int = 1):
+        # Как у DelRes: фильтр по дате заказа, пагинация Laravel, ETag страницы
+        await delay("crm")
+        with state.lock:
+            rows = [o for o in reversed(state.crm_orders)
+                    if start_date <= o.get("date", "")[:10] <= (end_date or "9999")]
+        items = rows[(page - 1) * per_page:page * per_page]
+        etag = '"%x"' % zlib.crc32(json.dumps(items, sort_keys=True, default=str).encode())
+        if request.headers.get("if-none-match") == etag:
+            state.record("crm", 0, 0)
+            return Response(status_code=304, headers={"ETag": etag})
+        response = reply("crm", b"", {"data": items, "current_page": page, "per_page": per_page,
+                                      "total": len(rows), "last_page": max(1, -(-len(rows) // per_page))})
+        response.headers["ETag"] = etag
+        return response
+
+    @app.post("/crm/api/_status/{uuid}")
+    async def crm_set_status(uuid: str, status: str):
+        with state.lock:
+            for o in state.crm_orders:
+                if o.get("uuid") == uuid:
+                    o["status"] = status
+                    return {"ok": True}
+        return JSONResponse(content={"ok": False}, status_code=404)
+
+    @app.post("/upstash")
+    @app.post("/upstash/")
+    async def upstash_one(request: Request):
+        raw = await request.body()
+        await delay("upstash")
+        encode = request.headers.get("upstash-encoding") == "base64"
+        return reply("upstash", raw, _upstash_result(state, json.loads(raw), encode), commands=1)
+
+    @app.post("/upstash/pipeline")
+    @app.post("/upstash/multi-exec")
+    async def upstash_pipeline(request: Request):
+        raw = await request.body()
+        await delay("upstash")
+        encode = request.headers.get("upstash-encoding") == "base64"
+        commands = json.loads(raw)
+        return reply("upstash", raw, [_upstash_result(state, c, encode) for c in commands],
+                     commands=len(commands))
+
+    @app.get("/_stats")
+    async def stats():
+        return state.snapshot()
+
+    @app.get("/_sent")
+    async def sent(limit: int = 50):
+        with state.lock:
+            return state.sent[-limit:]
+
+    @app.post("/_reset")
+    async def reset(flush: bool = False):
+        state.reset()
+        if flush:
+            state.redis.flushall()
+        return {"ok": True}
+
+    return app
+
+
+def env_for(base_url):
+    """Переменные окружения бота, направляющие все внешние вызовы в моки"""
+    return {
+        "GRAPH_API_URL": f"{base_url}/graph/v22.0",
+        "TELEGRAM_API_URL": f"{base_url}/telegram",
+        "CRM_BASE_URL": f"{base_url}/crm/api/v1",
+        "CRM_ORDERS_URL": f"{base_url}/crm/api/orders",
+        "UPSTASH_REDIS_REST_URL": f"{base_url}/upstash",
+        "UPSTASH_REDIS_REST_TOKEN": "mock",
+        "WHATSAPP_TOKEN": "mock",
+        "TELEGRAM_BOT_TOKEN": "1:mock",
+        "TELEGRAM_CHAT_ID": "1",
+        "CRM_TOKEN": "mock",
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class MockServer:
+    """Запуск моков под uvicorn в фоновом потоке: with MockServer() as m: m.url"""
+
+    def __init__(self, port=None, latency_ms=None):
+        self.port = port or free_port()
+        self.state = MockState(latency_ms)
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        import uvicorn
+        config = uvicorn.Config(create_app(self.state), host="127.0.0.1", port=self.port,
+                                log_level="warning", access_log=False)
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.time() + 10
+        while not self._server.started:
+            if time.time() > deadline:
+                raise RuntimeError("mock server did not start")
+            time.sleep(0.02)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def parse_latency(spec):
+    out = {}
+    for part in filter(None, (spec or "").split(",")):
+        name, _, ms = part.partition("=")
+        out[name.strip()] = float(ms)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8900)
+    ap.add_argument("--latency", default="", help="задержка по сервисам в мс: graph=80,upstash=15")
+    args = ap.parse_args()
+    import uvicorn
+    state = MockState(parse_latency(args.latency))
+    for k, v in env_for(f"http://127.0.0.1:{args.port}").items():
+        print(f"{k}={v}")
+    uvicorn.run(create_app(state), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
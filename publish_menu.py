@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+📋 Публикация меню без редеплоя
+
+    python publish_menu.py --export menu.json   # выгрузить встроенное меню для правки
+    python publish_menu.py menu.json            # проверить и опубликовать в Redis
+    python publish_menu.py --check menu.json    # только проверить
+    python publish_menu.py --reset              # вернуться к меню из api/config.py
+
+Инстансы подхватывают новую версию в течение MENU_CHECK_INTERVAL секунд.
+Для MENU_SOURCE=file достаточно заменить файл MENU_FILE (атомарно: mv).
+"""
+import argparse, asyncio, json, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api"))
+
+import menu
+from storage import create_storage
+
+
+async def main_async(args):
+    if args.export:
+        with open(args.export, "w", encoding="utf-8") as f:
+            json.dump(menu.builtin_document(), f, ensure_ascii=False, indent=2)
+        print(f"✅ {args.export}")
+        return
+
+    store = create_storage()
+    if store is None and not args.check:
+        raise SystemExit("❌ хранилище не настроено (UPSTASH_REDIS_REST_URL / REDIS_URL)")
+    try:
+        if args.reset:
+            await store.pipeline([["DEL", menu.DOC_KEY], ["DEL", menu.VERSION_KEY]])
+            print("✅ меню сброшено на встроенное")
+            return
+        with open(args.file, encoding="utf-8") as f:
+            doc = json.load(f)
+        m = menu.build_menu(json.loads(json.dumps(doc)), "check")
+        print(f"📋 {len(m.categories)} категорий, {len(m.items)} позиций, "
+              f"{len(m.variants_by_id)} вариантов, {len(m.aliases)} алиасов")
+        if args.check:
+            return
+        version = await menu.publish(store, doc)
+        print(f"✅ опубликовано: версия {version}")
+    finally:
+        if store is not None:
+            await store.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("file", nargs="?")
+    ap.add_argument("--export", metavar="FILE")
+    ap.add_argument("--check", action="store_true")
+    ap.add_argument("--reset", action="store_true")
+    args = ap.parse_args()
+    if not (args.file or args.export or args.reset):
+        ap.error("нужен файл меню, --export или --reset")
+    try:
+        asyncio.run(main_async(args))
+    except ValueError as e:
+        raise SystemExit(f"❌ меню не прошло проверку: {e}")
+
+
+if __name__ == "__main__":
+    main()
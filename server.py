@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+🖥 Бот на своём сервере (тот же api/index.py, что и на Vercel)
+
+    python server.py                            # 0.0.0.0:8000, воркеров — по числу CPU
+    python server.py --port 8080 --workers 4 --env-file .env
+    python server.py --no-cron                  # кроны шлёт внешний планировщик
+
+Отличия от Vercel закрыты здесь:
+  • переменные — из окружения и --env-file (формат .env.example; уже заданные не трогаются);
+  • кроны из vercel.json выполняет планировщик внутри воркеров (api/cron.py),
+    один раз на минуту для всех воркеров и машин — через блокировку в Redis;
+  • SIGTERM/Ctrl+C: воркер перестаёт принимать запросы, дожидается текущих,
+    дописывает фоновые задачи, очередь CRM и сессии (SHUTDOWN_DRAIN_TIMEOUT) и закрывает пулы.
+uvloop и httptools (requirements-server.txt) берутся, если установлены.
+Хранилище — Redis/Upstash: MemoryRedis у каждого воркера своя.
+"""
+import argparse, importlib.util, os
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_env_file(path):
+    """KEY=VALUE по строке, # — комментарий; уже заданные переменные окружения главнее"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, _, value = line.partition("=")
+            key, value = key.strip().removeprefix("export "), value.strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+                value = value[1:-1]
+            os.environ.setdefault(key, value)
+
+
+def _have(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    ap.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1)
+    ap.add_argument("--env-file", help="файл переменных (.env)")
+    ap.add_argument("--no-cron", action="store_true", help="не выполнять кроны из vercel.json")
+    ap.add_argument("--log-level", default="warning", help="уровень логов uvicorn (бота — LOG_LEVEL)")
+    args = ap.parse_args()
+
+    if args.env_file:
+        load_env_file(args.env_file)
+    os.environ["CRON_SCHEDULER"] = "0" if args.no_cron else os.environ.get("CRON_SCHEDULER", "1")
+    if os.getenv("STORAGE_BACKEND") == "memory" and args.workers > 1:
+        print("⚠️  STORAGE_BACKEND=memory: у каждого воркера свои сессии — для прода нужен Redis")
+    drain = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "10"))
+
+    import uvicorn
+    os.chdir(ROOT)
+    uvicorn.run(
+        "api.index:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="uvloop" if _have("uvloop") else "asyncio",
+        http="httptools" if _have("httptools") else "h11",
+        # Прокси (nginx, Caddy) передаёт адрес клиента в X-Forwarded-For
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        # Ждать текущие запросы, затем lifespan дописывает фоновые задачи
+        timeout_graceful_shutdown=drain,
+        timeout_keep_alive=30,
+        log_level=args.log_level,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""Общее для тестов: моки внешних сервисов (mock_services.py) и окружение бота
+против них. Ставится в pytest_configure — до первого импорта api.config"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import call_budget  # noqa: E402
+from mock_services import MockServer  # noqa: E402
+
+_mock = MockServer()
+
+
+def pytest_configure(config):
+    _mock.__enter__()
+    os.environ.update(call_budget.bot_env(_mock.url))
+
+
+def pytest_unconfigure(config):
+    if _mock._server is not None:
+        _mock.__exit__(None, None, None)
+
+
+@pytest.fixture
+def mock_services():
+    return _mock
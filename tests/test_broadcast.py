@@ -0,0 +1,80 @@
+"""Рассылка при отказе Graph (api/broadcast.py) против mock_services: разомкнутый
+автомат ставит задание на паузу, а не записывает получателям ошибку"""
+
+import asyncio
+import time
+
+from api import broadcast, wa_numbers
+from api.breaker import Breaker
+from api.storage import MemoryStorage
+from mock_services import MockServer
+
+PHONES = [f"7701{i:07d}" for i in range(150)]
+
+
+def _number(mock):
+    number = wa_numbers.Number("555", "mock", name="bc-test")
+    number.url = f"{mock.url}/graph/v22.0/555/messages"
+    # Короткое остывание и низкий порог — автомат размыкается с первых отказов
+    number.breaker = Breaker("graph:bc-test", failure_rate=0.1, cooldown=0.5)
+    return number
+
+
+async def _wait_for(check, timeout=15):
+    deadline = time.monotonic() + timeout
+    while not await check():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def _scenario(mock, number):
+    store = MemoryStorage()
+    await store.execute("SADD", "contacts:all", *PHONES)
+    job_id = await broadcast.create_job(store, {"type": "text", "text": "🔥"}, rate=1000, concurrency=4,
+                                        enqueue=True, number=number.phone_id)
+    stop = asyncio.Event()
+    worker = asyncio.create_task(broadcast.worker(store, stop=stop, poll=0.05))
+    try:
+        async def some_sent():
+            return len(mock.state.sent) >= 120
+
+        async def paused():
+            return (await broadcast.job_status(store, job_id))["status"] == "paused"
+
+        async def done():
+            return (await broadcast.job_status(store, job_id))["status"] == "done"
+
+        # Graph падает на второй странице (по 100) и поднимается, пока задание стоит на паузе
+        await _wait_for(some_sent)
+        mock.state.graph_errors["*"] = (503, 2)
+        await _wait_for(paused)
+        on_pause = await broadcast.job_status(store, job_id), await broadcast.job_outcomes(store, job_id)
+        mock.state.graph_errors.clear()
+        await _wait_for(done)
+    finally:
+        mock.state.graph_errors.clear()
+        stop.set()
+        await worker
+        await number.aclose()
+    return on_pause, await broadcast.job_status(store, job_id), await broadcast.job_outcomes(store, job_id)
+
+
+def test_open_breaker_pauses_and_resumes(monkeypatch):
+    with MockServer() as mock:
+        number = _number(mock)
+        # Воркер берёт номер задания из реестра
+        monkeypatch.setitem(wa_numbers.NUMBERS, number.phone_id, number)
+        (paused, paused_outcomes), job, outcomes = asyncio.run(_scenario(mock, number))
+        delivered = {m["to"] for m in mock.state.sent}
+
+    # На паузе: получателям без отправки итог не записан, ошибок нет
+    assert paused["resume_at"] > 0
+    # Курсор — начало прерванной страницы, а не за ней
+    assert paused["cursor"] != 0
+    assert paused["failed"] == 0 and 0 < paused["sent"] < len(PHONES)
+    assert set(paused_outcomes.values()) == {"s"} and len(paused_outcomes) == paused["sent"]
+
+    assert job["status"] == "done"
+    assert (job["sent"], job["failed"], job["matched"]) == (len(PHONES), 0, len(PHONES))
+    assert outcomes == {p: "s" for p in PHONES}
+    assert delivered == set(PHONES)
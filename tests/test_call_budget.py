@@ -0,0 +1,12 @@
+"""Бюджет внешних вызовов на шаг диалога (call_budget.json): шаг, которому
+понадобился лишний вызов Redis/Graph/CRM/Telegram, роняет тест"""
+
+import asyncio
+
+import call_budget
+
+
+def test_steps_within_budget(mock_services):
+    measured = asyncio.run(call_budget.measure_with(mock_services))
+    over, _ = call_budget.compare(measured, call_budget.load_budget())
+    assert not over, "\n".join(over + ["вызовы добавлены намеренно — python call_budget.py --update"])
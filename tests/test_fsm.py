@@ -0,0 +1,203 @@
+"""Таблица переходов (api/fsm.py) и переходы бота (api/index.py) без Graph:
+send_* подменены, переход вызывается через fsm.dispatch на сессии-словаре"""
+
+import asyncio
+
+import pytest
+
+from api.fsm import ANY, Router
+
+
+# ------------------------------------------
+# порядок поиска
+# ------------------------------------------
+
+def _router():
+    fsm = Router()
+
+    def handler(name):
+        async def fn(*args):
+            pass
+        fn.__name__ = name
+        return fn
+
+    fsm.on("стоп", kind="cmd", to="new")(handler("cmd_stop"))
+    fsm.on("x", state="s", to="t")(handler("s_id"))
+    fsm.on("p_", state="s", kind="prefix", to="t")(handler("s_prefix"))
+    fsm.on(state="m", kind="any", modal=True, to="m")(handler("m_modal"))
+    fsm.on("x", "g")(handler("g_id"))
+    fsm.on("p_", kind="prefix")(handler("g_prefix"))
+    fsm.on(state="s", kind="any", to="t")(handler("s_any"))
+    fsm.on(kind="any", to="main")(handler("g_any"))
+    fsm.alias("g", "корзина")
+    return fsm
+
+
+@pytest.mark.parametrize("state, text, name, arg", [
+    # 1. глобальная команда — в любом состоянии, без регистра и пробелов
+    ("s", " Стоп ", "cmd_stop", "стоп"),
+    ("m", "стоп", "cmd_stop", "стоп"),
+    # 2. кнопки шага раньше глобальных
+    ("s", "x", "s_id", "x"),
+    ("s", "p_42", "s_prefix", "42"),
+    # 3. modal any шага перехватывает глобальные кнопки
+    ("m", "x", "m_modal", "x"),
+    ("m", "p_42", "m_modal", "p_42"),
+    # 4. глобальные кнопки и синонимы — раньше свободного текста шага
+    ("other", "x", "g_id", "x"),
+    ("other", "p_42", "g_prefix", "42"),
+    ("s", "g", "g_id", "g"),
+    ("s", "Корзина", "g_id", "g"),
+    # 5. свободный текст шага
+    ("s", "привет", "s_any", "привет"),
+    # 6. по умолчанию
+    ("other", "привет", "g_any", "привет"),
+])
+def test_resolution_order(state, text, name, arg):
+    tr, got = _router().resolve(state, text)
+    assert (tr.name, got) == (name, arg)
+
+
+def test_no_transition():
+    fsm = Router()
+    assert fsm.resolve("s", "x") == (None, "x")
+    assert asyncio.run(fsm.dispatch("s", "x")) is None
+
+
+def test_registration_errors():
+    fsm = _router()
+
+    async def fn(*args):
+        pass
+    with pytest.raises(ValueError, match="duplicate"):
+        fsm.on("x", state="s")(fn)
+    with pytest.raises(ValueError, match="prefix"):
+        fsm.on("p", kind="prefix")
+    with pytest.raises(ValueError, match="kind"):
+        fsm.on("x", kind="regex")
+
+
+def test_dispatch_counts_calls_and_errors():
+    fsm = Router()
+    seen = []
+
+    @fsm.on("ok_", kind="prefix")
+    async def ok(who, arg):
+        seen.append((who, arg))
+
+    @fsm.on("boom")
+    async def boom(who, arg):
+        raise RuntimeError(arg)
+
+    tr = asyncio.run(fsm.dispatch("s", "ok_7", "me"))
+    assert seen == [("me", "7")] and tr.calls == 1 and tr.errors == 0
+    with pytest.raises(RuntimeError):
+        asyncio.run(fsm.dispatch("s", "boom", "me"))
+    info = {t["name"]: t for t in fsm.describe()["transitions"]}
+    assert (info["boom"]["calls"], info["boom"]["errors"]) == (1, 1)
+    fsm.reset_stats()
+    assert all(t.calls == t.errors == 0 for t in fsm.transitions())
+
+
+def test_describe_and_dot():
+    fsm = _router()
+    info = fsm.describe()
+    assert info["aliases"] == {"корзина": "g"}
+    rows = {(t["state"], t["kind"], t["key"]): t for t in info["transitions"]}
+    assert rows[("s", "prefix", "p_")]["name"] == "s_prefix"
+    assert rows[("m", "any", None)]["modal"] is True
+    assert rows[(ANY, "cmd", "стоп")]["to"] == ["new"]
+
+    dot = fsm.to_dot()
+    assert dot.startswith("digraph fsm {") and dot.endswith("}")
+    assert '"s" -> "t" [label="x"];' in dot
+    assert '"*" -> "new" [label="стоп", style=dashed];' in dot
+    # Переход без to — петля на своё состояние
+    assert '"*" -> "*" [label="g"];' in dot
+
+
+# ------------------------------------------
+# переходы бота
+# ------------------------------------------
+
+@pytest.fixture
+def bot(monkeypatch):
+    from api import index
+
+    sent = []
+
+    async def send_text(to, text):
+        sent.append(("text", text))
+
+    async def send_buttons(to, text, buttons):
+        sent.append(("buttons", text, [b["id"] for b in buttons]))
+
+    async def send_list(to, text, btn_text, sections):
+        sent.append(("list", text, [r["id"] for sec in sections for r in sec["rows"]]))
+
+    for name, fn in (("send_text", send_text), ("send_buttons", send_buttons), ("send_list", send_list)):
+        monkeypatch.setattr(index, name, fn)
+    return index, sent
+
+
+def _step(bot, s, text):
+    """Один переход → (переход, отправленное); состояние после него — из to перехода (или прежнее)"""
+    index, sent = bot
+    sent.clear()
+    before = s["state"]
+    tr = asyncio.run(index.fsm.dispatch(before, text, s["phone"], s))
+    assert s["state"] in (tr.to or (before,)), f"{tr.name}: {before} → {s['state']} not in {tr.to}"
+    return tr, list(sent)
+
+
+def _session(bot, phone):
+    return bot[0].new_session(phone)
+
+
+def test_greeting_and_language(bot):
+    s = _session(bot, "77000000001")
+    tr, sent = _step(bot, s, "что угодно")
+    assert tr.name == "on_greet" and s["state"] == "choose_lang"
+    assert sent[0][0] == "buttons" and sent[0][2] == ["lang_ru", "lang_kz"]
+
+    tr, sent = _step(bot, s, "lang_kz")
+    assert tr.name == "on_lang" and s["lang"] == "kz" and s["state"] == "main"
+    assert sent
+
+
+def test_add_and_checkout(bot):
+    s = {**_session(bot, "77000000002"), "state": "main"}
+    tr, sent = _step(bot, s, "add_b1_beef")
+    assert tr.name == "on_add"
+    assert [(c["vid"], c["qty"]) for c in s["cart"]] == [("b1_beef", 1)]
+    assert "btn_cart" in sent[-1][2]
+
+    s["cart"][0]["qty"] = 10
+    tr, sent = _step(bot, s, "checkout")
+    assert tr.name == "on_checkout" and s["state"] == "ask_address"
+
+    tr, sent = _step(bot, s, "коротко")
+    assert tr.name == "on_address" and s["state"] == "ask_phone"
+    assert s["order"]["address"] == "коротко"
+
+
+def test_stop_resets_but_keeps_language(bot):
+    s = {**_session(bot, "77000000003"), "state": "ask_phone", "lang": "kz", "cart": [{"vid": "b1_beef"}]}
+    tr, sent = _step(bot, s, "СТОП")
+    assert tr.name == "on_stop"
+    assert (s["state"], s["lang"], s["cart"]) == ("new", "kz", [])
+    assert sent[0][0] == "text"
+
+
+@pytest.mark.parametrize("state, text, name", [
+    ("ask_address", "geo_42.9,71.37|", "on_location"),
+    ("main", "geo_42.9,71.37|", "on_location_elsewhere"),
+    ("ask_address", "same_0", "on_same_as_last"),
+    ("ask_address", "Абая 10", "on_address"),
+    ("ask_address", "btn_cart", "on_cart"),
+    ("choose_lang", "btn_cart", "on_greet"),
+    ("confirm", "меню", "on_menu"),
+    ("main", "отписаться", "on_unsubscribe"),
+])
+def test_bot_table(bot, state, text, name):
+    assert bot[0].fsm.resolve(state, text)[0].name == name
@@ -0,0 +1,55 @@
+"""Разбор адресов справочником улиц (api/gazetteer.py) и parse_address для CRM"""
+
+import pytest
+
+from api import gazetteer
+from api.crm import parse_address
+
+
+def _fields(address):
+    r = gazetteer.parse(address)
+    return r["street"], r["building"], r["room"]
+
+
+@pytest.mark.parametrize("address, street, building, room", [
+    # улица из справочника — с падежной формой и полями в любом порядке
+    ("Мангилик ел 24, кв 90", "ул. Мангилик Ел", "24", "90"),
+    ("кв 5, ул. Жайбекова 110", "пр. Жайбеков", "110", "5"),
+    ("мкр Жулдыз 12", "мкр Жулдыз", "12", None),
+    # номерные микрорайоны
+    ("5 микрорайон, дом 12", "5 мкр", "12", None),
+    ("12 мкр, 4 дом, кв 5", "12 мкр", "4", "5"),
+    ("мкр 5, д. 3", "5 мкр", "3", None),
+    # улицы нет в справочнике — прежний разбор по шаблону
+    ("Неизвестная 7, кв 3", "Неизвестная", "7", "3"),
+    ("кв 3 Неизвестная 7", "Неизвестная", "7", "3"),
+    ("д. 7, ул. Неизвестная", "ул. Неизвестная", "7", None),
+    ("где-то там", "где-то там", None, None),
+])
+def test_parse_shapes(address, street, building, room):
+    assert _fields(address) == (street, building, room)
+
+
+def test_postfix_fields():
+    r = gazetteer.parse("Абая 10, 3 этаж, подъезд 2")
+    assert (r["building"], r["floor"], r["entrance"]) == ("10", "3", "2")
+
+
+def test_resolved_has_zone():
+    r = gazetteer.parse("Жайбекова 110")
+    assert r["resolved"] and r["zone"] == "A" and r["fee"] == 700
+    assert r["lat"] is not None and r["lon"] is not None
+
+
+def test_unresolved_has_no_zone():
+    r = gazetteer.parse("12 мкр, 4 дом")
+    assert not r["resolved"] and r["zone"] is None and r["lat"] is None
+
+
+def test_locate_outside_rings():
+    assert gazetteer.locate(43.5, 72.5)["zone"] is None
+
+
+def test_crm_parse_address_keeps_street():
+    for address in ("5 микрорайон, дом 12", "12 мкр, 4 дом, кв 5", "Неизвестная 7"):
+        assert parse_address(address)["street"]
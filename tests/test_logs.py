@@ -0,0 +1,33 @@
+"""Маскировка телефонов и токенов в логах (api/logs.py)"""
+
+import pytest
+
+from api.logs import redact
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("from 77001234567", "from ***4567"),
+    ("phone +7 (701) 555-44-33 ok", "phone ***4433 ok"),
+    ("8 701 555 44 33", "***4433"),
+    ("session:77001234567:v", "session:***4567:v"),
+    ("wamid.lt.77990000001.3", "wamid.lt.***0001.3"),
+])
+def test_phones_masked(text, expected):
+    assert redact(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "2024-06-01 12:30",
+    "2024-06-01T12:30:45.123456",
+    "order #130844 total 12,990 тг",
+    "created 1792414983 ms 1792414983123",
+    "crm_id 100049, 3 items, 2990 + 700",
+    "stream id 1792414983123-0",
+])
+def test_timestamps_and_amounts_untouched(text):
+    assert redact(text) == text
+
+
+def test_secrets_masked():
+    assert redact("Authorization: Bearer abc.def") == "Authorization: Bearer ***"
+    assert redact("/bot123456:AAE-secret/sendMessage") == "/bot***/sendMessage"
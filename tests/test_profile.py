@@ -0,0 +1,30 @@
+"""Профиль клиента после заказа (api/storage.py merge_profile)"""
+
+from api.storage import PROFILE_ADDRESSES, merge_profile
+
+
+def _order(address, **extra):
+    return {"id": 1, "address": address, "contact_phone": "+7700", "payment": "Наличные",
+            "payment_id": "cash", "cart": [], **extra}
+
+
+def test_addresses_most_recent_first():
+    profile = merge_profile(None, _order("Абая 10"))
+    profile = merge_profile(profile, _order("Толе би 5"))
+    profile = merge_profile(profile, _order("Абая 10"))
+    assert profile["addresses"] == ["Абая 10", "Толе би 5"]
+    assert profile["orders"] == 3
+
+
+def test_geo_address_keeps_coordinates():
+    profile = merge_profile(None, _order("📍 42.90000, 71.37000", lat=42.9, lon=71.37, geo=True))
+    profile = merge_profile(profile, _order("Абая 10", lat=42.89, lon=71.39))
+    # Координаты справочника у текстового адреса не сохраняются — он разбирается заново
+    assert profile["coords"] == {"📍 42.90000, 71.37000": [42.9, 71.37]}
+
+
+def test_coordinates_dropped_with_address():
+    profile = merge_profile(None, _order("Офис", lat=42.9, lon=71.37, geo=True))
+    for i in range(PROFILE_ADDRESSES):
+        profile = merge_profile(profile, _order(f"Абая {i + 1}"))
+    assert "Офис" not in profile["addresses"] and profile["coords"] == {}